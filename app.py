@@ -31,6 +31,13 @@ def start_channel(channel_name: str):
                         "wechatcom_service", "gewechat", "web", const.FEISHU, const.DINGTALK]:
         PluginManager().load_plugins()
 
+    if conf().get("metrics_port"):
+        try:
+            from common.metrics import start_metrics_server
+            start_metrics_server(conf().get("metrics_host", "127.0.0.1"), conf().get("metrics_port"))
+        except Exception as e:
+            logger.warning("[metrics] start prometheus endpoint failed: {}".format(e))
+
     if conf().get("use_linkai"):
         try:
             from common import linkai_client
@@ -8,6 +8,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.token_manager import get_baidu_access_token, invalidate_baidu_access_token
 from config import conf
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
@@ -78,13 +79,6 @@ class BaiduWenxinBot(Bot):
         try:
             logger.info("[BAIDU] model={}".format(session.model))
             access_token = self.get_access_token()
-            if access_token == 'None':
-                logger.warn("[BAIDU] access token 获取失败")
-                return {
-                    "total_tokens": 0,
-                    "completion_tokens": 0,
-                    "content": 0,
-                    }
             url = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/" + session.model + "?access_token=" + access_token
             headers = {
                 'Content-Type': 'application/json'
@@ -93,6 +87,8 @@ class BaiduWenxinBot(Bot):
             response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
             response_text = json.loads(response.text)
             logger.info(f"[BAIDU] response text={response_text}")
+            if response_text.get("error_code") in [110, 111]:  # access token无效或已过期
+                invalidate_baidu_access_token(BAIDU_API_KEY)
             res_content = response_text["result"]
             total_tokens = response_text["usage"]["total_tokens"]
             completion_tokens = response_text["usage"]["completion_tokens"]
@@ -112,9 +108,7 @@ class BaiduWenxinBot(Bot):
 
     def get_access_token(self):
         """
-        使用 AK，SK 生成鉴权签名（Access Token）
-        :return: access_token，或是None(如果错误)
+        使用 AK，SK 生成鉴权签名（Access Token），有效期内使用缓存，获取失败时抛出异常
+        :return: access_token
         """
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {"grant_type": "client_credentials", "client_id": BAIDU_API_KEY, "client_secret": BAIDU_SECRET_KEY}
-        return str(requests.post(url, params=params).json().get("access_token"))
+        return get_baidu_access_token(BAIDU_API_KEY, BAIDU_SECRET_KEY)
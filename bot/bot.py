@@ -8,6 +8,9 @@ from bridge.reply import Reply
 
 
 class Bot(object):
+    # bot内部已按自己的接口熔断并把失败转换为普通回复时设为True，Bridge不再套用chat熔断器
+    manages_circuit_breaker = False
+
     def reply(self, query, context: Context = None) -> Reply:
         """
         bot auto-reply content
@@ -66,7 +66,7 @@ class CozeSession(object):
 class CozeSessionManager(object):
     def __init__(self, sessioncls, **session_args):
         if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
+            sessions = ExpiredDict(conf().get("expires_in_seconds"), max_size=conf().get("max_sessions"))
         else:
             sessions = dict()
         self.sessions = sessions
@@ -20,21 +20,49 @@ from common import memory, utils, const
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
+
+class ChatGPTClientConf(object):
+    """
+    ChatGPTBot实例独立使用的接口配置，每次调用时传给openai，不修改openai模块的全局配置
+    api_key/api_base为空时使用全局配置；代理沿用全局的proxy配置，openai 0.27在每个线程的会话中读取openai.proxy，不支持按请求设置
+    """
+
+    def __init__(self, api_key=None, api_base=None, model=None):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.model = model
+
+    def key(self):
+        """用于判断配置是否被修改，修改后需要重新创建使用该配置的ChatGPTBot"""
+        return self.api_key, self.api_base, self.model
+
+    @classmethod
+    def failover(cls):
+        """dify等bot出错或熔断时使用的备用模型配置"""
+        return cls(
+            api_key=conf().get("failover_api_key") or conf().get("open_ai_api_key"),
+            api_base=conf().get("failover_api_base") or conf().get("open_ai_api_base") or None,
+            model=conf().get("failover_model", "gpt-3.5-turbo"),
+        )
+
+
 # OpenAI对话模型API (可用)
 class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
-    def __init__(self):
+    def __init__(self, client_conf: ChatGPTClientConf = None):
         super().__init__()
-        # set the default api_key
-        openai.api_key = conf().get("open_ai_api_key")
-        if conf().get("open_ai_api_base"):
-            openai.api_base = conf().get("open_ai_api_base")
+        self.client_conf = client_conf or ChatGPTClientConf()
+        if client_conf is None:
+            # set the default api_key
+            openai.api_key = conf().get("open_ai_api_key")
+            if conf().get("open_ai_api_base"):
+                openai.api_base = conf().get("open_ai_api_base")
         proxy = conf().get("proxy")
         if proxy:
             openai.proxy = proxy
         if conf().get("rate_limit_chatgpt"):
             self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
-        conf_model = conf().get("model") or "gpt-3.5-turbo"
-        self.sessions = SessionManager(ChatGPTSession, model=conf().get("model") or "gpt-3.5-turbo")
+        conf_model = self.client_conf.model or conf().get("model") or "gpt-3.5-turbo"
+        self.sessions = SessionManager(ChatGPTSession, model=conf_model)
         # o1相关模型不支持system prompt，暂时用文心模型的session
 
         self.args = {
@@ -49,7 +77,7 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
         }
         # o1相关模型固定了部分参数，暂时去掉
         if conf_model in [const.O1, const.O1_MINI]:
-            self.sessions = SessionManager(BaiduWenxinSession, model=conf().get("model") or const.O1_MINI)
+            self.sessions = SessionManager(BaiduWenxinSession, model=conf_model)
             remove_keys = ["temperature", "top_p", "frequency_penalty", "presence_penalty"]
             for key in remove_keys:
                 self.args.pop(key, None)  # 如果键不存在，使用 None 来避免抛出错误
@@ -131,7 +159,12 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             res = self.do_vision_completion_if_need(session_id, session.messages[-1]['content'])
             if res:
                 return res
-            response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
+            response = openai.ChatCompletion.create(
+                api_key=api_key or self.client_conf.api_key,
+                api_base=self.client_conf.api_base,
+                messages=session.messages,
+                **args
+            )
             # logger.debug("[CHATGPT] response={}".format(response))
             # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
             content = response.choices[0]["message"]["content"]
@@ -1,3 +1,5 @@
+import functools
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -16,6 +18,8 @@ class ChatGPTSession(Session):
     def __init__(self, session_id, system_prompt=None, model="gpt-3.5-turbo"):
         super().__init__(session_id, system_prompt)
         self.model = model
+        # 每条消息的token数缓存，key为id(message)，value为(message, 消息内容快照, token数)，只在消息新增或被修改时重新编码
+        self._message_tokens = {}
         self.reset()
 
     def discard_exceeding(self, max_tokens, cur_tokens=None):
@@ -29,13 +33,10 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                message = self.messages.pop(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
-                if precise:
-                    cur_tokens = self.calc_tokens()
-                else:
-                    cur_tokens = cur_tokens - max_tokens
+                message = self.messages.pop(1)
+                cur_tokens = self._discount(message, cur_tokens, max_tokens, precise)
                 break
             elif len(self.messages) == 2 and self.messages[1]["role"] == "user":
                 logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
@@ -43,56 +44,92 @@ class ChatGPTSession(Session):
             else:
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
-            if precise:
-                cur_tokens = self.calc_tokens()
-            else:
-                cur_tokens = cur_tokens - max_tokens
+            cur_tokens = self._discount(message, cur_tokens, max_tokens, precise)
         return cur_tokens
 
+    def _discount(self, message, cur_tokens, max_tokens, precise):
+        """移除一条消息后的token数，精确计数时直接减去该消息缓存的token数"""
+        if not precise:
+            return cur_tokens - max_tokens
+        cached = self._message_tokens.pop(id(message), None)
+        if cached is None or cached[0] is not message:
+            return self.calc_tokens()
+        return cur_tokens - cached[2]
+
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        token_model = resolve_token_model(self.model)
+        message_tokens = {}
+        num_tokens = reply_priming_tokens(token_model)
+        for message in self.messages:
+            snapshot = tuple(message.items())
+            cached = self._message_tokens.get(id(message))
+            if cached is None or cached[0] is not message or cached[1] != snapshot:
+                cached = (message, snapshot, num_tokens_from_message(message, token_model))
+            message_tokens[id(message)] = cached
+            num_tokens += cached[2]
+        self._message_tokens = message_tokens
+        return num_tokens
 
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
-
+@functools.lru_cache(maxsize=None)
+def resolve_token_model(model):
+    """返回计算token数时使用的模型，None表示按字符数计算"""
     if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
+        return None
+    if model in ["gpt-4", "gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
+                 "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
+                 "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
+                 const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
+        return "gpt-4"
+    if model not in ["gpt-3.5-turbo", "gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot",
+                     const.LINKAI_35] and not model.startswith("claude-3"):
+        logger.warn(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
+    return "gpt-3.5-turbo"
+
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """每个模型共享一个tiktoken编码对象"""
     import tiktoken
 
-    if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
-                   "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
-                   "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
-                   const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
-    elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def reply_priming_tokens(token_model):
+    # every reply is primed with <|start|>assistant<|message|>
+    return 0 if token_model is None else 3
+
+
+def num_tokens_from_message(message, token_model):
+    """Returns the number of tokens used by a single message, token_model comes from resolve_token_model."""
+    if token_model is None:
+        return len(message["content"])
+    if token_model == "gpt-3.5-turbo":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4":
+    else:
         tokens_per_message = 3
         tokens_per_name = 1
-    else:
-        logger.warn(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
+    encoding = get_encoding(token_model)
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_messages(messages, model):
+    """Returns the number of tokens used by a list of messages."""
+    token_model = resolve_token_model(model)
+    num_tokens = reply_priming_tokens(token_model)
     for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        num_tokens += num_tokens_from_message(message, token_model)
     return num_tokens
 
 
@@ -3,6 +3,7 @@ import io
 import os
 import mimetypes
 import threading
+import time
 import json
 
 
@@ -14,6 +15,7 @@ from lib.dify.dify_client import DifyClient, ChatClient
 from bot.dify.dify_session import DifySession, DifySessionManager
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
+from common.circuit_breaker import get_breaker
 from common.log import logger
 from common import const, memory
 from common.utils import parse_markdown_text, print_red
@@ -22,20 +24,41 @@ from config import conf
 from bot.openai.open_ai_image import OpenAIImage
 
 UNKNOWN_ERROR_MSG = "我暂时遇到了一些问题，请您稍后重试~"
+STREAM_INTERRUPTED_MSG = "回复生成中断，请稍后重试~"
+# 流式回复时可以切分的句子/段落结束符
+STREAM_SENTENCE_MARKS = ["\n", "。", "！", "？", "!", "?", "；", ";"]
+# chatflow、tts等不影响回复内容的SSE事件
+IGNORED_SSE_EVENTS = ["workflow_started", "node_started", "node_finished", "workflow_finished", "tts_message", "tts_message_end", "ping"]
+
+
+class StreamInterruptedError(Exception):
+    """流式回复已经发送了部分内容后出错，此时不能再故障转移，否则用户会收到两份回复"""
+
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.cause = cause
+
 
 class DifyBot(Bot):
+    # 按dify_api_base熔断，失败时返回错误提示或故障转移的回复，Bridge看不到失败
+    manages_circuit_breaker = True
+
     def __init__(self):
         super().__init__()
         self.sessions = DifySessionManager(DifySession, model=conf().get("model", const.DIFY))
         self.image_creator = OpenAIImage()  # 初始化OpenAIImage
         self.image_create_prefix = conf().get("image_create_prefix", ["画"])  # 从配置读取画图触发词
+        # 故障转移和深度搜索使用的(配置, ChatGPTBot)，首次使用时创建，配置不变时复用
+        self._failover_bot = None
+        self._deepsearch_bot = None
+        self._bot_lock = threading.Lock()
 
     def reply(self, query, context: Context=None):
         # acquire reply content
         if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
             if context.type == ContextType.IMAGE_CREATE:
                 query = conf().get('image_create_prefix', ['画'])[0] + query
-            logger.info("[DIFY] query={}".format(query))
+            logger.info("[DIFY] query=%s", query)
             session_id = context["session_id"]
             # TODO: 适配除微信以外的其他channel
             channel_type = conf().get("channel_type", "wx")
@@ -46,7 +69,7 @@ class DifyBot(Bot):
                 user = context["msg"].other_user_id if context.get("msg") else "default"
             else:
                 return Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatmp, wechatmp_service channel")
-            logger.debug(f"[DIFY] dify_user={user}")
+            logger.debug("[DIFY] dify_user=%s", user)
             user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
             session = self.sessions.get_session(session_id, user)
             if context.get("isgroup", False):
@@ -65,8 +88,8 @@ class DifyBot(Bot):
                 session.set_room_info('', '')
 
             # 打印设置的session信息
-            logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
-            logger.debug(f"[DIFY] session={session} query={query}")
+            logger.debug("[DIFY] Session user and room info - user_id: %s, user_name: %s, room_id: %s, room_name: %s", session.get_user_id(), session.get_user_name(), session.get_room_id(), session.get_room_name())
+            logger.debug("[DIFY] session=%s query=%s", session, query)
 
             reply, err = self._reply(query, session, context)
             if err != None:
@@ -97,6 +120,21 @@ class DifyBot(Bot):
     def _get_dify_conf(self, context: Context, key, default=None):
         return context.get(key, conf().get(key, default))
 
+    def _get_client(self, client_cls, context: Context):
+        """构造dify客户端，相同api_base和api_key的客户端共享同一个长连接池"""
+        api_key = self._get_dify_conf(context, "dify_api_key", '')
+        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
+        return client_cls(
+            api_key,
+            api_base,
+            connect_timeout=conf().get("dify_connect_timeout", 10),
+            read_timeout=conf().get("dify_read_timeout", 300),
+            pool_size=conf().get("dify_pool_size", 10),
+            max_retries=conf().get("dify_max_retries", 2),
+            keep_alive=conf().get("dify_keep_alive", True),
+            breaker=get_breaker("dify:" + api_base),
+        )
+
     def _reply(self, query: str, session: DifySession, context: Context):
 
         query = query.strip()
@@ -104,7 +142,7 @@ class DifyBot(Bot):
             if query.startswith(prefix):
                 # 提取画图提示词
                 prompt = query[len(prefix):].strip()
-                logger.info(f"[DIFY] 检测到画图请求，触发词={prefix}，提示词={prompt}")
+                logger.info("[DIFY] 检测到画图请求，触发词=%s，提示词=%s", prefix, prompt)
                 # 调用OpenAIImage创建图片
                 success, result = self.image_creator.create_img(prompt, context=context)
                 if success:
@@ -127,7 +165,7 @@ class DifyBot(Bot):
                         img_io.seek(0)
                         return Reply(ReplyType.IMAGE, img_io), None
                     except Exception as e:
-                        logger.error(f"[DIFY] 处理图片文件失败: {e}")
+                        logger.error("[DIFY] 处理图片文件失败: %s", e)
                         # 如果处理失败，尝试直接返回文件路径
                         return Reply(ReplyType.IMAGE, result), None
                 else:
@@ -140,10 +178,16 @@ class DifyBot(Bot):
                 if query.startswith(keyword):
                     # 截掉关键词，获取实际查询内容
                     actual_query = query[len(keyword):].strip()
-                    logger.info(f"[DIFY] 检测到深度搜索请求: 关键词={keyword}, 实际查询={actual_query}")
+                    logger.info("[DIFY] 检测到深度搜索请求: 关键词=%s, 实际查询=%s", keyword, actual_query)
                     deepsearch_model = conf().get("deepsearch_model", "sonar-reasoning-pro")
                     return self._use_specific_model(actual_query, context, deepsearch_model)            
 
+            breaker = get_breaker("dify:" + self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1"))
+            if breaker and breaker.is_open():
+                # 熔断期间不再等待dify超时，直接使用故障转移模型
+                logger.info("[DIFY] circuit breaker is open, failover to ChatGPTBot")
+                return self._use_failover_bot(query, context)
+
             session.count_user_message() # 限制一个conversation中消息数，防止conversation过长
             dify_app_type = self._get_dify_conf(context, "dify_app_type", 'chatbot')
             if dify_app_type == 'chatbot' or dify_app_type == 'chatflow':
@@ -161,93 +205,67 @@ class DifyBot(Bot):
             logger.exception(error_info)
             return None, UNKNOWN_ERROR_MSG
 
+    def _get_openai_bot(self, attr, api_key, api_base, model):
+        """
+        获取复用的ChatGPTBot，key/base/model通过ChatGPTClientConf按请求传入，不修改openai全局配置
+
+        attr属性保存(配置, bot)，#reconf等修改了key/base/model时重新创建
+        """
+        from bot.chatgpt.chat_gpt_bot import ChatGPTBot, ChatGPTClientConf
+        client_conf = ChatGPTClientConf(api_key=api_key, api_base=api_base, model=model)
+        cached = getattr(self, attr)
+        if cached is not None and cached[0] == client_conf.key():
+            return cached[1]
+        with self._bot_lock:
+            cached = getattr(self, attr)
+            if cached is None or cached[0] != client_conf.key():
+                cached = (client_conf.key(), ChatGPTBot(client_conf))
+                setattr(self, attr, cached)
+        return cached[1]
+
+    def _build_openai_context(self, query, context, model_name):
+        """创建交给ChatGPTBot处理的上下文，复制session_id等必要属性，缺少时返回None"""
+        if not context:
+            logger.error("[DIFY] Original context is None when building openai context!")
+            return None
+        if "session_id" not in context:
+            logger.error("[DIFY] Original context is missing 'session_id' when building openai context!")
+            return None
+        openai_context = Context(type=ContextType.TEXT, content=query, kwargs={})
+        # 复制其他可能被 chatgpt_bot.reply 使用的属性
+        for key in ["session_id", "msg", "isgroup", "receiver"]:
+            if key in context:
+                openai_context[key] = context[key]
+        openai_context["gpt_model"] = model_name
+        return openai_context
+
     def _use_specific_model(self, query, context, model_name):
         """使用指定的模型处理请求"""
         try:
-            logger.info(f"[DIFY] 使用深度搜索模型处理请求: {model_name}")
-            import openai
-            from bot.chatgpt.chat_gpt_bot import ChatGPTBot
-
-            # 先创建实例
-            specific_bot = ChatGPTBot()
-
-            # 保存原始的API配置
-            original_api_key = openai.api_key
-            original_api_base = openai.api_base
-            original_proxy = openai.proxy # 保存原始代理设置
-
-            try:
-                # ... (设置 deepsearch API 配置的代码保持不变) ...
-                # 获取深度搜索的特定API配置，如果未配置则使用默认OpenAI配置
-                deepsearch_api_key = conf().get("deepsearch_api_key", conf().get("open_ai_api_key"))
-                deepsearch_api_base = conf().get("deepsearch_api_base", conf().get("open_ai_api_base"))
-
-                # 设置OpenAI配置 - 这会影响全局配置
-                openai.api_key = deepsearch_api_key
-                if deepsearch_api_base:
-                    openai.api_base = deepsearch_api_base
-                else:
-                    # 如果深度搜索没有指定base，确保使用原始base或默认base
-                    openai.api_base = original_api_base if original_api_base else conf().get("open_ai_api_base")
-
-                logger.info(f"[DIFY] DeepSearch 使用API Base: {openai.api_base}，Key: {openai.api_key[:3]}...{openai.api_key[-3:]}")
-                # 如果有设置代理，也打印出来
-                if openai.proxy:
-                        logger.info(f"[DIFY] DeepSearch 使用 Proxy: {openai.proxy}")
-
-                # 创建新的上下文
-                specific_context = Context(type=ContextType.TEXT, content=query) # 直接设置 content
-
-                # 显式复制必要的属性，尤其是 session_id
-                if context:
-                    # 确保 session_id 被复制
-                    if "session_id" in context:
-                        specific_context["session_id"] = context["session_id"]
-                        logger.debug(f"[DIFY] Copied session_id to specific_context: {context['session_id']}") # 增加日志确认复制
-                    else:
-                         # 如果原始 context 确实没有 session_id，这是一个严重问题
-                         logger.error("[DIFY] Original context is missing 'session_id' in _use_specific_model!")
-                         return None, "内部错误：缺少会话ID"
-
-                    # 复制其他可能被 chatgpt_bot.reply 使用的属性 (可选)
-                    for key in ["msg", "isgroup", "receiver"]: # 按需添加
-                        if key in context:
-                            specific_context[key] = context[key]
-                else:
-                     logger.error("[DIFY] Original context is None in _use_specific_model!")
-                     return None, "内部错误：缺少上下文信息"
-
-                # 设置gpt_model
-                specific_context["gpt_model"] = model_name
-
-                # 使用ChatGPTBot处理请求 (现在 specific_context 应该有 session_id)
-                reply = specific_bot.reply(query, specific_context)
-
-                logger.info(f"[DIFY] 使用模型 {model_name} 处理成功")
-                return reply, None
-            finally:
-                # ... (恢复原始 API 配置的代码保持不变) ...
-                # 恢复原始的API配置
-                openai.api_key = original_api_key
-                openai.api_base = original_api_base
-                openai.proxy = original_proxy # 恢复原始代理设置
-                logger.debug("[DIFY] 恢复原始OpenAI API及代理配置")
-
+            logger.info("[DIFY] 使用深度搜索模型处理请求: %s", model_name)
+            # 获取深度搜索的特定API配置，如果未配置则使用默认OpenAI配置
+            deepsearch_api_key = conf().get("deepsearch_api_key") or conf().get("open_ai_api_key")
+            deepsearch_api_base = conf().get("deepsearch_api_base") or conf().get("open_ai_api_base") or None
+            specific_bot = self._get_openai_bot("_deepsearch_bot", deepsearch_api_key, deepsearch_api_base, model_name)
+            logger.info("[DIFY] DeepSearch 使用API Base: %s，Key: %s...%s", deepsearch_api_base, deepsearch_api_key[:3], deepsearch_api_key[-3:])
+
+            specific_context = self._build_openai_context(query, context, model_name)
+            if specific_context is None:
+                return None, "内部错误：缺少会话ID或上下文信息"
+
+            reply = specific_bot.reply(query, specific_context)
+            logger.info("[DIFY] 使用模型 %s 处理成功", model_name)
+            return reply, None
         except Exception as e:
-            # ... (异常处理和 failover 代码保持不变) ...
             # 如果特定模型失败，尝试使用故障转移模型
-            logger.exception(f"[DIFY] 特定模型处理失败: {e}，尝试使用故障转移模型")
-            # 在调用故障转移前，确保OpenAI配置已恢复或设置为故障转移所需状态
-            # (上面的 finally 块已经做了恢复，所以这里应该是安全的)
-            return self._use_failover_bot(query, context) 
-
+            logger.exception("[DIFY] 特定模型处理失败: %s，尝试使用故障转移模型", e)
+            return self._use_failover_bot(query, context)
 
     def _handle_chatbot(self, query: str, session: DifySession, context: Context):
         try:
-            api_key = self._get_dify_conf(context, "dify_api_key", '')
-            api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-            chat_client = ChatClient(api_key, api_base)
-            response_mode = 'blocking'
+            chat_client = self._get_client(ChatClient, context)
+            stream = self._is_stream_reply(context)
+            response_mode = 'streaming' if stream else 'blocking'
             payload = self._get_payload(query, session, response_mode)
             files = self._get_upload_files(session, context)
             response = chat_client.create_chat_message(
@@ -267,8 +285,16 @@ class DifyBot(Bot):
                 logger.info("[DIFY] API返回非200状态码，启动故障转移到ChatGPTBot")
                 return self._use_failover_bot(query, context)
 
+            if stream:
+                # 流式回复：生成过程中已分段发送，返回最后一段未发送的内容
+                reply, conversation_id = self._handle_stream_response(response, context)
+                if session.get_conversation_id() == '':
+                    session.set_conversation_id(conversation_id)
+                return reply, None
+
             rsp_data = response.json()
-            logger.debug("[DIFY] usage {}".format(rsp_data.get('metadata', {}).get('usage', 0)))
+            logger.debug("[DIFY] usage %s", rsp_data.get('metadata', {}).get('usage', 0))
+            logger.debug("[DIFY] chatbot latency %s", response.timing)
 
             answer = rsp_data['answer']
             
@@ -281,6 +307,9 @@ class DifyBot(Bot):
                 session.set_conversation_id(rsp_data['conversation_id'])
 
             return reply, None
+        except StreamInterruptedError as e:
+            logger.error("[DIFY] stream reply interrupted after partial content sent: %s", e.cause)
+            return None, STREAM_INTERRUPTED_MSG
         except Exception as e:
             # 记录错误信息
             error_info = f"[DIFY] Exception in _handle_chatbot: {e}"
@@ -294,84 +323,23 @@ class DifyBot(Bot):
         """使用ChatGPTBot作为故障转移处理请求"""
         try:
             logger.info("[DIFY] Failover to ChatGPTBot")
-            import openai
-            from bot.chatgpt.chat_gpt_bot import ChatGPTBot
-
-            # 先创建实例 (它会读取一次默认配置，没关系)
-            failover_bot = ChatGPTBot()
-
             # 使用专门的故障转移API配置
-            failover_api_key = conf().get("failover_api_key", conf().get("open_ai_api_key"))
-            failover_api_base = conf().get("failover_api_base", conf().get("open_ai_api_base"))
-
-            # 保存原始的API配置
-            original_api_key = openai.api_key
-            original_api_base = openai.api_base
-            original_proxy = openai.proxy # 保存原始代理
-
-            try:
-                # 设置Failover的OpenAI配置 - 这会影响全局配置
-                openai.api_key = failover_api_key
-                if failover_api_base:
-                    openai.api_base = failover_api_base
-                else:
-                     # 如果没有指定failover base，确保使用原始base或默认base
-                     openai.api_base = original_api_base if original_api_base else conf().get("open_ai_api_base")
-
-                # 对于 failover，通常应该使用全局代理设置
-                proxy = conf().get("proxy")
-                if proxy:
-                    openai.proxy = proxy
-                else:
-                    openai.proxy = None # 确保如果没有配置全局代理，则清除代理设置
-
-                logger.info(f"[DIFY] Failover using API base: {openai.api_base} with key: {failover_api_key[:3]}...{failover_api_key[-3:]}")
-                if openai.proxy:
-                     logger.info(f"[DIFY] Failover using Proxy: {openai.proxy}")
-
-                # 使用配置中的failover_model
-                failover_model = conf().get("failover_model", "gpt-3.5-turbo")
-
-                # 创建新的上下文，正确复制原始context的所有属性
-                failover_context = Context(type=ContextType.TEXT, content=query) # 直接设置 content
-
-                # 显式复制必要的属性，尤其是 session_id
-                if context:
-                    # 确保 session_id 被复制
-                    if "session_id" in context:
-                        failover_context["session_id"] = context["session_id"]
-                        logger.debug(f"[DIFY] Copied session_id to failover_context: {context['session_id']}") # 增加日志确认复制
-                    else:
-                        # 如果原始 context 确实没有 session_id，这是一个严重问题
-                        logger.error("[DIFY] Original context is missing 'session_id' in _use_failover_bot!")
-                        return None, "内部错误：缺少会话ID"
-
-                    # 复制其他可能被 chatgpt_bot.reply 使用的属性 (可选)
-                    for key in ["msg", "isgroup", "receiver"]: # 按需添加
-                        if key in context:
-                            failover_context[key] = context[key]
-                else:
-                    logger.error("[DIFY] Original context is None in _use_failover_bot!")
-                    return None, "内部错误：缺少上下文信息"
-
-                # 设置gpt_model
-                failover_context["gpt_model"] = failover_model
-
-                # 使用ChatGPTBot处理请求 (此时openai配置是failover的)
-                reply = failover_bot.reply(query, failover_context)
-
-                logger.info(f"[DIFY] Failover successful using model: {failover_model}")
-                return reply, None
-            finally:
-                # 恢复原始的API配置
-                openai.api_key = original_api_key
-                openai.api_base = original_api_base
-                openai.proxy = original_proxy # 恢复原始代理设置
-                logger.debug("[DIFY] 恢复原始OpenAI API及代理配置")
-
+            from bot.chatgpt.chat_gpt_bot import ChatGPTClientConf
+            client_conf = ChatGPTClientConf.failover()
+            failover_model = client_conf.model
+            failover_bot = self._get_openai_bot("_failover_bot", client_conf.api_key, client_conf.api_base, failover_model)
+            logger.info("[DIFY] Failover using API base: %s with key: %s...%s", client_conf.api_base, client_conf.api_key[:3], client_conf.api_key[-3:])
+
+            failover_context = self._build_openai_context(query, context, failover_model)
+            if failover_context is None:
+                return None, "内部错误：缺少会话ID或上下文信息"
+
+            reply = failover_bot.reply(query, failover_context)
+            logger.info("[DIFY] Failover successful using model: %s", failover_model)
+            return reply, None
         except Exception as failover_e:
             # 如果故障转移也失败，记录错误并返回默认错误消息
-            logger.exception(f"[DIFY] Failover failed: {failover_e}")
+            logger.exception("[DIFY] Failover failed: %s", failover_e)
             return None, UNKNOWN_ERROR_MSG
 
 
@@ -380,17 +348,17 @@ class DifyBot(Bot):
             response = requests.get(url)
             response.raise_for_status()
             parsed_url = urlparse(url)
-            logger.debug(f"Downloading file from {url}")
+            logger.debug("Downloading file from %s", url)
             url_path = unquote(parsed_url.path)
             # 从路径中提取文件名
             file_name = url_path.split('/')[-1]
-            logger.debug(f"Saving file as {file_name}")
+            logger.debug("Saving file as %s", file_name)
             file_path = os.path.join(TmpDir().path(), file_name)
             with open(file_path, 'wb') as file:
                 file.write(response.content)
             return file_path
         except Exception as e:
-            logger.error(f"Error downloading {url}: {e}")
+            logger.error("Error downloading %s: %s", url, e)
         return None
 
     def _download_image(self, url):
@@ -402,18 +370,17 @@ class DifyBot(Bot):
             for block in pic_res.iter_content(1024):
                 size += len(block)
                 image_storage.write(block)
-            logger.debug(f"[WX] download image success, size={size}, img_url={url}")
+            logger.debug("[WX] download image success, size=%s, img_url=%s", size, url)
             image_storage.seek(0)
             return image_storage
         except Exception as e:
-            logger.error(f"Error downloading {url}: {e}")
+            logger.error("Error downloading %s: %s", url, e)
         return None
 
     def _handle_agent(self, query: str, session: DifySession, context: Context):
         try:
-            api_key = self._get_dify_conf(context, "dify_api_key", '')
-            api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-            chat_client = ChatClient(api_key, api_base)
+            chat_client = self._get_client(ChatClient, context)
+            start = time.monotonic()
             response_mode = 'streaming'
             payload = self._get_payload(query, session, response_mode)
             files = self._get_upload_files(session, context)
@@ -436,7 +403,14 @@ class DifyBot(Bot):
             # data: {"event": "agent_thought", "id": "8dcf3648-fbad-407a-85dd-73a6f43aeb9f", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "position": 1, "thought": "", "observation": "", "tool": "dalle3", "tool_input": "{\"dalle3\": {\"prompt\": \"cute Japanese anime girl with white hair, blue eyes, bunny girl suit\"}}", "created_at": 1705639511, "message_files": [], "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
             # data: {"event": "agent_message", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "answer": "I have created an image of a cute Japanese", "created_at": 1705639511, "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
             # data: {"event": "message_end", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142", "metadata": {"usage": {"prompt_tokens": 305, "prompt_unit_price": "0.001", "prompt_price_unit": "0.001", "prompt_price": "0.0003050", "completion_tokens": 97, "completion_unit_price": "0.002", "completion_price_unit": "0.001", "completion_price": "0.0001940", "total_tokens": 184, "total_price": "0.0002290", "currency": "USD", "latency": 1.771092874929309}}}
+            if self._is_stream_reply(context):
+                reply, conversation_id = self._handle_stream_response(response, context)
+                if session.get_conversation_id() == '':
+                    session.set_conversation_id(conversation_id)
+                return reply, None
             msgs, conversation_id = self._handle_sse_response(response)
+            response.timing["total"] = time.monotonic() - start
+            logger.debug("[DIFY] agent latency %s", response.timing)
             channel = context.get("channel")
             # TODO: 适配除微信以外的其他channel
             is_group = context.get("isgroup", False)
@@ -461,51 +435,23 @@ class DifyBot(Bot):
             if session.get_conversation_id() == '':
                 session.set_conversation_id(conversation_id)
             return reply, None
+        except StreamInterruptedError as e:
+            logger.error("[DIFY] stream reply interrupted after partial content sent: %s", e.cause)
+            return None, STREAM_INTERRUPTED_MSG
         except Exception as e:
             # 记录错误信息
             error_info = f"[DIFY] Exception in _handle_agent: {e}"
             logger.exception(error_info)
             
             # 使用ChatGPTBot作为故障转移
-            try:
-                logger.info("[DIFY] Failover to ChatGPTBot")
-                from bot.chatgpt.chat_gpt_bot import ChatGPTBot
-                
-                # 创建ChatGPTBot实例
-                failover_bot = ChatGPTBot()
-                
-                # 使用配置中的failover_model
-                failover_model = conf().get("failover_model", "gpt-3.5-turbo")
-                
-                # 创建新的上下文，正确复制原始context的所有属性
-                failover_context = Context(type=ContextType.TEXT)
-                
-                # 如果原始context存在，复制其content和kwargs
-                if context:
-                    failover_context.content = context.content
-                    for key, value in context.kwargs.items():
-                        failover_context[key] = value
-                    
-                # 设置gpt_model
-                failover_context["gpt_model"] = failover_model
-                
-                # 使用ChatGPTBot处理请求
-                reply = failover_bot.reply(query, failover_context)
-                
-                logger.info(f"[DIFY] Failover successful using model: {failover_model}")
-                return reply, None
-            except Exception as failover_e:
-                # 如果故障转移也失败，记录错误并返回原始错误
-                logger.exception(f"[DIFY] Failover failed: {failover_e}")
-                return None, UNKNOWN_ERROR_MSG
+            return self._use_failover_bot(query, context)
 
     def _handle_workflow(self, query: str, session: DifySession, context: Context):
         try:
             payload = self._get_workflow_payload(query, session)
-            api_key = self._get_dify_conf(context, "dify_api_key", '')
-            api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-            dify_client = DifyClient(api_key, api_base)
+            dify_client = self._get_client(DifyClient, context)
             response = dify_client._send_request("POST", "/workflows/run", json=payload)
+            logger.debug("[DIFY] workflow latency %s", response.timing)
             if response.status_code != 200:
                 error_info = f"[DIFY] payload={payload} response text={response.text} status_code={response.status_code}"
                 logger.warning(error_info)
@@ -543,37 +489,7 @@ class DifyBot(Bot):
             logger.exception(error_info)
             
             # 使用ChatGPTBot作为故障转移
-            try:
-                logger.info("[DIFY] Failover to ChatGPTBot")
-                from bot.chatgpt.chat_gpt_bot import ChatGPTBot
-                
-                # 创建ChatGPTBot实例
-                failover_bot = ChatGPTBot()
-                
-                # 使用配置中的failover_model
-                failover_model = conf().get("failover_model", "gpt-3.5-turbo")
-                
-                # 创建新的上下文，正确复制原始context的所有属性
-                failover_context = Context(type=ContextType.TEXT)
-                
-                # 如果原始context存在，复制其content和kwargs
-                if context:
-                    failover_context.content = context.content
-                    for key, value in context.kwargs.items():
-                        failover_context[key] = value
-                    
-                # 设置gpt_model
-                failover_context["gpt_model"] = failover_model
-                
-                # 使用ChatGPTBot处理请求
-                reply = failover_bot.reply(query, failover_context)
-                
-                logger.info(f"[DIFY] Failover successful using model: {failover_model}")
-                return reply, None
-            except Exception as failover_e:
-                # 如果故障转移也失败，记录错误并返回原始错误
-                logger.exception(f"[DIFY] Failover failed: {failover_e}")
-                return None, UNKNOWN_ERROR_MSG
+            return self._use_failover_bot(query, context)
 
     def _get_upload_files(self, session: DifySession, context: Context):
         session_id = session.get_session_id()
@@ -582,9 +498,7 @@ class DifyBot(Bot):
             return None
         # 清理图片缓存
         memory.USER_IMAGE_CACHE[session_id] = None
-        api_key = self._get_dify_conf(context, "dify_api_key", '')
-        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-        dify_client = DifyClient(api_key, api_base)
+        dify_client = self._get_client(DifyClient, context)
         msg = img_cache.get("msg")
         path = img_cache.get("path")
         msg.prepare()
@@ -611,7 +525,7 @@ class DifyBot(Bot):
         #     'created_at': 1722781568
         # }
         file_upload_data = response.json()
-        logger.debug("[DIFY] upload file {}".format(file_upload_data))
+        logger.debug("[DIFY] upload file %s", file_upload_data)
         return [
             {
                 "type": "image",
@@ -643,10 +557,10 @@ class DifyBot(Bot):
         """
         Parses a single SSE event string and returns a dictionary of its data.
         """
-        event_prefix = "data: "
+        event_prefix = "data:"
         if not event_str.startswith(event_prefix):
             return None
-        trimmed_event_str = event_str[len(event_prefix):]
+        trimmed_event_str = event_str[len(event_prefix):].lstrip()
 
         # Check if trimmed_event_str is not empty and is a valid JSON string
         if trimmed_event_str:
@@ -654,37 +568,37 @@ class DifyBot(Bot):
                 event = json.loads(trimmed_event_str)
                 return event
             except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON from SSE event: {trimmed_event_str}")
+                logger.error("Failed to decode JSON from SSE event: %s", trimmed_event_str)
                 return None
         else:
             logger.warning("Received an empty SSE event.")
             return None
 
-    # TODO: 异步返回events
-    def _handle_sse_response(self, response: requests.Response):
-        events = []
+    def _iter_sse_events(self, response: requests.Response):
+        """逐行解析SSE响应，每收到一个事件就返回，不等待整个响应结束"""
         for line in response.iter_lines():
             if line:
                 decoded_line = line.decode('utf-8')
                 event = self._parse_sse_event(decoded_line)
                 if event:
-                    events.append(event)
+                    yield event
 
+    def _handle_sse_response(self, response: requests.Response):
         merged_message = []
         accumulated_agent_message = ''
         conversation_id = None
-        for event in events:
+        for event in self._iter_sse_events(response):
             event_name = event['event']
             if event_name == 'agent_message' or event_name == 'message':
                 accumulated_agent_message += event['answer']
-                logger.debug("[DIFY] accumulated_agent_message: {}".format(accumulated_agent_message))
+                logger.debug("[DIFY] accumulated_agent_message: %s", accumulated_agent_message)
                 # 保存conversation_id
                 if not conversation_id:
                     conversation_id = event['conversation_id']
             elif event_name == 'agent_thought':
                 self._append_agent_message(accumulated_agent_message, merged_message)
                 accumulated_agent_message = ''
-                logger.debug("[DIFY] agent_thought: {}".format(event))
+                logger.debug("[DIFY] agent_thought: %s", event)
             elif event_name == 'message_file':
                 self._append_agent_message(accumulated_agent_message, merged_message)
                 accumulated_agent_message = ''
@@ -693,20 +607,139 @@ class DifyBot(Bot):
                 # TODO: handle message_replace
                 pass
             elif event_name == 'error':
-                logger.error("[DIFY] error: {}".format(event))
+                logger.error("[DIFY] error: %s", event)
                 raise Exception(event)
             elif event_name == 'message_end':
                 self._append_agent_message(accumulated_agent_message, merged_message)
-                logger.debug("[DIFY] message_end usage: {}".format(event['metadata']['usage']))
+                logger.debug("[DIFY] message_end usage: %s", event['metadata']['usage'])
                 break
+            elif event_name in IGNORED_SSE_EVENTS:
+                pass
             else:
-                logger.warning("[DIFY] unknown event: {}".format(event))
+                logger.warning("[DIFY] unknown event: %s", event)
 
         if not conversation_id:
             raise Exception("conversation_id not found")
 
         return merged_message, conversation_id
 
+    def _is_stream_reply(self, context: Context):
+        # 需要语音回复时，文本要整体转换为语音，不分段发送
+        if not self._get_dify_conf(context, "dify_stream_reply", False) or not context.get("channel"):
+            return False
+        return context.get("desire_rtype") != ReplyType.VOICE
+
+    def _handle_stream_response(self, response: requests.Response, context: Context):
+        """
+        边接收SSE事件边发送回复：累积的文本达到dify_stream_min_chars字数或距上次发送超过dify_stream_flush_interval秒后，
+        在最后一个句子/段落结束处切分并通过channel发送，剩余内容作为最终回复返回，由channel按正常流程装饰和发送
+
+        已经发送过内容后出错时，发送剩余的内容并抛出StreamInterruptedError，调用方不再故障转移
+        """
+        channel = context.get("channel")
+        min_chars = self._get_dify_conf(context, "dify_stream_min_chars", 60)
+        flush_interval = self._get_dify_conf(context, "dify_stream_flush_interval", 3)
+        buffer = ''
+        sent = False
+        conversation_id = None
+        last_flush = time.monotonic()
+        try:
+            for event in self._iter_sse_events(response):
+                event_name = event['event']
+                if event_name == 'agent_message' or event_name == 'message':
+                    buffer += event['answer']
+                    if not conversation_id:
+                        conversation_id = event['conversation_id']
+                    if len(buffer) >= min_chars or time.monotonic() - last_flush >= flush_interval:
+                        text, buffer = self._split_stream_buffer(buffer)
+                        if text:
+                            sent = True
+                            self._send_stream_reply(channel, context, Reply(ReplyType.TEXT, text))
+                            last_flush = time.monotonic()
+                elif event_name == 'agent_thought':
+                    # agent的一次思考结束，之前的内容是完整的一段
+                    if buffer.strip() and not self._in_unclosed_block(buffer):
+                        sent = True
+                        self._send_stream_reply(channel, context, Reply(ReplyType.TEXT, buffer))
+                        buffer = ''
+                        last_flush = time.monotonic()
+                elif event_name == 'message_file':
+                    if buffer.strip() and not self._in_unclosed_block(buffer):
+                        sent = True
+                        self._send_stream_reply(channel, context, Reply(ReplyType.TEXT, buffer))
+                        buffer = ''
+                    if event.get('type') != 'image':
+                        logger.warning("[DIFY] unsupported message file type: %s", event)
+                    url = self._fill_file_base_url(event['url'])
+                    sent = True
+                    self._send_stream_reply(channel, context, Reply(ReplyType.IMAGE_URL, url))
+                    last_flush = time.monotonic()
+                elif event_name == 'message_replace':
+                    # TODO: handle message_replace
+                    pass
+                elif event_name == 'error':
+                    logger.error("[DIFY] error: %s", event)
+                    raise Exception(event)
+                elif event_name == 'message_end':
+                    logger.debug("[DIFY] message_end usage: %s", event.get('metadata', {}).get('usage'))
+                    break
+                elif event_name in IGNORED_SSE_EVENTS:
+                    pass
+                else:
+                    logger.warning("[DIFY] unknown event: %s", event)
+        except Exception as e:
+            if not sent:
+                # 还没有发送任何内容，由调用方故障转移
+                raise
+            if buffer.strip():
+                self._send_stream_reply(channel, context, Reply(ReplyType.TEXT, buffer))
+            raise StreamInterruptedError(e)
+
+        if not conversation_id:
+            raise Exception("conversation_id not found")
+
+        if not buffer.strip():
+            # 所有内容都已发送
+            return None, conversation_id
+        return Reply(ReplyType.TEXT, buffer), conversation_id
+
+    def _split_stream_buffer(self, buffer: str):
+        """在最后一个句子或段落结束处切分，返回(可以发送的部分, 剩余部分)"""
+        for end in sorted(self._stream_cut_positions(buffer), reverse=True):
+            text = buffer[:end]
+            if text.strip() and not self._in_unclosed_block(text):
+                return text, buffer[end:]
+        return '', buffer
+
+    def _stream_cut_positions(self, buffer: str):
+        for mark in STREAM_SENTENCE_MARKS + ['</think>', '</details>']:
+            index = buffer.find(mark)
+            while index != -1:
+                yield index + len(mark)
+                index = buffer.find(mark, index + 1)
+
+    def _in_unclosed_block(self, text: str):
+        # 推理模型的<think>/<details>思考过程需要完整发送，避免被切断导致channel无法正确处理标签
+        return text.count('<think>') > text.count('</think>') or text.count('<details') > text.count('</details>')
+
+    def _send_stream_reply(self, channel, context: Context, reply: Reply):
+        """
+        分段回复与最终回复一样经过插件装饰和带重试的发送
+
+        群聊只在发送的第一段文本@提问的用户，之后的分段和最终回复通过context的no_need_at跳过@
+        """
+        try:
+            if hasattr(channel, "_decorate_reply") and hasattr(channel, "_send_reply"):
+                reply = channel._decorate_reply(context, reply)
+                if reply and reply.content:
+                    channel._send_reply(context, reply)
+                    if reply.type == ReplyType.TEXT and context.get("isgroup", False):
+                        context["no_need_at"] = True
+            else:
+                channel.send(reply, context)
+        except Exception as e:
+            logger.exception("[DIFY] send stream reply failed: %s", e)
+
     def _append_agent_message(self, accumulated_agent_message,  merged_message):
         if accumulated_agent_message:
             merged_message.append({
@@ -716,7 +749,7 @@ class DifyBot(Bot):
 
     def _append_message_file(self, event: dict, merged_message: list):
         if event.get('type') != 'image':
-            logger.warning("[DIFY] unsupported message file type: {}".format(event))
+            logger.warning("[DIFY] unsupported message file type: %s", event)
         merged_message.append({
             'type': 'message_file',
             'content': event,
@@ -735,5 +768,5 @@ class DifyBot(Bot):
                 print_red(friendly_error_msg)
             return friendly_error_msg
         except Exception as e:
-            logger.error(f"Failed to handle error response, response_text: {response_text} error: {e}")
+            logger.error("Failed to handle error response, response_text: %s error: %s", response_text, e)
             return UNKNOWN_ERROR_MSG
@@ -61,7 +61,7 @@ class DifySession(object):
 class DifySessionManager(object):
     def __init__(self, sessioncls, **session_kwargs):
         if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
+            sessions = ExpiredDict(conf().get("expires_in_seconds"), max_size=conf().get("max_sessions"))
         else:
             sessions = dict()
         self.sessions = sessions
@@ -39,7 +39,7 @@ class Session(object):
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
         if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
+            sessions = ExpiredDict(conf().get("expires_in_seconds"), max_size=conf().get("max_sessions"))
         else:
             sessions = dict()
         self.sessions = sessions
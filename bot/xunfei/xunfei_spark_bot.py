@@ -10,8 +10,6 @@ from common.log import logger
 from config import conf
 from common import const
 import time
-import _thread as thread
-import datetime
 from datetime import datetime
 from wsgiref.handlers import format_date_time
 from urllib.parse import urlencode
@@ -23,15 +21,7 @@ import json
 from time import mktime
 from urllib.parse import urlparse
 import websocket
-import queue
 import threading
-import random
-
-# 消息队列 map
-queue_map = dict()
-
-# 响应队列 map
-reply_map = dict()
 
 
 class XunFeiBot(Bot):
@@ -54,76 +44,67 @@ class XunFeiBot(Bot):
         self.path = urlparse(self.spark_url).path
         # 和wenxin使用相同的session机制
         self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
+        # 限制同时打开的websocket连接数
+        self.connection_slots = threading.BoundedSemaphore(conf().get("xunfei_max_connections", 8))
 
     def reply(self, query, context: Context = None) -> Reply:
         if context.type == ContextType.TEXT:
             logger.info("[XunFei] query={}".format(query))
             session_id = context["session_id"]
-            request_id = self.gen_request_id(session_id)
-            reply_map[request_id] = ""
             session = self.sessions.session_query(query, session_id)
-            threading.Thread(target=self.create_web_socket,
-                             args=(session.messages, request_id)).start()
-            depth = 0
-            time.sleep(0.1)
             t1 = time.time()
+            chunks = []
             usage = {}
-            while depth <= 300:
-                try:
-                    data_queue = queue_map.get(request_id)
-                    if not data_queue:
-                        depth += 1
-                        time.sleep(0.1)
-                        continue
-                    data_item = data_queue.get(block=True, timeout=0.1)
-                    if data_item.is_end:
-                        # 请求结束
-                        del queue_map[request_id]
-                        if data_item.reply:
-                            reply_map[request_id] += data_item.reply
-                        usage = data_item.usage
-                        break
-
-                    reply_map[request_id] += data_item.reply
-                    depth += 1
-                except Exception as e:
-                    depth += 1
-                    continue
+            try:
+                for chunk in self.stream_reply_text(session.messages, usage):
+                    chunks.append(chunk)
+            except Exception as e:
+                logger.error("[XunFei] request failed: {}".format(e))
+                return Reply(ReplyType.ERROR, "讯飞星火请求失败，请稍后再试")
+            content = "".join(chunks)
             t2 = time.time()
             logger.info(
-                f"[XunFei-API] response={reply_map[request_id]}, time={t2 - t1}s, usage={usage}"
+                f"[XunFei-API] response={content}, time={t2 - t1}s, usage={usage}"
             )
-            self.sessions.session_reply(reply_map[request_id], session_id,
-                                        usage.get("total_tokens"))
-            reply = Reply(ReplyType.TEXT, reply_map[request_id])
-            del reply_map[request_id]
-            return reply
+            self.sessions.session_reply(content, session_id,
+                                        (usage.get("text") or usage).get("total_tokens"))
+            return Reply(ReplyType.TEXT, content)
         else:
             reply = Reply(ReplyType.ERROR,
                           "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def create_web_socket(self, prompt, session_id, temperature=0.5):
-        logger.info(f"[XunFei] start connect, prompt={prompt}")
-        websocket.enableTrace(False)
-        wsUrl = self.create_url()
-        ws = websocket.WebSocketApp(wsUrl,
-                                    on_message=on_message,
-                                    on_error=on_error,
-                                    on_close=on_close,
-                                    on_open=on_open)
-        data_queue = queue.Queue(1000)
-        queue_map[session_id] = data_queue
-        ws.appid = self.app_id
-        ws.question = prompt
-        ws.domain = self.domain
-        ws.session_id = session_id
-        ws.temperature = temperature
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    def stream_reply_text(self, messages, usage=None, temperature=0.5):
+        """
+        建立websocket连接发送请求，逐段返回回复内容，结束后把token用量写入usage
 
-    def gen_request_id(self, session_id: str):
-        return session_id + "_" + str(int(time.time())) + "" + str(
-            random.randint(0, 100))
+        在调用线程中阻塞接收，不创建额外的线程，也不轮询；同时打开的连接数不超过xunfei_max_connections
+        """
+        timeout = conf().get("xunfei_timeout", 30)
+        if not self.connection_slots.acquire(timeout=timeout):
+            raise Exception("too many concurrent xunfei connections")
+        try:
+            logger.info(f"[XunFei] start connect, prompt={messages}")
+            ws = websocket.create_connection(self.create_url(), timeout=timeout, sslopt={"cert_reqs": ssl.CERT_NONE})
+            try:
+                ws.send(json.dumps(gen_params(appid=self.app_id, domain=self.domain, question=messages, temperature=temperature)))
+                while True:
+                    data = json.loads(ws.recv())
+                    code = data["header"]["code"]
+                    if code != 0:
+                        raise Exception(f"请求错误: {code}, {data}")
+                    choices = data["payload"]["choices"]
+                    content = choices["text"][0]["content"]
+                    if content:
+                        yield content
+                    if choices["status"] == 2:
+                        if usage is not None:
+                            usage.update(data["payload"].get("usage") or {})
+                        return
+            finally:
+                ws.close()
+        finally:
+            self.connection_slots.release()
 
     # 生成url
     def create_url(self):
@@ -183,65 +164,6 @@ class XunFeiBot(Bot):
         return data
 
 
-class ReplyItem:
-    def __init__(self, reply, usage=None, is_end=False):
-        self.is_end = is_end
-        self.reply = reply
-        self.usage = usage
-
-
-# 收到websocket错误的处理
-def on_error(ws, error):
-    logger.error(f"[XunFei] error: {str(error)}")
-
-
-# 收到websocket关闭的处理
-def on_close(ws, one, two):
-    data_queue = queue_map.get(ws.session_id)
-    data_queue.put("END")
-
-
-# 收到websocket连接建立的处理
-def on_open(ws):
-    logger.info(f"[XunFei] Start websocket, session_id={ws.session_id}")
-    thread.start_new_thread(run, (ws, ))
-
-
-def run(ws, *args):
-    data = json.dumps(
-        gen_params(appid=ws.appid,
-                   domain=ws.domain,
-                   question=ws.question,
-                   temperature=ws.temperature))
-    ws.send(data)
-
-
-# Websocket 操作
-# 收到websocket消息的处理
-def on_message(ws, message):
-    data = json.loads(message)
-    code = data['header']['code']
-    if code != 0:
-        logger.error(f'请求错误: {code}, {data}')
-        ws.close()
-    else:
-        choices = data["payload"]["choices"]
-        status = choices["status"]
-        content = choices["text"][0]["content"]
-        data_queue = queue_map.get(ws.session_id)
-        if not data_queue:
-            logger.error(
-                f"[XunFei] can't find data queue, session_id={ws.session_id}")
-            return
-        reply_item = ReplyItem(content)
-        if status == 2:
-            usage = data["payload"].get("usage")
-            reply_item = ReplyItem(content, usage)
-            reply_item.is_end = True
-            ws.close()
-        data_queue.put(reply_item)
-
-
 def gen_params(appid, domain, question, temperature=0.5):
     """
     通过appid和用户的提问来生成请参数
@@ -1,9 +1,14 @@
+import threading
+import time
+
 from bot.bot_factory import create_bot
 from bridge.context import Context
-from bridge.reply import Reply
+from bridge.reply import Reply, ReplyType
 from common import const
+from common.circuit_breaker import get_breaker
 from common.log import logger
 from common.singleton import singleton
+from common.token_bucket import KeyedTokenBucket
 from config import conf
 from translate.factory import create_translator
 from voice.factory import create_voice
@@ -66,11 +71,23 @@ class Bridge(object):
 
         self.bots = {}
         self.chat_bots = {}
+        self.failover_bot = None
+        self.failover_lock = threading.Lock()
+        self.user_limiter = self._create_limiter("rate_limit_user")
+        self.group_limiter = self._create_limiter("rate_limit_group")
+        self.model_limiter = self._create_limiter("rate_limit_model_tpm")
+
+    @staticmethod
+    def _create_limiter(key):
+        tpm = conf().get(key, 0)
+        if not tpm:
+            return None
+        return KeyedTokenBucket(tpm, max_keys=conf().get("rate_limit_max_keys", 10000))
 
     # 模型对应的接口
     def get_bot(self, typename):
         if self.bots.get(typename) is None:
-            logger.info("create bot {} for {}".format(self.btype[typename], typename))
+            logger.info("create bot %s for %s", self.btype[typename], typename)
             if typename == "text_to_voice":
                 self.bots[typename] = create_voice(self.btype[typename])
             elif typename == "voice_to_text":
@@ -84,8 +101,69 @@ class Bridge(object):
     def get_bot_type(self, typename):
         return self.btype[typename]
 
+    def _check_rate_limit(self, bot_type, query, context: Context):
+        """
+        依次按群、用户、模型限流，不等待令牌，返回触发限流的key，未触发返回None
+
+        被后面的限流器拒绝时归还前面已经取到的令牌，被拒绝的请求不消耗群和用户的额度
+        """
+        msg = context.get("msg")
+        isgroup = context.get("isgroup", False)
+        checks = []
+        if self.group_limiter and isgroup:
+            checks.append((self.group_limiter, "group:" + str(context.get("receiver")), 1))
+        if self.user_limiter:
+            if msg is not None:
+                user_id = msg.actual_user_id if isgroup else msg.from_user_id
+            else:
+                user_id = context.get("session_id")
+            checks.append((self.user_limiter, "user:" + str(user_id), 1))
+        if self.model_limiter:
+            model = context.get("gpt_model") or conf().get("model")
+            checks.append((self.model_limiter, "model:{}:{}".format(bot_type, model), max(1, len(query or ""))))
+        acquired = []
+        for limiter, key, cost in checks:
+            if limiter.try_acquire(key, cost) > 0:
+                for acquired_limiter, acquired_key, acquired_cost in acquired:
+                    acquired_limiter.refund(acquired_key, acquired_cost)
+                return key
+            acquired.append((limiter, key, cost))
+        return None
+
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot_type = self.btype["chat"]
+        limited_key = self._check_rate_limit(bot_type, query, context)
+        if limited_key:
+            logger.info("[Bridge] rate limited, key=%s", limited_key)
+            return Reply(ReplyType.TEXT, conf().get("rate_limit_reply", "提问太快啦，请休息一下再问我吧"))
+        bot = self.get_bot("chat")
+        breaker = get_breaker("chat:" + bot_type)
+        if breaker is None or bot.manages_circuit_breaker:
+            return bot.reply(query, context)
+        if not breaker.allow_request():
+            logger.info("[Bridge] circuit breaker of %s is open, use failover model", bot_type)
+            return self.get_failover_bot().reply(query, context)
+        start = time.monotonic()
+        try:
+            reply = bot.reply(query, context)
+        except Exception:
+            breaker.record(False, time.monotonic() - start)
+            raise
+        breaker.record(reply is not None and reply.type != ReplyType.ERROR, time.monotonic() - start)
+        return reply
+
+    def get_failover_bot(self):
+        """熔断期间使用的备用模型，使用failover_model相关配置"""
+        from bot.chatgpt.chat_gpt_bot import ChatGPTBot, ChatGPTClientConf
+        client_conf = ChatGPTClientConf.failover()
+        # failover_bot为(配置, bot)，#reconf等修改了failover_*配置时重新创建
+        cached = self.failover_bot
+        if cached is None or cached[0] != client_conf.key():
+            with self.failover_lock:
+                cached = self.failover_bot
+                if cached is None or cached[0] != client_conf.key():
+                    cached = self.failover_bot = (client_conf.key(), ChatGPTBot(client_conf))
+        return cached[1]
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
@@ -31,6 +31,7 @@ class Context:
         self.type = type
         self.content = content
         self.kwargs = kwargs
+        self.trace = None  # 处理流程各阶段的耗时记录，见common/trace.py
 
     def __contains__(self, key):
         if key == "type":
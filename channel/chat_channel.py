@@ -1,15 +1,18 @@
 import os
-import re
 import threading
 import time
-from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import CancelledError, Future
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
 from common.dequeue import Dequeue
+from common.handler_pool import HandlerPool, OVERFLOW_BLOCK, OVERFLOW_REJECT
 from common import memory
+from common.metrics import gauge
+from common.trace import Trace, trace_mark, trace_span
+from common.trigger_matcher import get_trigger_index, mention_pattern
 from plugins import *
 
 try:
@@ -17,8 +20,6 @@ try:
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
-
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
 class ChatChannel(Channel):
@@ -26,17 +27,57 @@ class ChatChannel(Channel):
     user_id = None  # 登录的用户id
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
-    lock = threading.Lock()  # 用于控制对sessions的访问
+    lock = threading.RLock()  # 用于控制对sessions的访问，取消future时会在持有锁的线程中触发回调，因此使用可重入锁
+    ready_sessions = deque()  # 可能有待处理消息的session_id，由produce和任务结束回调放入，consume取出
+    ready_cond = threading.Condition(lock)  # 有session就绪时唤醒consume
 
     def __init__(self):
+        self._handler_pool = None
+        self._reject_pool = None
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
 
+    @property
+    def handler_pool(self) -> HandlerPool:
+        """
+        处理消息的线程池，首次使用时按通道类型创建，此时channel_type已由channel_factory设置
+        """
+        if self._handler_pool is None:
+            with self.lock:
+                if self._handler_pool is None:
+                    pool_size = conf().get("handler_pool_channel_sizes", {}).get(self.channel_type) or conf().get("handler_pool_size", 8)
+                    self._handler_pool = HandlerPool(
+                        max_workers=pool_size,
+                        max_pending=conf().get("handler_pool_max_pending", 0),
+                        overflow_policy=conf().get("handler_pool_overflow_policy", OVERFLOW_BLOCK),
+                        name=self.channel_type,
+                    )
+                    # 回复拒绝消息的线程池，过载时也不会无限创建线程，排队已满时不再回复
+                    self._reject_pool = HandlerPool(max_workers=2, max_pending=100, overflow_policy=OVERFLOW_REJECT, name=f"{self.channel_type}_reject")
+                    gauge("chat_session_queued_messages", func=self._session_queued_total, channel=self.channel_type)
+                    gauge("chat_session_queue_depth_max", func=self._session_queue_depth_max, channel=self.channel_type)
+                    logger.info("[chat_channel] handler pool created, channel_type=%s, max_workers=%s", self.channel_type, pool_size)
+        return self._handler_pool
+
+    def _session_queued_total(self):
+        """所有session中排队等待处理的消息数"""
+        with self.lock:
+            return sum(session[0].qsize() for session in self.sessions.values())
+
+    def _session_queue_depth_max(self):
+        """排队消息最多的session的排队数"""
+        with self.lock:
+            return max((session[0].qsize() for session in self.sessions.values()), default=0)
+
     # 根据消息构造context，消息内容相关的触发项写在这里
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
+        received_at = getattr(kwargs.get("msg"), "received_at", None)
+        context.trace = Trace(received_at)
+        if received_at is not None:
+            context.trace.mark("ingest")  # 收到回调到开始构造context，包括解析消息和异步接收队列的等待
         if ctype == ContextType.ACCEPT_FRIEND:
             return context
         # context首次传入时，origin_ctype是None,
@@ -47,8 +88,8 @@ class ChatChannel(Channel):
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
+        trigger = get_trigger_index()
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -58,28 +99,14 @@ class ChatChannel(Channel):
                 group_id = cmsg.other_user_id
                 context["group_name"] = group_name
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if trigger.is_group_allowed(group_name):
                     session_id = f"{cmsg.actual_user_id}@@{group_id}" # 当群聊未共享session时，session_id为user_id与group_id的组合，用于区分不同群聊以及单聊
                     context["is_shared_session_group"] = False  # 默认为非共享会话群
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if trigger.is_group_in_one_session(group_name):
                         session_id = group_id
                         context["is_shared_session_group"] = True  # 如果是共享会话群，设置为True
                 else:
-                    logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
+                    logger.debug("No need reply, groupName not in whitelist, group_name=%s", group_name)
                     return None
                 context["session_id"] = session_id
                 context["receiver"] = group_id
@@ -90,47 +117,43 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not trigger.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
         # 消息内容匹配过程，并处理content
         if ctype == ContextType.TEXT:
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
 
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = trigger.group_chat_prefix.match(content)
+                match_contain = trigger.group_chat_keyword.contains(content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     logger.debug("[chat_channel] to_user_id != actual_user_id 条件成立")
 
-                    if match_prefix is not None or match_contain is not None:
+                    if match_prefix is not None or match_contain:
                         flag = True
                         if match_prefix:
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if nick_name and nick_name in trigger.nick_name_black_list:
                             # 黑名单过滤
-                            logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
+                            logger.warning("[chat_channel] Nickname %s in In BlackList, ignore", nick_name)
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not trigger.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = mention_pattern(self.name).sub(r"", content)
                         if isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = mention_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = mention_pattern(context["msg"].self_display_name).sub(r"", content)
                         content = subtract_res
                 else:
                     logger.debug("[chat_channel] to_user_id == actual_user_id 条件不成立，消息被过滤")
@@ -141,12 +164,12 @@ class ChatChannel(Channel):
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if nick_name and nick_name in trigger.nick_name_black_list:
                     # 黑名单过滤
-                    logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
+                    logger.warning("[chat_channel] Nickname '%s' in In BlackList, ignore", nick_name)
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = trigger.single_chat_prefix.match(content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
@@ -154,37 +177,43 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = trigger.image_create_prefix.match(content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
-                    "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and trigger.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
-                    "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and trigger.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
     def _handle(self, context: Context):
         if context is None or not context.content:
             return
-        logger.debug("[chat_channel] ready to handle context: {}".format(context))
-        # reply的构建步骤
-        reply = self._generate_reply(context)
+        trace_mark(context, "queue")
+        try:
+            logger.debug("[chat_channel] ready to handle context: %s", context)
+            # reply的构建步骤
+            reply = self._generate_reply(context)
+            trace_mark(context, "generate")
 
-        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+            logger.debug("[chat_channel] ready to decorate reply: %s", reply)
 
-        # reply的包装步骤
-        if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
+            # reply的包装步骤
+            if reply and reply.content:
+                reply = self._decorate_reply(context, reply)
+                trace_mark(context, "decorate")
 
-            # reply的发送步骤
-            self._send_reply(context, reply)
+                # reply的发送步骤
+                self._send_reply(context, reply)
+                trace_mark(context, "send")
+        finally:
+            if context.trace is not None:
+                context.trace.finish()
 
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         e_context = PluginManager().emit_event(
@@ -195,7 +224,7 @@ class ChatChannel(Channel):
         )
         reply = e_context["reply"]
         if not e_context.is_pass():
-            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+            logger.debug("[chat_channel] ready to handle context: type=%s, content=%s", context.type, context.content)
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
                 reply = super().build_reply_content(context.content, context)
@@ -205,12 +234,14 @@ class ChatChannel(Channel):
                 file_path = context.content
                 wav_path = os.path.splitext(file_path)[0] + ".wav"
                 try:
-                    any_to_wav(file_path, wav_path)
+                    with trace_span(context, "voice_convert"):
+                        any_to_wav(file_path, wav_path)
                 except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
                     logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
                     wav_path = file_path
                 # 语音识别
-                reply = super().build_voice_to_text(wav_path)
+                with trace_span(context, "asr"):
+                    reply = super().build_voice_to_text(wav_path)
                 # 删除临时文件
                 try:
                     os.remove(file_path)
@@ -223,6 +254,7 @@ class ChatChannel(Channel):
                 if reply.type == ReplyType.TEXT:
                     new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
                     if new_context:
+                        new_context.trace = context.trace  # 语音转文字后的处理计入原消息的trace
                         reply = self._generate_reply(new_context)
                     else:
                         return
@@ -238,7 +270,7 @@ class ChatChannel(Channel):
             elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
                 pass
             else:
-                logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+                logger.warning("[chat_channel] unknown context type: %s", context.type)
                 return
         return reply
 
@@ -261,7 +293,8 @@ class ChatChannel(Channel):
                 if reply.type == ReplyType.TEXT:
                     reply_text = reply.content
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
-                        reply = super().build_text_to_voice(reply.content)
+                        with trace_span(context, "tts"):
+                            reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
                     if context.get("isgroup", False):
                         if not context.get("no_need_at", False):
@@ -279,10 +312,10 @@ class ChatChannel(Channel):
                 elif reply.type == ReplyType.ACCEPT_FRIEND:
                     pass
                 else:
-                    logger.error("[chat_channel] unknown reply type: {}".format(reply.type))
+                    logger.error("[chat_channel] unknown reply type: %s", reply.type)
                     return
             if desire_rtype and desire_rtype != reply.type and reply.type not in [ReplyType.ERROR, ReplyType.INFO]:
-                logger.warning("[chat_channel] desire_rtype: {}, but reply type: {}".format(context.get("desire_rtype"), reply.type))
+                logger.warning("[chat_channel] desire_rtype: %s, but reply type: %s", context.get("desire_rtype"), reply.type)
             return reply
 
     def _send_reply(self, context: Context, reply: Reply):
@@ -295,38 +328,43 @@ class ChatChannel(Channel):
             )
             reply = e_context["reply"]
             if not e_context.is_pass() and reply and reply.type:
-                logger.debug("[chat_channel] ready to send reply: {}, context: {}".format(reply, context))
+                logger.debug("[chat_channel] ready to send reply: %s, context: %s", reply, context)
                 self._send(reply, context)
 
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
         try:
-            self.send(reply, context)
+            with trace_span(context, "send_attempt"):
+                self.send(reply, context)
         except Exception as e:
-            logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
+            logger.error("[chat_channel] sendMsg error: %s", str(e))
             if isinstance(e, NotImplementedError):
                 return
             logger.exception(e)
             if retry_cnt < 2:
-                time.sleep(3 + 3 * retry_cnt)
+                with trace_span(context, "send_retry_wait"):
+                    time.sleep(3 + 3 * retry_cnt)
                 self._send(reply, context, retry_cnt + 1)
 
     # 处理好友申请
     def _build_friend_request_reply(self, context):
         if isinstance(context.content, dict) and "Content" in context.content:
-            logger.info("friend request content: {}".format(context.content["Content"]))
+            logger.info("friend request content: %s", context.content["Content"])
             if context.content["Content"] in conf().get("accept_friend_commands", []):
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=True)
             else:
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=False)
         else:
-            logger.error("Invalid context content: {}".format(context.content))
+            logger.error("Invalid context content: %s", context.content)
             return None
 
     def _success_callback(self, session_id, **kwargs):  # 线程正常结束时的回调函数
-        logger.debug("Worker return success, session_id = {}".format(session_id))
+        logger.debug("Worker return success, session_id = %s", session_id)
 
     def _fail_callback(self, session_id, exception, **kwargs):  # 线程异常结束时的回调函数
-        logger.exception("Worker return exception: {}".format(exception))
+        logger.exception("Worker return exception: %s", exception)
+
+    def _dropped_callback(self, session_id, **kwargs):  # 消息被取消、丢弃或因排队已满被拒绝，没有执行时的回调函数
+        logger.info("Worker dropped, session_id = %s", session_id)
 
     def _thread_pool_callback(self, session_id, **kwargs):
         def func(worker: Future):
@@ -336,18 +374,24 @@ class ChatChannel(Channel):
                     self._fail_callback(session_id, exception=worker_exception, **kwargs)
                 else:
                     self._success_callback(session_id, **kwargs)
-            except CancelledError as e:
-                logger.info("Worker cancelled, session_id = {}".format(session_id))
+            except CancelledError:
+                self._dropped_callback(session_id, **kwargs)
             except Exception as e:
-                logger.exception("Worker raise exception: {}".format(e))
-            with self.lock:
+                logger.exception("Worker raise exception: %s", e)
+            with self.ready_cond:
                 self.sessions[session_id][1].release()
+                if self.futures.get(session_id):
+                    self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
+                # 释放了并发额度，session可能有排队的消息可以处理，或者需要清理
+                self.ready_sessions.append(session_id)
+                self.ready_cond.notify()
 
         return func
 
     def produce(self, context: Context):
         session_id = context.get("session_id", 0)
-        with self.lock:
+        trace_mark(context, "compose")
+        with self.ready_cond:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
@@ -357,53 +401,86 @@ class ChatChannel(Channel):
                 self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
             else:
                 self.sessions[session_id][0].put(context)
+            self.ready_sessions.append(session_id)
+            self.ready_cond.notify()
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，等待有session就绪后从消息队列中取出消息并处理，空闲的session不会被轮询
     def consume(self):
         while True:
+            with self.ready_cond:
+                while not self.ready_sessions:
+                    self.ready_cond.wait()
+                session_id = self.ready_sessions.popleft()
+                if session_id not in self.sessions:
+                    continue
+                context_queue, semaphore = self.sessions[session_id]
+                if context_queue.empty():
+                    if semaphore._value == semaphore._initial_value:  # 没有正在处理的任务，说明所有任务都处理完毕
+                        self.futures[session_id] = [t for t in self.futures.get(session_id, []) if not t.done()]
+                        assert len(self.futures[session_id]) == 0, "thread pool error"
+                        del self.futures[session_id]
+                        del self.sessions[session_id]
+                    continue
+                if not semaphore.acquire(blocking=False):  # 并发已满，等待任务结束的回调再次放入就绪队列
+                    continue
+                context = context_queue.get()
+                if not context_queue.empty():  # 仍有排队消息，允许在并发额度内继续处理
+                    self.ready_sessions.append(session_id)
+            logger.debug("[chat_channel] consume context: %s", context)
+            # 在锁外提交，线程池排队已满且策略为block时会在这里等待
+            future: Future = self.handler_pool.submit(self._handle, context)
+            if future is None:
+                self._reject_context(session_id, context)
+                continue
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+                self.futures.setdefault(session_id, []).append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+
+    # 线程池排队已满，拒绝处理该消息并回复用户
+    def _reject_context(self, session_id, context: Context):
+        logger.warning("[chat_channel] handler pool is full, reject context: session_id=%s", session_id)
+        with self.ready_cond:
+            self.sessions[session_id][1].release()
+            self.ready_sessions.append(session_id)
+            self.ready_cond.notify()
+        reject_reply = conf().get("handler_pool_reject_reply")
+        if reject_reply and context.get("receiver"):
+            reply = Reply(ReplyType.TEXT, reject_reply)
+            # 只尝试发送一次，不重试等待，避免过载时占用线程；发送后再调用_dropped_callback
+            if self._reject_pool.submit(self._send_reject_reply, session_id, reply, context) is not None:
+                return
+            logger.warning("[chat_channel] reject reply pool is full, skip reject reply: session_id=%s", session_id)
+        self._dropped_callback(session_id, context=context)
+
+    def _send_reject_reply(self, session_id, reply: Reply, context: Context):
+        try:
+            reply = self._decorate_reply(context, reply)
+            if reply and reply.type:
+                self.send(reply, context)
+        except Exception as e:
+            logger.warning("[chat_channel] send reject reply failed: %s", e)
+        finally:
+            self._dropped_callback(session_id, context=context)
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
             if session_id in self.sessions:
-                for future in self.futures[session_id]:
+                for future in self.futures.get(session_id, []):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    logger.info("Cancel %s messages in session %s", cnt, session_id)
                 self.sessions[session_id][0] = Dequeue()
 
     def cancel_all_session(self):
         with self.lock:
-            for session_id in self.sessions:
-                for future in self.futures[session_id]:
+            for session_id in list(self.sessions):
+                for future in self.futures.get(session_id, []):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    logger.info("Cancel %s messages in session %s", cnt, session_id)
                 self.sessions[session_id][0] = Dequeue()
 
 
@@ -6,6 +6,7 @@
 ChatMessage
 msg_id: 消息id (必填)
 create_time: 消息创建时间
+received_at: 收到消息回调的时间(time.monotonic())，用于统计处理流程耗时，可不填
 
 ctype: 消息类型 : ContextType (必填)
 content: 消息内容, 如果是声音/图片，这里是文件路径 (必填)
@@ -36,6 +37,7 @@ _rawmsg: 原始消息对象
 class ChatMessage(object):
     msg_id = None
     create_time = None
+    received_at = None
 
     ctype = None
     content = None
@@ -14,7 +14,9 @@ from channel.feishu.feishu_message import FeishuMessage
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.web_server import run_wsgi_app
 from common.singleton import singleton
+from common.token_manager import TokenManager
 from config import conf
 from common.expired_dict import ExpiredDict
 from bridge.context import ContextType
@@ -48,7 +50,7 @@ class FeiShuChanel(ChatChannel):
         )
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("feishu_port", 9891)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_wsgi_app(app.wsgifunc(), port)
 
     def send(self, reply: Reply, context: Context):
         msg = context.get("msg")
@@ -98,6 +100,14 @@ class FeiShuChanel(ChatChannel):
 
 
     def fetch_access_token(self) -> str:
+        """获取tenant_access_token，有效期内使用缓存，获取失败时返回空字符串"""
+        try:
+            return TokenManager().get_token("feishu:" + str(self.feishu_app_id), self._request_access_token)
+        except Exception as e:
+            logger.error(f"[FeiShu] fetch token error, {e}")
+            return ""
+
+    def _request_access_token(self):
         url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal/"
         headers = {
             "Content-Type": "application/json"
@@ -108,15 +118,12 @@ class FeiShuChanel(ChatChannel):
         }
         data = bytes(json.dumps(req_body), encoding='utf8')
         response = requests.post(url=url, data=data, headers=headers)
-        if response.status_code == 200:
-            res = response.json()
-            if res.get("code") != 0:
-                logger.error(f"[FeiShu] get tenant_access_token error, code={res.get('code')}, msg={res.get('msg')}")
-                return ""
-            else:
-                return res.get("tenant_access_token")
-        else:
-            logger.error(f"[FeiShu] fetch token error, res={response}")
+        if response.status_code != 200:
+            raise Exception(f"res={response}")
+        res = response.json()
+        if res.get("code") != 0:
+            raise Exception(f"get tenant_access_token error, code={res.get('code')}, msg={res.get('msg')}")
+        return res.get("tenant_access_token"), res.get("expire", 7200)
 
 
     def _upload_image_url(self, img_url, access_token):
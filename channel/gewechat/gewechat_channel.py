@@ -1,7 +1,10 @@
 import os
+import queue
+import threading
 import time
 import json
 import web
+from functools import lru_cache
 from urllib.parse import urlparse
 
 from bridge.context import Context, ContextType
@@ -9,6 +12,8 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
 from channel.gewechat.gewechat_message import GeWeChatMessage
 from common.log import logger
+from common.metrics import counter, gauge, histogram
+from common.web_server import run_wsgi_app, serve_file
 from common.singleton import singleton
 from common.tmp_dir import TmpDir
 from config import conf, save_config
@@ -16,6 +21,7 @@ from lib.gewechat import GewechatClient
 from voice.audio_convert import mp3_to_silk
 import uuid
 import re
+import zlib
 
 MAX_UTF8_LEN = 2048
 
@@ -39,12 +45,12 @@ class GeWeChatChannel(ChatChannel):
             token_resp = self.client.get_token()
             # {'ret': 200, 'msg': '执行成功', 'data': 'tokenxxx'}
             if token_resp.get("ret") != 200:
-                logger.error(f"[gewechat] get token failed: {token_resp}")
+                logger.error("[gewechat] get token failed: %s", token_resp)
                 return
             self.token = token_resp.get("data")
             conf().set("gewechat_token", self.token)
             save_config()
-            logger.info(f"[gewechat] new token saved: {self.token}")
+            logger.info("[gewechat] new token saved: %s", self.token)
             self.client = GewechatClient(self.base_url, self.token)
 
         self.app_id = conf().get("gewechat_app_id")
@@ -55,20 +61,33 @@ class GeWeChatChannel(ChatChannel):
         if not self.download_url:
             logger.warning("[gewechat] download_url is not set, unable to download image")
 
-        logger.info(f"[gewechat] init: base_url: {self.base_url}, token: {self.token}, app_id: {self.app_id}, download_url: {self.download_url}")
+        logger.info("[gewechat] init: base_url: %s, token: %s, app_id: %s, download_url: %s", self.base_url, self.token, self.app_id, self.download_url)
+
+        # 异步接收模式：回调请求线程只做轻量校验后立即返回，消息解析与context构造交给后台线程
+        # 按会话(私聊对方/群)分片，同一会话的消息总由同一个线程按顺序处理
+        self.ingest_queues = []
+        if conf().get("gewechat_async_ingest", False):
+            worker_num = max(1, conf().get("gewechat_ingest_workers", 2))
+            queue_size = max(1, conf().get("gewechat_ingest_queue_size", 1000) // worker_num)
+            for i in range(worker_num):
+                ingest_queue = queue.Queue(maxsize=queue_size)
+                self.ingest_queues.append(ingest_queue)
+                gauge("gewechat_ingest_queue_depth", func=ingest_queue.qsize, shard=str(i))
+                threading.Thread(target=self._ingest_worker, args=(ingest_queue,), name=f"gewechat-ingest-{i}", daemon=True).start()
+            logger.info("[gewechat] async ingest enabled, workers: %s, queue size per worker: %s", worker_num, queue_size)
 
     def startup(self):
         # 如果app_id为空或登录后获取到新的app_id，保存配置
         app_id, error_msg = self.client.login(self.app_id)
         if error_msg:
-            logger.error(f"[gewechat] login failed: {error_msg}")
+            logger.error("[gewechat] login failed: %s", error_msg)
             return
 
         # 如果原来的self.app_id为空或登录后获取到新的app_id，保存配置
         if not self.app_id or self.app_id != app_id:
             conf().set("gewechat_app_id", app_id)
             save_config()
-            logger.info(f"[gewechat] new app_id saved: {app_id}")
+            logger.info("[gewechat] new app_id saved: %s", app_id)
             self.app_id = app_id
 
         # 获取回调地址，示例地址：http://172.17.0.1:9919/v2/api/callback/collect  
@@ -88,7 +107,7 @@ class GeWeChatChannel(ChatChannel):
             # 设置回调地址，{ "ret": 200, "msg": "操作成功" }
             callback_resp = self.client.set_callback(self.token, callback_url)
             if callback_resp.get("ret") != 200:
-                logger.error(f"[gewechat] set callback failed: {callback_resp}")
+                logger.error("[gewechat] set callback failed: %s", callback_resp)
                 return
             logger.info("[gewechat] callback set successfully")
 
@@ -100,10 +119,82 @@ class GeWeChatChannel(ChatChannel):
         path = parsed_url.path
         # 如果没有指定端口，使用默认端口80
         port = parsed_url.port or 80
-        logger.info(f"[gewechat] start callback server: {callback_url}, using port {port}")
+        logger.info("[gewechat] start callback server: %s, using port %s", callback_url, port)
         urls = (path, "channel.gewechat.gewechat_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_wsgi_app(app.wsgifunc(), port)
+
+    def submit_callback(self, data):
+        """
+        提交回调消息。未开启异步接收时直接在当前线程处理；
+        开启后按会话放入对应的有界队列，队列已满时阻塞回调请求(背压)，保证消息不丢失且同一会话的消息不乱序
+        """
+        received_at = time.monotonic()
+        if not self.ingest_queues:
+            self.handle_callback(data, received_at)
+            return
+        ingest_queue = self.ingest_queues[self._ingest_shard(data)]
+        try:
+            ingest_queue.put_nowait((data, received_at))
+        except queue.Full:
+            logger.warning("[gewechat] ingest queue is full, wait for the worker, qsize: %s", ingest_queue.qsize())
+            counter("gewechat_ingest_messages_total", result="blocked").inc()
+            ingest_queue.put((data, received_at))
+        counter("gewechat_ingest_messages_total", result="queued").inc()
+
+    def _ingest_shard(self, data):
+        """群消息的FromUserName是群id，私聊是对方的wxid，同一会话的消息落到同一个队列"""
+        session_key = ""
+        if isinstance(data, dict):
+            session_key = ((data.get("Data") or {}).get("FromUserName") or {}).get("string") or ""
+        return zlib.crc32(session_key.encode("utf-8")) % len(self.ingest_queues)
+
+    def _ingest_worker(self, ingest_queue):
+        while True:
+            data, enqueue_time = ingest_queue.get()
+            histogram("gewechat_ingest_wait_seconds").observe(time.monotonic() - enqueue_time)
+            try:
+                self.handle_callback(data, enqueue_time)
+                counter("gewechat_ingest_messages_total", result="processed").inc()
+            except Exception as e:
+                counter("gewechat_ingest_messages_total", result="failed").inc()
+                logger.exception("[gewechat] handle callback failed: %s", e)
+            finally:
+                ingest_queue.task_done()
+
+    def handle_callback(self, data, received_at=None):
+        """解析回调消息，构造context并放入消息队列"""
+        gewechat_msg = GeWeChatMessage(data, self.client)
+        gewechat_msg.received_at = received_at
+
+        # 微信客户端的状态同步消息
+        if gewechat_msg.ctype == ContextType.STATUS_SYNC:
+            logger.debug("[gewechat] ignore status sync message: %s", gewechat_msg.content)
+            return
+
+        # 忽略非用户消息（如公众号、系统通知等）
+        if gewechat_msg.ctype == ContextType.NON_USER_MSG:
+            logger.debug("[gewechat] ignore non-user message from %s: %s", gewechat_msg.from_user_id, gewechat_msg.content)
+            return
+
+        # 忽略来自自己的消息
+        if gewechat_msg.my_msg:
+            logger.debug("[gewechat] ignore message from myself: %s: %s", gewechat_msg.actual_user_id, gewechat_msg.content)
+            return
+
+        # 忽略过期的消息
+        if int(gewechat_msg.create_time) < int(time.time()) - 60 * 5: # 跳过5分钟前的历史消息
+            logger.debug("[gewechat] ignore expired message from %s: %s", gewechat_msg.actual_user_id, gewechat_msg.content)
+            return
+
+        context = self._compose_context(
+            gewechat_msg.ctype,
+            gewechat_msg.content,
+            isgroup=gewechat_msg.is_group,
+            msg=gewechat_msg,
+        )
+        if context:
+            self.produce(context)
 
     def remove_markdown(self, text: str) -> str:
         """
@@ -141,14 +232,14 @@ class GeWeChatChannel(ChatChannel):
                 at_pattern1 = f"@{gewechat_message.actual_user_nickname}\n"
                 at_pattern2 = f"@{gewechat_message.actual_user_nickname}"
                 already_at_user = at_pattern1 in reply_text or (at_pattern2 in reply_text and not at_pattern2 + "\n" in reply_text)
-                logger.debug(f"[gewechat] 检查@用户: nickname={gewechat_message.actual_user_nickname}, already_at_user={already_at_user}, reply_text={reply_text[:50]}...")
+                logger.debug("[gewechat] 检查@用户: nickname=%s, already_at_user=%s, reply_text=%s...", gewechat_message.actual_user_nickname, already_at_user, reply_text[:50])
             
-            # 只有在没有已经@用户的情况下才设置ats参数
-            if gewechat_message and gewechat_message.is_group and not already_at_user:
+            # 只有在没有已经@用户的情况下才设置ats参数，流式回复的后续分段设置了no_need_at，不再@
+            if gewechat_message and gewechat_message.is_group and not already_at_user and not context.get("no_need_at", False):
                 ats = gewechat_message.actual_user_id
             
             self.client.post_text(self.app_id, receiver, reply_text, ats)
-            logger.info("[gewechat] Do send text to {}: {}".format(receiver, reply_text))
+            logger.info("[gewechat] Do send text to %s: %s", receiver, reply_text)
         elif reply.type == ReplyType.VOICE:
             try:
                 content = reply.content
@@ -159,12 +250,12 @@ class GeWeChatChannel(ChatChannel):
                     callback_url = conf().get("gewechat_callback_url")
                     silk_url = callback_url + "?file=" + silk_path
                     self.client.post_voice(self.app_id, receiver, silk_url, duration)
-                    logger.info(f"[gewechat] Do send voice to {receiver}: {silk_url}, duration: {duration/1000.0} seconds")
+                    logger.info("[gewechat] Do send voice to %s: %s, duration: %s seconds", receiver, silk_url, duration/1000.0)
                     return
                 else:
-                    logger.error(f"[gewechat] voice file is not mp3, path: {content}, only support mp3")
+                    logger.error("[gewechat] voice file is not mp3, path: %s, only support mp3", content)
             except Exception as e:
-                logger.error(f"[gewechat] send voice failed: {e}")
+                logger.error("[gewechat] send voice failed: %s", e)
         elif reply.type == ReplyType.FILE:
             try:
                 file_path = reply.content
@@ -176,9 +267,9 @@ class GeWeChatChannel(ChatChannel):
                 
                 # 调用发送文件API
                 self.client.post_file(self.app_id, receiver, file_url, file_name)
-                logger.info(f"[gewechat] Do send file to {receiver}: file_name={file_name}, file_url={file_url}")
+                logger.info("[gewechat] Do send file to %s: file_name=%s, file_url=%s", receiver, file_name, file_url)
             except Exception as e:
-                logger.error(f"[gewechat] send file failed: {e}")
+                logger.error("[gewechat] send file failed: %s", e)
         elif reply.type == ReplyType.VIDEO:
             try:
                 video_path = reply.content
@@ -190,13 +281,13 @@ class GeWeChatChannel(ChatChannel):
                 
                 # 使用post_file API发送视频
                 self.client.post_file(self.app_id, receiver, video_url, video_name)
-                logger.info(f"[gewechat] Do send video to {receiver}: video_name={video_name}, video_url={video_url}")
+                logger.info("[gewechat] Do send video to %s: video_name=%s, video_url=%s", receiver, video_name, video_url)
             except Exception as e:
-                logger.error(f"[gewechat] send video failed: {e}")
+                logger.error("[gewechat] send video failed: %s", e)
         elif reply.type == ReplyType.IMAGE_URL:
             img_url = reply.content
             self.client.post_image(self.app_id, receiver, img_url)
-            logger.info("[gewechat] sendImage url={}, receiver={}".format(img_url, receiver))
+            logger.info("[gewechat] sendImage url=%s, receiver=%s", img_url, receiver)
         elif reply.type == ReplyType.IMAGE:
             image_storage = reply.content
             image_storage.seek(0)
@@ -210,7 +301,21 @@ class GeWeChatChannel(ChatChannel):
             callback_url = conf().get("gewechat_callback_url")
             img_url = callback_url + "?file=" + img_file_path
             self.client.post_image(self.app_id, receiver, img_url)
-            logger.info("[gewechat] sendImage, receiver={}, url={}".format(receiver, img_url))
+            logger.info("[gewechat] sendImage, receiver=%s, url=%s", receiver, img_url)
+
+
+@lru_cache(maxsize=1024)
+def _resolve_tmp_file(file_path):
+    """返回文件的绝对路径，不在tmp目录下时返回None；同一个文件会被多次下载，缓存校验结果"""
+    # 使用os.path.abspath清理路径
+    clean_path = os.path.abspath(file_path)
+    # 获取tmp目录的绝对路径
+    tmp_dir = os.path.abspath("tmp")
+    # 检查文件路径是否在tmp目录下
+    if not clean_path.startswith(tmp_dir + os.sep):
+        return None
+    return clean_path
+
 
 class Query:
     def GET(self):
@@ -218,27 +323,22 @@ class Query:
         params = web.input(file="")
         file_path = params.file
         if file_path:
-            # 使用os.path.abspath清理路径
-            clean_path = os.path.abspath(file_path)
-            # 获取tmp目录的绝对路径
-            tmp_dir = os.path.abspath("tmp")
-            # 检查文件路径是否在tmp目录下
-            if not clean_path.startswith(tmp_dir):
-                logger.error(f"[gewechat] Forbidden access to file outside tmp directory: file_path={file_path}, clean_path={clean_path}, tmp_dir={tmp_dir}")
+            clean_path = _resolve_tmp_file(file_path)
+            if clean_path is None:
+                logger.error("[gewechat] Forbidden access to file outside tmp directory: file_path=%s", file_path)
                 raise web.forbidden()
 
-            if os.path.exists(clean_path):
-                with open(clean_path, 'rb') as f:
-                    return f.read()
+            if os.path.isfile(clean_path):
+                return serve_file(clean_path)
             else:
-                logger.error(f"[gewechat] File not found: {clean_path}")
+                logger.error("[gewechat] File not found: %s", clean_path)
                 raise web.notfound()
         return "gewechat callback server is running"
 
     def POST(self):
         channel = GeWeChatChannel()
         web_data = web.data()
-        logger.debug("[gewechat] receive data: {}".format(web_data))
+        logger.debug("[gewechat] receive data: %s", web_data)
         data = json.loads(web_data)
         
         # gewechat服务发送的回调测试消息
@@ -246,34 +346,16 @@ class Query:
             logger.debug(f"[gewechat] 收到gewechat服务发送的回调测试消息")
             return "success"
 
-        gewechat_msg = GeWeChatMessage(data, channel.client)
-        
-        # 微信客户端的状态同步消息
-        if gewechat_msg.ctype == ContextType.STATUS_SYNC:
-            logger.debug(f"[gewechat] ignore status sync message: {gewechat_msg.content}")
-            return "success"
-
-        # 忽略非用户消息（如公众号、系统通知等）
-        if gewechat_msg.ctype == ContextType.NON_USER_MSG:
-            logger.debug(f"[gewechat] ignore non-user message from {gewechat_msg.from_user_id}: {gewechat_msg.content}")
-            return "success"
+        if channel.ingest_queues and isinstance(data, dict):
+            # 异步接收模式下，在请求线程中先做不需要远程调用的轻量过滤
+            msg_data = data.get('Data') or {}
+            if data.get('Wxid') and data.get('Wxid') == msg_data.get('FromUserName', {}).get('string'):
+                logger.debug("[gewechat] ignore message from myself")
+                return "success"
+            create_time = int(msg_data.get('CreateTime') or 0)
+            if create_time and create_time < int(time.time()) - 60 * 5:
+                logger.debug("[gewechat] ignore expired message: %s", msg_data.get('NewMsgId'))
+                return "success"
 
-        # 忽略来自自己的消息
-        if gewechat_msg.my_msg:
-            logger.debug(f"[gewechat] ignore message from myself: {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
-            return "success"
-
-        # 忽略过期的消息
-        if int(gewechat_msg.create_time) < int(time.time()) - 60 * 5: # 跳过5分钟前的历史消息
-            logger.debug(f"[gewechat] ignore expired message from {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
-            return "success"
-
-        context = channel._compose_context(
-            gewechat_msg.ctype,
-            gewechat_msg.content,
-            isgroup=gewechat_msg.is_group,
-            msg=gewechat_msg,
-        )
-        if context:
-            channel.produce(context)
+        channel.submit_callback(data)
         return "success"
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+from common.log import logger
+from common.singleton import singleton
+from config import conf
+
+
+@singleton
+class GeWeChatContactCache(object):
+    """
+    gewechat联系人/群成员缓存，避免每条回调消息都实时调用get_brief_info和get_chatroom_member_list
+
+    - 联系人昵称：key为(app_id, wxid)，value为昵称
+    - 群成员：key为(app_id, chatroom_id)，value为{wxid: 昵称}字典，查找群成员为O(1)
+    两类缓存均有过期时间和最大条目数限制，超出时淘汰最久未使用的条目
+
+    群成员列表中找不到的成员(已退群、接口数据延迟等)在gewechat_member_miss_ttl秒内不再重新拉取；
+    同一个群同时只有一个线程拉取成员列表，其余线程等待并使用其结果
+    """
+
+    def __init__(self):
+        self.ttl = conf().get("gewechat_contact_cache_ttl", 600)
+        self.max_size = conf().get("gewechat_contact_cache_max_size", 1000)
+        self._contacts = OrderedDict()
+        self._members = OrderedDict()
+        self.miss_ttl = conf().get("gewechat_member_miss_ttl", 60)
+        # key为(app_id, chatroom_id, wxid)，拉取群成员列表后仍找不到的成员
+        self._member_misses = OrderedDict()
+        # key为(app_id, chatroom_id)，value为[拉取锁, 最近一次拉取完成的时间, 拉取结果]
+        self._member_fetches = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, cache, key):
+        with self._lock:
+            item = cache.get(key)
+            if item is None:
+                return None
+            value, expiry_time = item
+            if time.monotonic() > expiry_time:
+                del cache[key]
+                return None
+            cache.move_to_end(key)
+            return value
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _put(self, cache, key, value, ttl=None):
+        with self._lock:
+            cache[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            cache.move_to_end(key)
+            while len(cache) > self.max_size:
+                cache.popitem(last=False)
+
+    def get_nickname(self, client, app_id, wxid):
+        """获取群/好友的名称，未命中缓存时调用get_brief_info"""
+        key = (app_id, wxid)
+        nickname = self._get(self._contacts, key)
+        self._count(nickname is not None)
+        if nickname is not None:
+            return nickname
+        brief_info_response = client.get_brief_info(app_id, [wxid])
+        if brief_info_response['ret'] == 200 and brief_info_response['data']:
+            brief_info = brief_info_response['data'][0]
+            nickname = brief_info.get('nickName', '') or wxid
+            self._put(self._contacts, key, nickname)
+            return nickname
+        return None
+
+    def _get_member_fetch(self, key):
+        with self._lock:
+            fetch = self._member_fetches.get(key)
+            if fetch is None:
+                fetch = self._member_fetches[key] = [threading.Lock(), 0.0, None]
+            self._member_fetches.move_to_end(key)
+            while len(self._member_fetches) > self.max_size:
+                self._member_fetches.popitem(last=False)
+            return fetch
+
+    def get_member_nickname(self, client, app_id, chatroom_id, wxid):
+        """获取群成员的群昵称(优先displayName，其次nickName)，成员不在缓存的列表中时重新拉取一次群成员列表"""
+        key = (app_id, chatroom_id)
+        miss_key = (app_id, chatroom_id, wxid)
+        members = self._get(self._members, key)
+        # 成员列表已缓存但找不到该成员时，可能是新进群的成员，按未命中处理
+        hit = members is not None and wxid in members
+        if not hit and self._get(self._member_misses, miss_key) is not None:
+            # 最近拉取过仍找不到该成员，不再重复拉取
+            self._count(True)
+            return None
+        self._count(hit)
+        if hit:
+            return members[wxid]
+        requested_at = time.monotonic()
+        fetch = self._get_member_fetch(key)
+        with fetch[0]:
+            if fetch[1] < requested_at:
+                # 等待期间没有其他线程完成拉取，由当前线程拉取
+                fetch[2] = self._fetch_members(client, app_id, chatroom_id)
+                fetch[1] = time.monotonic()
+            members = fetch[2]
+        if members is None:
+            return None
+        if wxid not in members:
+            self._put(self._member_misses, miss_key, True, ttl=self.miss_ttl)
+        return members.get(wxid)
+
+    def _fetch_members(self, client, app_id, chatroom_id):
+        chatroom_member_list_response = client.get_chatroom_member_list(app_id, chatroom_id)
+        if chatroom_member_list_response.get('ret', 0) == 200 and chatroom_member_list_response.get('data', {}).get('memberList', []):
+            members = {}
+            for member_info in chatroom_member_list_response['data']['memberList']:
+                members[member_info['wxid']] = member_info.get('displayName', '') or member_info.get('nickName', '')
+            self._put(self._members, (app_id, chatroom_id), members)
+            return members
+        return None
+
+    def invalidate(self, app_id, wxid):
+        """群成员变动、群名修改时使缓存失效"""
+        with self._lock:
+            self._contacts.pop((app_id, wxid), None)
+            self._members.pop((app_id, wxid), None)
+            for miss_key in [k for k in self._member_misses if k[:2] == (app_id, wxid)]:
+                del self._member_misses[miss_key]
+        logger.debug("[gewechat] contact cache invalidated: app_id=%s, wxid=%s", app_id, wxid)
+
+    def clear(self):
+        with self._lock:
+            self._contacts.clear()
+            self._members.clear()
+            self._member_misses.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "contacts": len(self._contacts),
+                "chatrooms": len(self._members),
+                "member_misses": len(self._member_misses),
+            }
@@ -3,6 +3,7 @@ import uuid
 import re
 from bridge.context import ContextType
 from channel.chat_message import ChatMessage
+from channel.gewechat.gewechat_contact_cache import GeWeChatContactCache
 from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
@@ -303,6 +304,11 @@ class GeWeChatMessage(ChatMessage):
         super().__init__(msg)
         self.msg = msg
         self.create_time = msg.get('Data', {}).get('CreateTime', 0)
+        if msg.get('TypeName') == 'ModContacts':
+            # 群名修改、群成员变动等联系人变更通知，使对应的联系人/群成员缓存失效
+            user_name = msg.get('Data', {}).get('UserName', {}).get('string', '')
+            if user_name:
+                GeWeChatContactCache().invalidate(conf().get("gewechat_app_id"), user_name)
         if not msg.get('Data'):
             logger.warning(f"[gewechat] Missing 'Data' in message")
             return
@@ -327,7 +333,7 @@ class GeWeChatMessage(ChatMessage):
         if self._is_non_user_message(msg['Data'].get('MsgSource', ''), self.from_user_id):
             self.ctype = ContextType.NON_USER_MSG
             self.content = msg['Data']['Content']['string']
-            logger.debug(f"[gewechat] detected non-user message from {self.from_user_id}: {self.content}")
+            logger.debug("[gewechat] detected non-user message from %s: %s", self.from_user_id, self.content)
             return
 
         if msg_type == 1:  # Text message
@@ -398,6 +404,9 @@ class GeWeChatMessage(ChatMessage):
         elif msg_type == 10002:  # Group System Message
             if self.is_group:
                 content = msg['Data']['Content']['string']
+                if any(note in content for note in notes_bot_join_group + notes_join_group):
+                    # 有成员进群，群成员列表已变化
+                    GeWeChatContactCache().invalidate(self.app_id, self.from_user_id)
                 if any(note_bot_join_group in content for note_bot_join_group in notes_bot_join_group):  # 邀请机器人加入群聊
                     logger.warn("机器人加入群聊消息，不处理~")
                     pass
@@ -429,19 +438,17 @@ class GeWeChatMessage(ChatMessage):
                                     return
 
                     except ET.ParseError as e:
-                        logger.error(f"[gewechat] Failed to parse group join XML: {e}")
+                        logger.error("[gewechat] Failed to parse group join XML: %s", e)
                         # Fall back to regular content handling
                         pass
         else:
             raise NotImplementedError("Unsupported message type: Type:{}".format(msg_type))
 
         # 获取群聊或好友的名称
-        brief_info_response = self.client.get_brief_info(self.app_id, [self.other_user_id])
-        if brief_info_response['ret'] == 200 and brief_info_response['data']:
-            brief_info = brief_info_response['data'][0]
-            self.other_user_nickname = brief_info.get('nickName', '')
-            if not self.other_user_nickname:
-                self.other_user_nickname = self.other_user_id
+        contact_cache = GeWeChatContactCache()
+        nickname = contact_cache.get_nickname(self.client, self.app_id, self.other_user_id)
+        if nickname is not None:
+            self.other_user_nickname = nickname
 
         if self.is_group:
             # 如果是群聊消息，获取实际发送者信息
@@ -479,16 +486,7 @@ class GeWeChatMessage(ChatMessage):
                 }
             }
             """
-            chatroom_member_list_response = self.client.get_chatroom_member_list(self.app_id, self.from_user_id)
-            if chatroom_member_list_response.get('ret', 0) == 200 and chatroom_member_list_response.get('data', {}).get('memberList', []):
-                # 从群成员列表中匹配acual_user_id
-                for member_info in chatroom_member_list_response['data']['memberList']:
-                    if member_info['wxid'] == self.actual_user_id:
-                        # 先获取displayName，如果displayName为空，再获取nickName
-                        self.actual_user_nickname = member_info.get('displayName', '')
-                        if not self.actual_user_nickname:
-                            self.actual_user_nickname = member_info.get('nickName', '')
-                        break
+            self.actual_user_nickname = contact_cache.get_member_nickname(self.client, self.app_id, self.from_user_id, self.actual_user_id)
             # 如果actual_user_nickname为空，使用actual_user_id作为nickname
             if not self.actual_user_nickname:
                 self.actual_user_nickname = self.actual_user_id
@@ -514,14 +512,14 @@ class GeWeChatMessage(ChatMessage):
                         atuserlist = atuserlist_elem.text
                         self.is_at = self.to_user_id in atuserlist
                         xml_parsed = True
-                        logger.debug(f"[gewechat] is_at: {self.is_at}. atuserlist: {atuserlist}")
+                        logger.debug("[gewechat] is_at: %s. atuserlist: %s", self.is_at, atuserlist)
                 except ET.ParseError:
                     pass
 
             # 只有在XML解析失败时才从PushContent中判断
             if not xml_parsed:
                 self.is_at = '在群聊中@了你' in self.msg.get('Data', {}).get('PushContent', '')
-                logger.debug(f"[gewechat] Parse is_at from PushContent. self.is_at: {self.is_at}")
+                logger.debug("[gewechat] Parse is_at from PushContent. self.is_at: %s", self.is_at)
 
             # 如果是群消息，使用正则表达式去掉wxid前缀和@信息
             if self.content is not None:  # 添加检查
@@ -541,9 +539,9 @@ class GeWeChatMessage(ChatMessage):
                 
                 # 4. 清理多余空格
                 self.content = self.content.strip()
-                logger.debug(f"[gewechat] 清理后content: {self.content}")
+                logger.debug("[gewechat] 清理后content: %s", self.content)
             else:
-                logger.warning(f"[gewechat] Content is None for group message with msg_id: {self.msg_id}")
+                logger.warning("[gewechat] Content is None for group message with msg_id: %s", self.msg_id)
                 self.content = ""  # 设置默认值
         else:
             # 如果不是群聊消息，保持结构统一，也要设置actual_user_id和actual_user_nickname
@@ -558,7 +556,7 @@ class GeWeChatMessage(ChatMessage):
             with open(self.content, "wb") as f:
                 f.write(voice_data)
         except Exception as e:
-            logger.error(f"[gewechat] Failed to download voice file: {e}")
+            logger.error("[gewechat] Failed to download voice file: %s", e)
 
     def download_image(self):
         try:
@@ -571,25 +569,25 @@ class GeWeChatMessage(ChatMessage):
                     content_xml = content_xml[xml_start:]
                 image_info = self.client.download_image(app_id=self.app_id, xml=content_xml, type=1)
             except Exception as e:
-                logger.warning(f"[gewechat] Failed to download high-quality image: {e}")
+                logger.warning("[gewechat] Failed to download high-quality image: %s", e)
                 # 尝试下载普通图片
                 image_info = self.client.download_image(app_id=self.app_id, xml=content_xml, type=2)
             if image_info['ret'] == 200 and image_info['data']:
                 file_url = image_info['data']['fileUrl']
-                logger.info(f"[gewechat] Download image file from {file_url}")
+                logger.info("[gewechat] Download image file from %s", file_url)
                 download_url = conf().get("gewechat_download_url").rstrip('/')
                 full_url = download_url + '/' + file_url
                 try:
                     file_data = requests.get(full_url).content
                 except Exception as e:
-                    logger.error(f"[gewechat] Failed to download image file: {e}")
+                    logger.error("[gewechat] Failed to download image file: %s", e)
                     return
                 with open(self.content, "wb") as f:
                     f.write(file_data)
             else:
-                logger.error(f"[gewechat] Failed to download image file: {image_info}")
+                logger.error("[gewechat] Failed to download image file: %s", image_info)
         except Exception as e:
-            logger.error(f"[gewechat] Failed to download image file: {e}")
+            logger.error("[gewechat] Failed to download image file: %s", e)
 
     def prepare(self):
         if self._prepare_fn:
@@ -613,7 +611,7 @@ class GeWeChatMessage(ChatMessage):
         # 检查发送者ID
         special_accounts = ["Tencent-Games", "weixin"]
         if from_user_id in special_accounts or from_user_id.startswith("gh_"):
-            logger.debug(f"[gewechat] non-user message detected by sender id: {from_user_id}")
+            logger.debug("[gewechat] non-user message detected by sender id: %s", from_user_id)
             return True
 
         # 检查消息源中的标签
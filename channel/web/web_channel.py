@@ -1,14 +1,18 @@
 import sys
 import time
+import threading
 import web
 import json
-from queue import Queue
+from collections import OrderedDict
+from queue import Queue, Empty, Full
 from bridge.context import *
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, check_prefix
 from channel.chat_message import ChatMessage
 from common.log import logger
+from common.metrics import counter
 from common.singleton import singleton
+from common.web_server import run_wsgi_app
 from config import conf
 import os
 
@@ -44,8 +48,78 @@ class WebChannel(ChatChannel):
     def __init__(self):
         super().__init__()
         self.message_queues = {}  # 为每个用户存储一个消息队列
+        self.sse_connections = {}  # user_id: 当前SSE连接数
+        self.idle_since = OrderedDict()  # 没有SSE连接的用户队列: 开始空闲的时间，按时间先后排列
+        self.queue_lock = threading.Lock()
         self.msg_id_counter = 0  # 添加消息ID计数器
 
+    def _get_queue(self, user_id, connect=False):
+        """获取用户的消息队列，不存在时创建；connect为True时登记一个SSE连接"""
+        with self.queue_lock:
+            return self._get_queue_locked(user_id, connect)
+
+    def _get_queue_locked(self, user_id, connect=False):
+        """同_get_queue，调用方需持有queue_lock"""
+        now = time.monotonic()
+        self._sweep_idle_queues(now)
+        queue = self.message_queues.get(user_id)
+        if queue is None:
+            queue = Queue(maxsize=conf().get("web_sse_queue_size", 100))
+            self.message_queues[user_id] = queue
+        if connect:
+            self.sse_connections[user_id] = self.sse_connections.get(user_id, 0) + 1
+            self.idle_since.pop(user_id, None)
+        elif user_id not in self.sse_connections and user_id not in self.idle_since:
+            self.idle_since[user_id] = now
+        return queue
+
+    def _release_queue(self, user_id):
+        """SSE连接断开，用户没有其他连接时：队列为空则删除，否则保留web_sse_queue_ttl秒等待重连"""
+        with self.queue_lock:
+            count = self.sse_connections.get(user_id, 1) - 1
+            if count > 0:
+                self.sse_connections[user_id] = count
+                return
+            self.sse_connections.pop(user_id, None)
+            queue = self.message_queues.get(user_id)
+            if queue is not None and queue.empty():
+                del self.message_queues[user_id]
+            elif queue is not None:
+                self.idle_since[user_id] = time.monotonic()
+
+    def _sweep_idle_queues(self, now):
+        ttl = conf().get("web_sse_queue_ttl", 300)
+        while self.idle_since:
+            user_id, since = next(iter(self.idle_since.items()))
+            if now - since < ttl:
+                break
+            del self.idle_since[user_id]
+            self.message_queues.pop(user_id, None)
+
+    def _enqueue(self, user_id, message):
+        """
+        队列已满时按web_sse_drop_policy丢弃最早(drop_oldest)或最新(drop_newest)的消息
+
+        取队列和放入消息都在queue_lock内完成，否则_release_queue可能在两者之间删除空队列，消息随队列丢失
+        """
+        policy = conf().get("web_sse_drop_policy", "drop_oldest")
+        with self.queue_lock:
+            queue = self._get_queue_locked(user_id)
+            while True:
+                try:
+                    queue.put_nowait(message)
+                    return
+                except Full:
+                    counter("web_sse_dropped_messages_total", policy=policy).inc()
+                    if policy == "drop_newest":
+                        logger.warning(f"[WebChannel] message queue of user {user_id} is full, drop newest message")
+                        return
+                    try:
+                        queue.get_nowait()
+                        logger.warning(f"[WebChannel] message queue of user {user_id} is full, drop oldest message")
+                    except Empty:
+                        pass
+
     def _generate_msg_id(self):
         """生成唯一的消息ID"""
         self.msg_id_counter += 1
@@ -82,17 +156,13 @@ class WebChannel(ChatChannel):
             # 获取用户ID，如果没有则使用默认值
             # user_id = getattr(context.get("session", None), "session_id", "default_user")
             user_id = context["receiver"]
-            # 确保用户有对应的消息队列
-            if user_id not in self.message_queues:
-                self.message_queues[user_id] = Queue()
-                
             # 将消息放入对应用户的队列
             message_data = {
                 "type": str(reply.type),
                 "content": reply.content,
                 "timestamp": time.time()
             }
-            self.message_queues[user_id].put(message_data)
+            self._enqueue(user_id, message_data)
             logger.debug(f"Message queued for user {user_id}")
             
         except Exception as e:
@@ -107,30 +177,22 @@ class WebChannel(ChatChannel):
         web.header('Cache-Control', 'no-cache')
         web.header('Connection', 'keep-alive')
         
-        # 确保用户有消息队列
-        if user_id not in self.message_queues:
-            self.message_queues[user_id] = Queue()
-        
-        try:    
+        queue = self._get_queue(user_id, connect=True)
+        heartbeat_interval = conf().get("web_sse_heartbeat_interval", 15)
+        try:
+            # 先发送一次心跳，让浏览器尽快收到响应头
+            yield f": heartbeat\n\n"
             while True:
+                # 阻塞等待消息，超时未收到消息时发送心跳；连接断开时写入失败，生成器被关闭
                 try:
-                    # 发送心跳
+                    message = queue.get(timeout=heartbeat_interval)
+                except Empty:
                     yield f": heartbeat\n\n"
-                    
-                    # 非阻塞方式获取消息
-                    if not self.message_queues[user_id].empty():
-                        message = self.message_queues[user_id].get_nowait()
-                        yield f"data: {json.dumps(message)}\n\n"
-                    time.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"SSE Error: {e}")
-                    break
+                    continue
+                yield f"data: {json.dumps(message)}\n\n"
         finally:
             # 清理资源
-            if user_id in self.message_queues:
-                # 只有当队列为空时才删除
-                if self.message_queues[user_id].empty():
-                    del self.message_queues[user_id]
+            self._release_queue(user_id)
 
     def post_message(self):
         """
@@ -186,7 +248,8 @@ class WebChannel(ChatChannel):
         )
         port = conf().get("web_port", 9899)
         app = web.application(urls, globals(), autoreload=False)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        # 每个SSE连接占用一个工作线程，需要按并发连接数设置线程数
+        run_wsgi_app(app.wsgifunc(), port, threads=conf().get("web_server_threads", 200))
 
 
 class SSEHandler:
@@ -202,3 +265,49 @@ class MessageHandler:
 class ChatHandler:
     def GET(self):
         return WebChannel().chat_page()
+
+
+if __name__ == "__main__":
+    # SSE压力测试: python -m channel.web.web_channel [连接数]
+    # 建立大量SSE连接，给每个用户推送一条消息，统计建连、送达和断开后的清理情况
+    import selectors
+    import socket
+
+    from config import load_config
+
+    load_config()
+    logger.setLevel("ERROR")
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    conf()["web_server_threads"] = clients + 20
+    conf()["web_sse_heartbeat_interval"] = 5
+    channel = WebChannel()
+    threading.Thread(target=channel.startup, daemon=True).start()
+    time.sleep(1)
+
+    sel = selectors.DefaultSelector()
+    received = {}
+    start = time.time()
+    for i in range(clients):
+        sock = socket.create_connection(("127.0.0.1", conf().get("web_port", 9899)))
+        sock.sendall(f"GET /sse/user{i} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, i)
+        received[i] = b""
+
+    def pump(timeout, done):
+        deadline = time.time() + timeout
+        while time.time() < deadline and not done():
+            for key, _ in sel.select(0.1):
+                received[key.data] += key.fileobj.recv(65536)
+
+    pump(30, lambda: all(b"heartbeat" in data for data in received.values()))
+    print(f"connected: {sum(b'heartbeat' in data for data in received.values())}/{clients}, {time.time() - start:.2f}s")
+    start = time.time()
+    for i in range(clients):
+        channel._enqueue(f"user{i}", {"type": "TEXT", "content": "hello", "timestamp": time.time()})
+    pump(30, lambda: all(b"data:" in data for data in received.values()))
+    print(f"delivered: {sum(b'data:' in data for data in received.values())}/{clients}, {time.time() - start:.3f}s")
+    for key in list(sel.get_map().values()):
+        key.fileobj.close()
+    time.sleep(3 * conf().get("web_sse_heartbeat_interval"))
+    print(f"after disconnect: queues={len(channel.message_queues)}, connections={len(channel.sse_connections)}")
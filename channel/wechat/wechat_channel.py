@@ -14,7 +14,6 @@ import requests
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
-from channel import chat_channel
 from channel.wechat.wechat_message import *
 from common.expired_dict import ExpiredDict
 from common.log import logger
@@ -171,7 +170,7 @@ class WechatChannel(ChatChannel):
             time.sleep(2)
             self.auto_login_times += 1
             if self.auto_login_times < 3:
-                chat_channel.handler_pool._shutdown = False
+                self.handler_pool.reset()
                 self.startup()
         except Exception as e:
             pass
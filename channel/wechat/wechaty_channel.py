@@ -45,7 +45,7 @@ class WechatyChannel(ChatChannel):
     async def main(self):
         loop = asyncio.get_event_loop()
         # 将asyncio的loop传入处理线程
-        chat_channel.handler_pool._initializer = lambda: asyncio.set_event_loop(loop)
+        self.handler_pool.set_initializer(lambda: asyncio.set_event_loop(loop))
         self.bot = Wechaty()
         self.bot.on("login", self.on_login)
         self.bot.on("message", self.on_message)
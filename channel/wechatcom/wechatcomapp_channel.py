@@ -1,9 +1,7 @@
 # -*- coding=utf-8 -*-
-import io
 import os
 import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -16,6 +14,8 @@ from channel.chat_channel import ChatChannel
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
 from common.log import logger
+from common.web_server import run_wsgi_app
+from common.media_upload import MediaIdCache, download_media, file_sha256, upload_concurrently
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
 from config import conf, subscribe_msg
@@ -47,7 +47,7 @@ class WechatComAppChannel(ChatChannel):
         urls = ("/wxcomapp/?", "channel.wechatcom.wechatcomapp_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_wsgi_app(app.wsgifunc(), port)
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -63,17 +63,18 @@ class WechatComAppChannel(ChatChannel):
             logger.info("[wechatcom] Do send text to {}: {}".format(receiver, reply_text))
         elif reply.type == ReplyType.VOICE:
             try:
-                media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
                 any_to_amr(file_path, amr_file)
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
                     logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcom] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
+
+                def upload_voice(path):
+                    with open(path, "rb") as f:
+                        return self._upload_media("voice", f, file_sha256(path))
+
+                media_ids = upload_concurrently(upload_voice, files)
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload voice failed: {}".format(e))
                 return
@@ -89,33 +90,33 @@ class WechatComAppChannel(ChatChannel):
             logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
-            sz = fsize(image_storage)
-            if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
-            image_storage.seek(0)
-            if ".webp" in img_url:
-                try:
-                    image_storage = convert_webp_to_png(image_storage)
-                except Exception as e:
-                    logger.error(f"Failed to convert image: {e}")
-                    return
+            media = download_media(img_url)
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
+                with open(media.path, "rb") as image_storage:
+                    sha256 = media.sha256
+                    if media.size >= 10 * 1024 * 1024:
+                        logger.info("[wechatcom] image too large, ready to compress, sz={}".format(media.size))
+                        image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                        logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
+                    image_storage.seek(0)
+                    if ".webp" in img_url:
+                        try:
+                            image_storage = convert_webp_to_png(image_storage)
+                        except Exception as e:
+                            logger.error(f"Failed to convert image: {e}")
+                            return
+                    media_id = self._upload_media("image", image_storage, sha256)
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload image failed: {}".format(e))
                 return
+            finally:
+                media.remove()
 
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
+            self.client.message.send_image(self.agent_id, receiver, media_id)
             logger.info("[wechatcom] sendImage url={}, receiver={}".format(img_url, receiver))
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
+            sha256 = file_sha256(image_storage)
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
@@ -123,14 +124,23 @@ class WechatComAppChannel(ChatChannel):
                 logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
+                media_id = self._upload_media("image", image_storage, sha256)
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload image failed: {}".format(e))
                 return
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
+            self.client.message.send_image(self.agent_id, receiver, media_id)
             logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
 
+    def _upload_media(self, media_type, media_file, sha256):
+        """上传临时素材，sha256为原始文件内容的哈希，相同内容的文件在有效期内只上传一次，返回media_id"""
+
+        def upload():
+            response = self.client.media.upload(media_type, media_file)
+            logger.debug("[wechatcom] upload {} response: {}".format(media_type, response))
+            return response["media_id"]
+
+        return MediaIdCache().get_or_upload("wechatcom_app", "{}/{}".format(self.corp_id, self.agent_id), sha256, upload)
+
 
 class Query:
     def GET(self):
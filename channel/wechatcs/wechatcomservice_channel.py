@@ -1,5 +1,4 @@
 # -*- coding=utf-8 -*-
-import io
 import json
 import os
 import time
@@ -17,6 +16,8 @@ from channel.chat_channel import ChatChannel
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcs.wechatcomservice_message import WechatComServiceMessage
 from common.log import logger
+from common.web_server import run_wsgi_app
+from common.media_upload import MediaIdCache, download_media, file_sha256, upload_concurrently
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length
 from config import conf, subscribe_msg
@@ -61,7 +62,7 @@ class WechatComServiceChannel(ChatChannel):
         urls = ("/wxcomapp", "channel.wechatcs.wechatcomservice_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_wsgi_app(app.wsgifunc(), port)
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -80,7 +81,6 @@ class WechatComServiceChannel(ChatChannel):
             logger.info("[wechatcs] Do send text to {}: {}".format(receiver, reply_text))
         elif reply.type == ReplyType.VOICE:
             try:
-                media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
                 any_to_amr(file_path, amr_file)
@@ -89,10 +89,12 @@ class WechatComServiceChannel(ChatChannel):
                     logger.info(
                         "[wechatcs] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0,
                                                                                            len(files)))
-                for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcs] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
+
+                def upload_voice(path):
+                    with open(path, "rb") as f:
+                        return self._upload_media("voice", f, file_sha256(path))
+
+                media_ids = upload_concurrently(upload_voice, files)
             except WeChatClientException as e:
                 logger.error("[wechatcs] upload voice failed: {}".format(e))
                 return
@@ -110,28 +112,27 @@ class WechatComServiceChannel(ChatChannel):
             logger.info("[wechatcs] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
-            sz = fsize(image_storage)
-            if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcs] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
-            image_storage.seek(0)
+            media = download_media(img_url)
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcs] upload image response: {}".format(response))
+                with open(media.path, "rb") as image_storage:
+                    if media.size >= 10 * 1024 * 1024:
+                        logger.info("[wechatcs] image too large, ready to compress, sz={}".format(media.size))
+                        image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                        logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
+                    image_storage.seek(0)
+                    media_id = self._upload_media("image", image_storage, media.sha256)
             except WeChatClientException as e:
                 logger.error("[wechatcs] upload image failed: {}".format(e))
                 return
+            finally:
+                media.remove()
 
             # self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            self.send_image_message(external_userid=external_userid, open_kfid=open_kfid, media_id=response["media_id"])
+            self.send_image_message(external_userid=external_userid, open_kfid=open_kfid, media_id=media_id)
             logger.info("[wechatcs] sendImage url={}, receiver={}".format(img_url, receiver))
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
+            sha256 = file_sha256(image_storage)
             sz = fsize(image_storage)
 
             if sz >= 10 * 1024 * 1024:
@@ -140,13 +141,12 @@ class WechatComServiceChannel(ChatChannel):
                 logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcs] upload image response: {}".format(response))
+                media_id = self._upload_media("image", image_storage, sha256)
             except WeChatClientException as e:
                 logger.error("[wechatcs] upload image failed: {}".format(e))
                 return
             # self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            self.send_image_message(external_userid=external_userid, open_kfid=open_kfid, media_id=response["media_id"])
+            self.send_image_message(external_userid=external_userid, open_kfid=open_kfid, media_id=media_id)
             logger.info("[wechatcs] sendImage, receiver={}".format(receiver))
         elif reply.type == ReplyType.LINK:
             # 解析 reply.content 中的 JSON 数据
@@ -154,6 +154,7 @@ class WechatComServiceChannel(ChatChannel):
                 # link_data = json.loads(reply.content)
                 link_data = reply.content
                 image_storage = link_data["image"]
+                sha256 = file_sha256(image_storage)
                 sz = fsize(image_storage)
 
                 if sz >= 10 * 1024 * 1024:
@@ -162,12 +163,11 @@ class WechatComServiceChannel(ChatChannel):
                     logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
                 image_storage.seek(0)
                 try:
-                    response = self.client.media.upload("image", image_storage)
-                    logger.debug("[wechatcs] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", image_storage, sha256)
                 except WeChatClientException as e:
                     logger.error("[wechatcs] upload image failed: {}".format(e))
                     return
-                link_data["thumb_media_id"] = response["media_id"]
+                link_data["thumb_media_id"] = media_id
                 # 此时已经不需要图片数据了
                 link_data.pop("image")
                 self.send_link_message(
@@ -177,8 +177,18 @@ class WechatComServiceChannel(ChatChannel):
             except json.JSONDecodeError:
                 logger.error("Invalid JSON format in reply.content")
 
+    def _upload_media(self, media_type, media_file, sha256):
+        """上传临时素材，sha256为原始文件内容的哈希，相同内容的文件在有效期内只上传一次，返回media_id"""
+
+        def upload():
+            response = self.client.media.upload(media_type, media_file)
+            logger.debug("[wechatcs] upload {} response: {}".format(media_type, response))
+            return response["media_id"]
+
+        return MediaIdCache().get_or_upload("wechatcom_service", "{}/{}".format(self.corp_id, self.agent_id), sha256, upload)
+
     def send_text_message(self, external_userid, open_kfid, content, msgid=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
+        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.access_token}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -192,7 +202,7 @@ class WechatComServiceChannel(ChatChannel):
         return response.json()
 
     def send_image_message(self, external_userid, open_kfid, msgid=None, media_id=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
+        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.access_token}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -210,7 +220,7 @@ class WechatComServiceChannel(ChatChannel):
         return response
 
     def send_voice_message(self, external_userid, open_kfid, media_id, msgid=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
+        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.access_token}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -239,7 +249,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
         # 发送图文链接消息
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
+        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.access_token}"
         response = requests.post(url, json=data).json()
         if response['errmsg'] == 'ok':
             print("Send LINK Message Success")
@@ -248,8 +258,8 @@ class WechatComServiceChannel(ChatChannel):
         return response
 
     def get_latest_message(self, token, open_kfid, next_cursor=""):
-        logger.debug(f"self.client.fetch_access_token():{self.client.fetch_access_token()}")
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/sync_msg?access_token={self.client.fetch_access_token()}"
+        logger.debug(f"self.client.access_token:{self.client.access_token}")
+        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/sync_msg?access_token={self.client.access_token}"
         data = {
             "token": token,
             "open_kfid": open_kfid,
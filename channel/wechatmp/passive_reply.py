@@ -62,7 +62,7 @@ class Query:
                     logger.debug("[wechatmp] context: {} {} {}".format(context, wechatmp_msg, supported))
 
                     if supported and context:
-                        channel.running.add(from_user)
+                        channel.start_running(from_user)
                         channel.produce(context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
@@ -100,14 +100,8 @@ class Query:
                     )
                 )
 
-                task_running = True
-                waiting_until = request_time + 4
-                while time.time() < waiting_until:
-                    if from_user in channel.running:
-                        time.sleep(0.1)
-                    else:
-                        task_running = False
-                        break
+                # wait until the reply is ready, woken up by the channel's callbacks
+                task_running = not channel.wait_running(from_user, request_time + 4 - time.time())
 
                 reply_text = ""
                 if task_running:
@@ -1,12 +1,10 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import imghdr
-import io
 import os
 import threading
 import time
 
-import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
@@ -18,6 +16,8 @@ from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_client import WechatMPClient
 from common.log import logger
+from common.web_server import run_wsgi_app
+from common.media_upload import MediaIdCache, download_media, file_sha256, upload_concurrently
 from common.singleton import singleton
 from common.utils import split_string_by_utf8_length, remove_markdown_symbol
 from config import conf
@@ -50,6 +50,9 @@ class WechatMPChannel(ChatChannel):
             self.cache_dict = defaultdict(list)
             # Record whether the current message is being processed
             self.running = set()
+            # Set when the processing of the user's message is finished, so that the waiting request wakes up at once
+            self.running_events = dict()
+            self.running_lock = threading.Lock()
             # Count the request from wechat official server by message_id
             self.request_cnt = dict()
             # The permanent media need to be deleted to avoid media number limit
@@ -65,7 +68,7 @@ class WechatMPChannel(ChatChannel):
             urls = ("/wx", "channel.wechatmp.active_reply.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatmp_port", 8080)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_wsgi_app(app.wsgifunc(), port)
 
     def start_loop(self, loop):
         asyncio.set_event_loop(loop)
@@ -90,89 +93,65 @@ class WechatMPChannel(ChatChannel):
                 if len(files) > 1:
                     logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
 
-                for path in files:
+                def upload_voice(path):
                     # support: <2M, <60s, mp3/wma/wav/amr
-                    try:
-                        with open(path, "rb") as f:
-                            response = self.client.material.add("voice", f)
-                            logger.debug("[wechatmp] upload voice response: {}".format(response))
-                            f_size = os.fstat(f.fileno()).st_size
-                            time.sleep(1.0 + 2 * f_size / 1024 / 1024)
-                            # todo check media_id
-                    except WeChatClientException as e:
-                        logger.error("[wechatmp] upload voice failed: {}".format(e))
-                        return
-                    media_id = response["media_id"]
+                    with open(path, "rb") as f:
+                        response = self.client.material.add("voice", f)
+                    logger.debug("[wechatmp] upload voice response: {}".format(response))
+                    return response["media_id"]
+
+                try:
+                    media_ids = upload_concurrently(upload_voice, files)
+                except WeChatClientException as e:
+                    logger.error("[wechatmp] upload voice failed: {}".format(e))
+                    return
+                # 等待素材生效，分段是并发上传的，按最大的分段等待一次即可
+                f_size = max(os.path.getsize(path) for path in files)
+                time.sleep(1.0 + 2 * f_size / 1024 / 1024)
+                # todo check media_id
+                for media_id in media_ids:
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
                     self.cache_dict[receiver].append(("voice", media_id))
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
-                img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
+                media = download_media(reply.content)
                 try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    with open(media.path, "rb") as f:
+                        media_id = self._upload_material("image", f, receiver, context)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                media_id = response["media_id"]
+                finally:
+                    media.remove()
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
                 self.cache_dict[receiver].append(("image", media_id))
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
-                image_storage = reply.content
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
                 try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_material("image", reply.content, receiver, context)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
                 self.cache_dict[receiver].append(("image", media_id))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
-                video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
+                media = download_media(reply.content)
                 try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    with open(media.path, "rb") as f:
+                        media_id = self._upload_material("video", f, receiver, context)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                media_id = response["media_id"]
+                finally:
+                    media.remove()
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
                 self.cache_dict[receiver].append(("video", media_id))
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
-                video_storage = reply.content
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
                 try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_material("video", reply.content, receiver, context)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
                 self.cache_dict[receiver].append(("video", media_id))
 
@@ -203,16 +182,23 @@ class WechatMPChannel(ChatChannel):
                         file_name = os.path.basename(file_path)
                         file_type = "audio/mpeg"
                     logger.info("[wechatmp] file_name: {}, file_type: {} ".format(file_name, file_type))
-                    media_ids = []
                     duration, files = split_audio(file_path, 60 * 1000)
                     if len(files) > 1:
                         logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                    for path in files:
+
+                    def upload_voice(path):
                         # support: <2M, <60s, AMR\MP3
-                        response = self.client.media.upload("voice", (os.path.basename(path), open(path, "rb"), file_type))
-                        logger.debug("[wechatcom] upload voice response: {}".format(response))
-                        media_ids.append(response["media_id"])
+                        def upload():
+                            with open(path, "rb") as f:
+                                response = self.client.media.upload("voice", (os.path.basename(path), f, file_type))
+                            logger.debug("[wechatmp] upload voice response: {}".format(response))
+                            return response["media_id"]
+
+                        media_id = MediaIdCache().get_or_upload("wechatmp", conf().get("wechatmp_app_id"), file_sha256(path), upload)
                         os.remove(path)
+                        return media_id
+
+                    media_ids = upload_concurrently(upload_voice, files)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload voice failed: {}".format(e))
                     return
@@ -227,78 +213,117 @@ class WechatMPChannel(ChatChannel):
                     time.sleep(1)
                 logger.info("[wechatmp] Do send voice to {}".format(receiver))
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
-                img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
+                media = download_media(reply.content)
                 try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    with open(media.path, "rb") as f:
+                        media_id = self._upload_media("image", f, receiver, context, media.sha256)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                self.client.message.send_image(receiver, response["media_id"])
+                finally:
+                    media.remove()
+                self.client.message.send_image(receiver, media_id)
                 logger.info("[wechatmp] Do send image to {}".format(receiver))
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
-                image_storage = reply.content
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
                 try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", reply.content, receiver, context, file_sha256(reply.content))
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                self.client.message.send_image(receiver, response["media_id"])
+                self.client.message.send_image(receiver, media_id)
                 logger.info("[wechatmp] Do send image to {}".format(receiver))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
-                video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
+                media = download_media(reply.content)
                 try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    with open(media.path, "rb") as f:
+                        media_id = self._upload_media("video", f, receiver, context, media.sha256)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                self.client.message.send_video(receiver, response["media_id"])
+                finally:
+                    media.remove()
+                self.client.message.send_video(receiver, media_id)
                 logger.info("[wechatmp] Do send video to {}".format(receiver))
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
-                video_storage = reply.content
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
                 try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_media("video", reply.content, receiver, context, file_sha256(reply.content))
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                self.client.message.send_video(receiver, response["media_id"])
+                self.client.message.send_video(receiver, media_id)
                 logger.info("[wechatmp] Do send video to {}".format(receiver))
         return
 
+    def _media_file(self, media_type, media_file, receiver, context):
+        """构造上传素材用的(文件名, 文件对象, content_type)"""
+        media_file.seek(0)
+        if media_type == "image":
+            file_type = imghdr.what(media_file)
+            media_file.seek(0)
+            content_type = "image/" + file_type
+        else:
+            file_type = "mp4"
+            content_type = "video/" + file_type
+        filename = receiver + "-" + str(context["msg"].msg_id) + "." + file_type
+        return filename, media_file, content_type
+
+    def _upload_material(self, media_type, media_file, receiver, context):
+        """上传永久素材(被动回复使用)，返回media_id"""
+        response = self.client.material.add(media_type, self._media_file(media_type, media_file, receiver, context))
+        logger.debug("[wechatmp] upload {} response: {}".format(media_type, response))
+        return response["media_id"]
+
+    def _upload_media(self, media_type, media_file, receiver, context, sha256):
+        """上传临时素材(主动回复使用)，相同内容的文件在有效期内只上传一次，返回media_id"""
+
+        def upload():
+            response = self.client.media.upload(media_type, self._media_file(media_type, media_file, receiver, context))
+            logger.debug("[wechatmp] upload {} response: {}".format(media_type, response))
+            return response["media_id"]
+
+        return MediaIdCache().get_or_upload("wechatmp", conf().get("wechatmp_app_id"), sha256, upload)
+
+    def start_running(self, user_id):
+        """
+        标记用户的消息正在处理中
+
+        #管理命令可能在用户已有消息处理中时提交，此时复用已有的Event，否则先等待的请求持有的旧Event永远不会被唤醒
+        """
+        with self.running_lock:
+            self.running.add(user_id)
+            if user_id not in self.running_events:
+                self.running_events[user_id] = threading.Event()
+
+    def _finish_running(self, user_id):
+        with self.running_lock:
+            self.running.discard(user_id)
+            event = self.running_events.pop(user_id, None)
+        if event:
+            event.set()
+
+    def wait_running(self, user_id, timeout):
+        """等待用户的消息处理完成，最多等待timeout秒，返回是否已处理完成"""
+        with self.running_lock:
+            if user_id not in self.running:
+                return True
+            event = self.running_events.get(user_id)
+        if event is None:
+            return user_id not in self.running
+        return event.wait(max(timeout, 0))
+
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
         logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
         if self.passive_reply:
-            self.running.remove(session_id)
+            self._finish_running(session_id)
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
             assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            self._finish_running(session_id)
+
+    def _dropped_callback(self, session_id, context, **kwargs):  # 消息被取消、丢弃或被拒绝时的回调函数
+        logger.info("[wechatmp] Reply dropped, msgId={}".format(context["msg"].msg_id))
+        if self.passive_reply:
+            # 否则用户一直处于running状态，之后的消息都会被忽略
+            self._finish_running(session_id)
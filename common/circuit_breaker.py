@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+
+from common.log import logger
+from common.metrics import counter, gauge
+from config import conf
+
+STATE_CLOSED = "closed"  # 正常放行
+STATE_OPEN = "open"  # 熔断，直接拒绝请求
+STATE_HALF_OPEN = "half_open"  # 熔断时间结束，放行少量探测请求
+# 导出到circuit_breaker_state指标的数值
+STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时拒绝请求抛出的异常"""
+
+    def __init__(self, name):
+        super().__init__(f"circuit breaker {name} is open")
+        self.name = name
+
+
+class CircuitBreaker(object):
+    """
+    按后端统计最近请求的错误率和p95耗时的熔断器
+
+    :param name: 后端名称
+    :param window: 统计最近多少次请求
+    :param min_requests: 窗口内至少有多少次请求才判断是否熔断
+    :param error_rate: 错误率达到该值时熔断
+    :param p95_latency: p95耗时超过该值(秒)时熔断，小于等于0表示不按耗时熔断
+    :param open_seconds: 熔断持续时间(秒)，之后进入半开状态放行探测请求
+    :param half_open_probes: 半开状态下同时放行的探测请求数，全部成功后恢复
+    """
+
+    def __init__(self, name, window=20, min_requests=5, error_rate=0.5, p95_latency=0, open_seconds=30, half_open_probes=1):
+        self.name = name
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.p95_latency = p95_latency
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.lock = threading.Lock()
+        self.results = deque(maxlen=window)  # (是否成功, 耗时)
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.probes = deque()  # 半开状态下已放行的探测请求的放行时间
+        self.probe_successes = 0
+        self.rejected = 0
+        self.transitions = {}  # "closed->open": 次数
+        self.pending_events = []  # 持有锁时发生的状态变化，释放锁后再通知监听者
+
+    def is_open(self):
+        """是否处于熔断中，不占用半开状态的探测名额"""
+        with self.lock:
+            return self.state == STATE_OPEN and time.monotonic() - self.opened_at < self.open_seconds
+
+    def allow_request(self):
+        """是否放行请求，放行后必须调用record记录结果"""
+        try:
+            return self._allow_request()
+        finally:
+            self._notify_listeners()
+
+    def _allow_request(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.state == STATE_OPEN:
+                if now - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    counter("circuit_breaker_rejected_total", breaker=self.name).inc()
+                    return False
+                self._transition(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN:
+                # 超过熔断时间仍未返回结果的探测请求不再占用名额
+                while self.probes and now - self.probes[0] >= self.open_seconds:
+                    self.probes.popleft()
+                if len(self.probes) >= self.half_open_probes:
+                    self.rejected += 1
+                    counter("circuit_breaker_rejected_total", breaker=self.name).inc()
+                    return False
+                self.probes.append(now)
+            return True
+
+    def record(self, success, latency):
+        """记录一次请求的结果和耗时(秒)"""
+        try:
+            self._record(success, latency)
+        finally:
+            self._notify_listeners()
+
+    def _record(self, success, latency):
+        with self.lock:
+            if self.state == STATE_HALF_OPEN:
+                if self.probes:
+                    self.probes.popleft()
+                if not success or (self.p95_latency > 0 and latency > self.p95_latency):
+                    self._open()
+                    return
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_probes:
+                    self.results.clear()
+                    self._transition(STATE_CLOSED)
+                return
+            self.results.append((success, latency))
+            if self.state == STATE_CLOSED and self._should_open():
+                self._open()
+
+    def _should_open(self):
+        total = len(self.results)
+        if total < self.min_requests:
+            return False
+        errors = sum(1 for success, _ in self.results if not success)
+        if errors / total >= self.error_rate:
+            return True
+        return self.p95_latency > 0 and self._p95() > self.p95_latency
+
+    def _p95(self):
+        latencies = sorted(latency for _, latency in self.results)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._transition(STATE_OPEN)
+
+    def _transition(self, state):
+        """切换状态，调用方持有锁"""
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logger.info(f"[CircuitBreaker] {self.name} {key}")
+        self.pending_events.append((self.state, state))
+        self.state = state
+        self.probes.clear()
+        self.probe_successes = 0
+
+    def _notify_listeners(self):
+        """在锁外通知状态变化，监听者可以调用stats()，耗时的监听者也不会阻塞其他请求"""
+        if not self.pending_events:
+            return
+        with self.lock:
+            events, self.pending_events = self.pending_events, []
+        for from_state, to_state in events:
+            for listener in list(_listeners):
+                try:
+                    listener(self.name, from_state, to_state)
+                except Exception as e:
+                    logger.warning(f"[CircuitBreaker] listener error: {e}")
+
+    def stats(self):
+        with self.lock:
+            total = len(self.results)
+            errors = sum(1 for success, _ in self.results if not success)
+            return {
+                "state": self.state,
+                "requests": total,
+                "error_rate": errors / total if total else 0.0,
+                "p95_latency": self._p95(),
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_listeners = []
+
+
+def get_breaker(name):
+    """
+    获取指定后端的熔断器，未开启circuit_breaker_enabled时返回None
+    """
+    if not conf().get("circuit_breaker_enabled", False):
+        return None
+    breaker = _breakers.get(name)
+    if breaker is not None:
+        return breaker
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                window=conf().get("circuit_breaker_window", 20),
+                min_requests=conf().get("circuit_breaker_min_requests", 5),
+                error_rate=conf().get("circuit_breaker_error_rate", 0.5),
+                p95_latency=conf().get("circuit_breaker_p95_latency", 0),
+                open_seconds=conf().get("circuit_breaker_open_seconds", 30),
+                half_open_probes=conf().get("circuit_breaker_half_open_probes", 1),
+            )
+            _breakers[name] = breaker
+            gauge("circuit_breaker_state", func=lambda: STATE_VALUES[breaker.state], breaker=name)
+    return breaker
+
+
+def add_listener(listener):
+    """注册熔断器状态变化的回调，参数为(name, from_state, to_state)，用于导出监控指标"""
+    _listeners.append(listener)
+
+
+def get_all_stats():
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
+
+
+def _count_transition(name, from_state, to_state):
+    counter("circuit_breaker_transitions_total", breaker=name, **{"from": from_state, "to": to_state}).inc()
+
+
+add_listener(_count_transition)
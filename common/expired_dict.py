@@ -1,22 +1,56 @@
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+class ExpiredDict(MutableMapping):
+    """
+    带过期时间的字典，读取或写入key时刷新其过期时间
+
+    所有key的过期时长相同，按最近访问顺序保存即按过期时间有序，最早过期的key在最前面：
+    - 读写均为O(1)，写入时从头部清理已过期的key，每个key只会被清理一次
+    - 设置max_size后，超出时淘汰最久未访问的key
+    - keys()/items()/values()/迭代不刷新过期时间
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None):
         self.expires_in_seconds = expires_in_seconds if expires_in_seconds else 3600
+        self.max_size = max_size
+        self._data = OrderedDict()  # key: (value, expiry_time)
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        while self._data:
+            key, (value, expiry_time) = next(iter(self._data.items()))
+            if expiry_time > now:
+                break
+            del self._data[key]
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        with self._lock:
+            value, expiry_time = self._data[key]
+            now = time.monotonic()
+            if now > expiry_time:
+                del self._data[key]
+                raise KeyError("expired {}".format(key))
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            return value
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            self._sweep(now)
+            if self.max_size:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
 
     def get(self, key, default=None):
         try:
@@ -31,12 +65,48 @@ class ExpiredDict(dict):
         except KeyError:
             return False
 
+    def _snapshot(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            return [(key, value) for key, (value, _) in self._data.items()]
+
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        return [key for key, _ in self._snapshot()]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        return self._snapshot()
+
+    def values(self):
+        return [value for _, value in self._snapshot()]
 
     def __iter__(self):
-        return self.keys().__iter__()
+        return iter(self.keys())
+
+    def __len__(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __repr__(self):
+        return "ExpiredDict({})".format(dict(self.items()))
+
+
+if __name__ == "__main__":
+    # 简单的性能测试: python -m common.expired_dict
+    n = 100000
+    d = ExpiredDict(3600, max_size=n)
+    start = time.perf_counter()
+    for i in range(n):
+        d[i] = i
+    print(f"set {n}: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    for i in range(n):
+        d.get(i)
+    print(f"get {n}: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    d.items()
+    print(f"scan {n}: {time.perf_counter() - start:.3f}s")
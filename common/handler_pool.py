@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import counter, gauge, histogram
+
+OVERFLOW_BLOCK = "block"  # 排队已满时阻塞等待
+OVERFLOW_REJECT = "reject"  # 排队已满时拒绝新任务
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 排队已满时丢弃最早排队且未开始执行的任务
+
+
+class HandlerPool(object):
+    """
+    带排队上限和运行指标的线程池，对ThreadPoolExecutor的封装
+
+    :param max_workers: 最大工作线程数
+    :param max_pending: 已提交但未开始执行的最大任务数，小于等于0表示不限制
+    :param overflow_policy: 排队已满时的策略，block/reject/drop_oldest
+    :param name: 指标中的pool标签，指定后导出handler_pool_*指标
+    """
+
+    def __init__(self, max_workers=8, max_pending=0, overflow_policy=OVERFLOW_BLOCK, name=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.initializer = None
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.overflow_policy = overflow_policy
+        self.cond = threading.Condition()
+        self.waiting = deque()  # 排队中的future，仅drop_oldest策略使用，已开始执行的会被惰性移除
+        self.pending = 0
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        if name:
+            gauge("handler_pool_active_workers", func=lambda: self.active, pool=name)
+            gauge("handler_pool_pending", func=lambda: self.pending, pool=name)
+            gauge("handler_pool_max_workers", pool=name).set(max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        提交任务，返回Future；排队已满且策略为reject，或drop_oldest没有可丢弃的任务时返回None
+        """
+        while True:
+            victim = None
+            with self.cond:
+                if self.max_pending <= 0 or self.pending < self.max_pending:
+                    # 线程池已关闭时抛出RuntimeError，此时不占用排队名额
+                    future = self.executor.submit(self._run, time.monotonic(), fn, args, kwargs)
+                    self.pending += 1
+                    self.submitted += 1
+                    self._count("submitted")
+                    future.add_done_callback(self._on_done)
+                    if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                        self.waiting.append(future)
+                        while self.waiting and not self._is_waiting(self.waiting[0]):
+                            self.waiting.popleft()
+                    break
+                if self.overflow_policy == OVERFLOW_BLOCK:
+                    self.cond.wait()
+                    continue
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    while self.waiting and victim is None:
+                        f = self.waiting.popleft()
+                        if self._is_waiting(f):
+                            victim = f
+                if victim is None:
+                    self.rejected += 1
+                    self._count("rejected")
+                    return None
+            # 在锁外取消，取消会同步触发future的回调
+            if victim.cancel():
+                with self.cond:
+                    self.dropped += 1
+                self._count("dropped")
+        return future
+
+    def _count(self, result):
+        if self.name:
+            counter("handler_pool_tasks_total", pool=self.name, result=result).inc()
+
+    @staticmethod
+    def _is_waiting(future):
+        return not future.running() and not future.done()
+
+    def _run(self, enqueue_time, fn, args, kwargs):
+        wait = time.monotonic() - enqueue_time
+        with self.cond:
+            self.pending -= 1
+            self.active += 1
+            self.wait_count += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.cond.notify()
+        if self.name:
+            histogram("handler_pool_wait_seconds", pool=self.name).observe(wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.cond:
+                self.active -= 1
+
+    def _on_done(self, future):
+        # 被取消的任务不会执行_run，需要在这里归还排队名额
+        if future.cancelled():
+            with self.cond:
+                self.pending -= 1
+                self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "wait_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+    def reset(self):
+        """
+        用新的线程池替换当前线程池，旧线程池中已提交的任务继续执行完
+
+        渠道断线重新登录时使用，此前的线程池可能已被关闭而无法再提交任务
+        """
+        with self.cond:
+            old_executor = self.executor
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+        old_executor.shutdown(wait=False)
+
+    def set_initializer(self, initializer):
+        """设置工作线程启动时执行的函数，对之后创建的工作线程生效"""
+        self.initializer = initializer
+        self.reset()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
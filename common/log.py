@@ -1,8 +1,54 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 
+LOG_FORMAT = "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
 
-def _reset_logger(log):
+# 异步模式下在后台线程写日志的监听器
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON，便于日志采集"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, LOG_DATEFMT),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _create_file_handler(log_file, rotate, max_bytes, backup_count, when):
+    if rotate == "size":
+        return logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    if rotate == "time":
+        return logging.handlers.TimedRotatingFileHandler(log_file, when=when, backupCount=backup_count, encoding="utf-8")
+    return logging.FileHandler(log_file, encoding="utf-8")
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _reset_logger(log, log_file="run.log", async_mode=False, rotate=None, max_bytes=10 * 1024 * 1024, backup_count=5,
+                  when="midnight", json_format=False):
+    _stop_listener()
     for handler in log.handlers:
         handler.close()
         log.removeHandler(handler)
@@ -10,21 +56,33 @@ def _reset_logger(log):
     log.handlers.clear()
     log.propagate = False
     console_handle = logging.StreamHandler(sys.stdout)
-    console_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    file_handle = logging.FileHandler("run.log", encoding="utf-8")
-    file_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
+    console_handle.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+    file_handle = _create_file_handler(log_file, rotate, max_bytes, backup_count, when)
+    file_handle.setFormatter(JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+    if not async_mode:
+        log.addHandler(file_handle)
+        log.addHandler(console_handle)
+        return
+    # 异步模式：业务线程只把日志放入无界队列，由监听线程写文件和控制台，避免磁盘IO阻塞消息处理
+    global _listener
+    log_queue = queue.SimpleQueue()
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, file_handle, console_handle, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_logger(config):
+    """按配置重新设置日志输出方式，加载配置后调用"""
+    _reset_logger(
+        logger,
+        log_file=config.get("log_file") or "run.log",
+        async_mode=config.get("log_async", False),
+        rotate=config.get("log_rotate"),
+        max_bytes=config.get("log_max_bytes", 10 * 1024 * 1024),
+        backup_count=config.get("log_backup_count", 5),
+        when=config.get("log_rotate_when", "midnight"),
+        json_format=config.get("log_json", False),
     )
-    log.addHandler(file_handle)
-    log.addHandler(console_handle)
 
 
 def _get_logger():
@@ -34,5 +92,6 @@ def _get_logger():
     return log
 
 
-# 日志句柄
+# 日志句柄，在hot path中使用延迟格式化：logger.debug("xxx: %s", obj)，避免日志级别关闭时仍然拼接字符串
 logger = _get_logger()
+atexit.register(_stop_listener)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common.log import logger
+from common.singleton import singleton
+from common.tmp_dir import TmpDir
+from config import conf, get_appdata_dir
+
+CHUNK_SIZE = 64 * 1024
+# 临时素材有效期为3天，提前半天失效，避免使用时刚好过期
+TEMP_MEDIA_TTL = 2.5 * 24 * 3600
+
+
+class DownloadedMedia(object):
+    """边下载边写入临时文件并计算sha256，不在内存中保存整个文件"""
+
+    def __init__(self, path, sha256, size):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except Exception:
+            pass
+
+
+def download_media(url, suffix="", timeout=(10, 60)):
+    path = TmpDir().path() + uuid.uuid4().hex + suffix
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as res:
+            res.raise_for_status()
+            with open(path, "wb") as f:
+                for block in res.iter_content(CHUNK_SIZE):
+                    f.write(block)
+                    digest.update(block)
+                    size += len(block)
+    except Exception:
+        # 下载或写入中途出错时删除已写入部分内容的临时文件，调用方拿不到路径无法清理
+        DownloadedMedia(path, None, size).remove()
+        raise
+    return DownloadedMedia(path, digest.hexdigest(), size)
+
+
+def file_sha256(file):
+    """计算文件路径或文件对象的sha256，文件对象读取后恢复原来的位置"""
+    digest = hashlib.sha256()
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    pos = file.tell()
+    file.seek(0)
+    for block in iter(lambda: file.read(CHUNK_SIZE), b""):
+        digest.update(block)
+    file.seek(pos)
+    return digest.hexdigest()
+
+
+def upload_concurrently(upload, items, max_workers=None):
+    """
+    并发上传多个互不依赖的分段，按items的顺序返回结果，任一分段失败时抛出异常
+
+    :param upload: 上传单个分段的函数
+    :param max_workers: 并发数，默认取media_upload_workers配置，受接口频率限制不宜过大
+    """
+    max_workers = max_workers or conf().get("media_upload_workers", 3)
+    if len(items) <= 1 or max_workers <= 1:
+        return [upload(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(upload, items))
+
+
+@singleton
+class MediaIdCache(object):
+    """
+    按(通道, 应用id, 内容sha256)缓存临时素材的media_id，同一个文件发送给多个用户时只上传一次
+
+    临时素材有效期为3天，缓存的media_id在有效期前失效；索引保存在appdata目录的media_id_cache.json中，重启后仍可复用
+    """
+
+    def __init__(self):
+        self.path = os.path.join(get_appdata_dir(), "media_id_cache.json")
+        self._cache = {}  # "channel:app_id:sha256": [media_id, expiry_time]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def _key(channel, app_id, sha256):
+        return "{}:{}:{}".format(channel, app_id, sha256)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            now = time.time()
+            self._cache = {key: item for key, item in cache.items() if item[1] > now}
+            logger.info("[media] media_id cache loaded, size=%s", len(self._cache))
+        except Exception as e:
+            logger.warning("[media] load media_id cache failed: %s", e)
+
+    def _save(self):
+        """写入临时文件后替换，清理已过期的media_id"""
+        with self._lock:
+            now = time.time()
+            self._cache = {key: item for key, item in self._cache.items() if item[1] > now}
+            data = json.dumps(self._cache, separators=(",", ":"))
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning("[media] save media_id cache failed: %s", e)
+
+    def get(self, channel, app_id, sha256):
+        key = self._key(channel, app_id, sha256)
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None and time.time() > item[1]:
+                del self._cache[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def put(self, channel, app_id, sha256, media_id, ttl=TEMP_MEDIA_TTL):
+        with self._lock:
+            self._cache[self._key(channel, app_id, sha256)] = [media_id, int(time.time() + ttl)]
+        self._save()
+
+    def get_or_upload(self, channel, app_id, sha256, upload):
+        """命中缓存时直接返回media_id，否则调用upload()上传并缓存其返回的media_id"""
+        media_id = self.get(channel, app_id, sha256)
+        if media_id:
+            logger.debug("[media] media_id cache hit, channel=%s, sha256=%s", channel, sha256)
+            return media_id
+        media_id = upload()
+        self.put(channel, app_id, sha256, media_id)
+        return media_id
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
@@ -0,0 +1,230 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.log import logger
+
+# 耗时直方图的桶上界(秒)，与Prometheus默认桶相近，覆盖插件的亚毫秒级耗时到模型调用的分钟级耗时
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram(object):
+    """
+    固定分桶的耗时直方图，记录一次耗时为O(log 桶数)，分位数按桶内线性插值估算
+
+    :param name: 指标名
+    :param labels: 标签，如{"plugin": "GODCMD", "event": "ON_HANDLE_CONTEXT"}
+    """
+
+    def __init__(self, name, labels=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶记录超过最大上界的耗时
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            max_value = self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else max_value
+                return min(max_value, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+        return max_value
+
+    def snapshot(self):
+        """返回count、sum、max和p50/p95/p99"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Counter(object):
+    """只增不减的计数器"""
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge(object):
+    """
+    可增可减的当前值，如队列长度、活跃线程数
+
+    指定func时每次读取都调用func获取当前值，适合导出已有对象的状态，不需要在变化时更新
+    """
+
+    def __init__(self, name, labels=None, func=None):
+        self.name = name
+        self.labels = labels or {}
+        self.func = func
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.func is not None:
+            try:
+                return self.func()
+            except Exception as e:
+                logger.warning("[metrics] read gauge %s failed: %s", self.name, e)
+                return 0
+        return self._value
+
+
+_histograms = {}  # (name, 排序后的标签): Histogram
+_histograms_lock = threading.Lock()
+_counters = {}  # (name, 排序后的标签): Counter
+_counters_lock = threading.Lock()
+_gauges = {}  # (name, 排序后的标签): Gauge
+_gauges_lock = threading.Lock()
+
+
+def histogram(name, **labels):
+    """获取指定指标名和标签的直方图，不存在时创建"""
+    key = (name, tuple(sorted(labels.items())))
+    hist = _histograms.get(key)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.get(key)
+            if hist is None:
+                hist = Histogram(name, labels)
+                _histograms[key] = hist
+    return hist
+
+
+def get_histograms(name=None):
+    """返回所有直方图，指定name时只返回该指标的直方图"""
+    return [hist for (hist_name, _), hist in list(_histograms.items()) if name is None or hist_name == name]
+
+
+def counter(name, **labels):
+    """获取指定指标名和标签的计数器，不存在时创建"""
+    key = (name, tuple(sorted(labels.items())))
+    c = _counters.get(key)
+    if c is None:
+        with _counters_lock:
+            c = _counters.get(key)
+            if c is None:
+                c = Counter(name, labels)
+                _counters[key] = c
+    return c
+
+
+def get_counters(name=None):
+    """返回所有计数器，指定name时只返回该指标的计数器"""
+    return [c for (counter_name, _), c in list(_counters.items()) if name is None or counter_name == name]
+
+
+def gauge(name, func=None, **labels):
+    """获取指定指标名和标签的gauge，不存在时创建；传入func时替换原有的取值函数"""
+    key = (name, tuple(sorted(labels.items())))
+    with _gauges_lock:
+        g = _gauges.get(key)
+        if g is None:
+            g = Gauge(name, labels, func)
+            _gauges[key] = g
+        elif func is not None:
+            g.func = func
+    return g
+
+
+def get_gauges(name=None):
+    """返回所有gauge，指定name时只返回该指标的gauge"""
+    return [g for (gauge_name, _), g in list(_gauges.items()) if name is None or gauge_name == name]
+
+
+def _format_labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+
+def render_prometheus():
+    """按Prometheus文本格式导出所有直方图、计数器和gauge"""
+    lines = []
+    typed = set()
+    for hist in sorted(get_histograms(), key=lambda h: h.name):
+        if hist.name not in typed:
+            lines.append(f"# TYPE {hist.name} histogram")
+            typed.add(hist.name)
+        with hist.lock:
+            counts = list(hist.counts)
+            total, hist_sum = hist.count, hist.sum
+        cumulative = 0
+        for upper, bucket_count in zip(hist.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{hist.name}_bucket{_format_labels(hist.labels, le=upper)} {cumulative}")
+        lines.append(f"{hist.name}_bucket{_format_labels(hist.labels, le='+Inf')} {total}")
+        lines.append(f"{hist.name}_sum{_format_labels(hist.labels)} {hist_sum}")
+        lines.append(f"{hist.name}_count{_format_labels(hist.labels)} {total}")
+    for c in sorted(get_counters(), key=lambda c: c.name):
+        if c.name not in typed:
+            lines.append(f"# TYPE {c.name} counter")
+            typed.add(c.name)
+        lines.append(f"{c.name}{_format_labels(c.labels)} {c.value}")
+    for g in sorted(get_gauges(), key=lambda g: g.name):
+        if g.name not in typed:
+            lines.append(f"# TYPE {g.name} gauge")
+            typed.add(g.name)
+        lines.append(f"{g.name}{_format_labels(g.labels)} {g.value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host="127.0.0.1", port=9464):
+    """在后台线程启动/metrics接口，供Prometheus抓取"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("[metrics] prometheus endpoint started at http://%s:%s/metrics", host, port)
+    return server
@@ -1,7 +1,16 @@
-import heapq
+import bisect
 
 
 class SortedDict(dict):
+    """
+    按sort_func(key, value)排序的字典，迭代、keys()、items()按排序值返回，排序值相同时按key排序
+
+    内部用有序列表保存(排序值, key)，并记录每个key当前的排序值：
+    - 插入、更新、删除时二分查找位置，不需要扫描和重新堆化
+    - 排序结果缓存到下次修改，连续迭代不重复计算
+    - value被原地修改导致排序值变化时，需要调用update_order(key)
+    """
+
     def __init__(self, sort_func=lambda k, v: k, init_dict=None, reverse=False):
         if init_dict is None:
             init_dict = []
@@ -10,56 +19,79 @@ class SortedDict(dict):
         self.sort_func = sort_func
         self.sorted_keys = None
         self.reverse = reverse
-        self.heap = []
+        self.entries = []  # (排序值, key)，升序
+        self.entry_of = {}  # key: 该key在entries中的(排序值, key)
         for k, v in init_dict:
             self[k] = v
 
+    def _insert_entry(self, key, entry):
+        bisect.insort(self.entries, entry)
+        self.entry_of[key] = entry
+        self.sorted_keys = None
+
+    def _remove_entry(self, key):
+        entry = self.entry_of.pop(key)
+        del self.entries[bisect.bisect_left(self.entries, entry)]
+        self.sorted_keys = None
+
     def __setitem__(self, key, value):
+        entry = (self.sort_func(key, value), key)
         if key in self:
-            super().__setitem__(key, value)
-            for i, (priority, k) in enumerate(self.heap):
-                if k == key:
-                    self.heap[i] = (self.sort_func(key, value), key)
-                    heapq.heapify(self.heap)
-                    break
-            self.sorted_keys = None
+            if self.entry_of[key] != entry:
+                self._remove_entry(key)
+                self._insert_entry(key, entry)
         else:
-            super().__setitem__(key, value)
-            heapq.heappush(self.heap, (self.sort_func(key, value), key))
-            self.sorted_keys = None
+            self._insert_entry(key, entry)
+        super().__setitem__(key, value)
 
     def __delitem__(self, key):
         super().__delitem__(key)
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                del self.heap[i]
-                heapq.heapify(self.heap)
-                break
-        self.sorted_keys = None
+        self._remove_entry(key)
 
     def keys(self):
         if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
+            sorted_keys = [k for _, k in self.entries]
+            if self.reverse:
+                sorted_keys.reverse()
+            self.sorted_keys = sorted_keys
         return self.sorted_keys
 
     def items(self):
-        if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
-        sorted_items = [(k, self[k]) for k in self.sorted_keys]
-        return sorted_items
-
-    def _update_heap(self, key):
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                new_priority = self.sort_func(key, self[key])
-                if new_priority != priority:
-                    self.heap[i] = (new_priority, key)
-                    heapq.heapify(self.heap)
-                    self.sorted_keys = None
-                break
+        return [(k, self[k]) for k in self.keys()]
+
+    def update_order(self, key):
+        """key对应的value被原地修改后，按新的排序值调整位置"""
+        entry = (self.sort_func(key, self[key]), key)
+        if self.entry_of[key] != entry:
+            self._remove_entry(key)
+            self._insert_entry(key, entry)
 
     def __iter__(self):
         return iter(self.keys())
 
     def __repr__(self):
         return f"{type(self).__name__}({dict(self)}, sort_func={self.sort_func.__name__}, reverse={self.reverse})"
+
+
+if __name__ == "__main__":
+    # 简单的性能测试: python -m common.sorted_dict
+    import random
+    import time
+
+    n = 10000
+    d = SortedDict(lambda k, v: v["priority"], reverse=True)
+    start = time.perf_counter()
+    for i in range(n):
+        d[f"plugin{i}"] = {"priority": random.randint(-1000, 1000)}
+    print(f"insert {n}: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    for i in range(n):
+        key = f"plugin{random.randrange(n)}"
+        d[key]["priority"] = random.randint(-1000, 1000)
+        d.update_order(key)
+    print(f"update priority {n}: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    for _ in range(n):
+        for _ in d:
+            break
+    print(f"iterate {n}: {time.perf_counter() - start:.3f}s")
@@ -1,39 +1,108 @@
 import threading
 import time
 
+from common.expired_dict import ExpiredDict
+
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
-        self.rate = int(tpm) / 60  # 令牌每秒生成速率
+    """
+    令牌桶，按距上次取令牌经过的时间计算补充的令牌数，不需要单独的令牌生成线程
+
+    :param tpm: 每分钟生成的令牌数
+    :param timeout: get_token等待令牌的超时时间，None表示一直等待
+    :param capacity: 令牌桶容量，默认等于tpm，初始时令牌桶是满的
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None):
+        self.rate = float(tpm) / 60  # 令牌每秒生成速率
+        self.capacity = float(capacity or tpm)  # 令牌桶容量
+        self.tokens = self.capacity
         self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, cost=1):
+        """
+        不等待地取cost个令牌，成功返回0，令牌不足时不扣减并返回还需等待的秒数
+
+        cost超过容量时按容量计算，避免永远取不到
+        """
+        cost = min(cost, self.capacity)
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0
+            return (cost - self.tokens) / self.rate
+
+    def refund(self, cost=1):
+        """归还try_acquire取到的令牌，用于多个限流器同时检查时后面的限流器拒绝了请求"""
+        cost = min(cost, self.capacity)
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + cost)
+
+    def acquire(self, cost=1, timeout=None):
+        """取cost个令牌，令牌不足时等待，超过timeout秒仍未取到返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(cost)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(wait)
 
     def get_token(self):
         """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
-                    return False
-            self.tokens -= 1
-        return True
+        return self.acquire(1, self.timeout)
 
     def close(self):
-        self.is_running = False
+        """没有后台线程需要停止，保留该方法兼容旧的调用"""
+        pass
+
+
+class KeyedTokenBucket:
+    """
+    按key(用户、群、模型等)分别限流的令牌桶集合，每个key互不影响
+
+    令牌桶在capacity/rate秒不使用后已经补满，此时丢弃和重新创建等价，因此使用ExpiredDict保存，空闲的key会被自动清理
+
+    :param tpm: 每个key每分钟生成的令牌数
+    :param capacity: 每个key的令牌桶容量，默认等于tpm
+    :param max_keys: 最多保存的key数量
+    """
+
+    def __init__(self, tpm, capacity=None, max_keys=None):
+        self.tpm = tpm
+        self.capacity = capacity or tpm
+        self.buckets = ExpiredDict(max(60.0, self.capacity * 60.0 / tpm), max_size=max_keys)
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.tpm, capacity=self.capacity)
+                    self.buckets[key] = bucket
+        return bucket
+
+    def try_acquire(self, key, cost=1):
+        """不等待地从key对应的令牌桶取cost个令牌，成功返回0，否则返回还需等待的秒数"""
+        return self.get_bucket(key).try_acquire(cost)
+
+    def refund(self, key, cost=1):
+        self.get_bucket(key).refund(cost)
+
+    def acquire(self, key, cost=1, timeout=None):
+        return self.get_bucket(key).acquire(cost, timeout)
 
 
 if __name__ == "__main__":
@@ -43,3 +112,7 @@ if __name__ == "__main__":
         if token_bucket.get_token():
             print(f"第{i+1}次请求成功")
     token_bucket.close()
+
+    limiter = KeyedTokenBucket(2)  # 每个群每分钟2次
+    for group in ["group_a", "group_a", "group_a", "group_b"]:
+        print(group, "ok" if limiter.try_acquire(group) == 0 else "limited")
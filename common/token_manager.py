@@ -0,0 +1,132 @@
+import threading
+import time
+
+import requests
+
+from common.log import logger
+from common.singleton import singleton
+
+# 剩余有效期少于该值(秒)时视为过期，同步获取新token
+EXPIRE_MARGIN = 60
+# 已使用有效期的该比例后，在后台提前刷新，期间仍返回旧token
+REFRESH_AHEAD_RATIO = 0.8
+
+
+class _TokenEntry(object):
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        self.refresh_at = 0.0
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()  # 同一个凭证同时只有一个线程在获取token
+        self.refreshing = False
+
+
+@singleton
+class TokenManager(object):
+    """
+    按凭证缓存access_token，各个接口共用
+
+    - 缓存的token在有效期内直接返回，不再请求鉴权接口
+    - 有效期用掉80%后由后台线程提前刷新，请求线程不等待
+    - 多个线程同时发现token过期时，只有一个线程请求鉴权接口，其他线程等待并复用其结果
+
+    fetch函数返回(token, 有效期秒数)，获取失败时抛出异常
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            with self.lock:
+                entry = self.entries.setdefault(key, _TokenEntry())
+        return entry
+
+    def get_token(self, key, fetch):
+        entry = self._entry(key)
+        now = time.monotonic()
+        token = entry.token
+        if token and now < entry.expires_at - EXPIRE_MARGIN:
+            if now >= entry.refresh_at:
+                self._refresh_in_background(key, entry, fetch)
+            return token
+        return self.refresh(key, fetch)
+
+    def refresh(self, key, fetch):
+        """
+        强制获取新token，用于接口返回token失效时；等待期间其他线程已经刷新过则直接使用其结果
+        """
+        entry = self._entry(key)
+        requested_at = time.monotonic()
+        with entry.lock:
+            if entry.token and entry.fetched_at >= requested_at:
+                return entry.token
+            token, expires_in = fetch()
+            now = time.monotonic()
+            entry.token = token
+            entry.fetched_at = now
+            entry.expires_at = now + expires_in
+            entry.refresh_at = now + expires_in * REFRESH_AHEAD_RATIO
+            logger.debug("[TokenManager] access token fetched, key=%s, expires_in=%s", key, expires_in)
+            return token
+
+    def invalidate(self, key):
+        entry = self._entry(key)
+        with entry.lock:
+            entry.token = None
+
+    def _refresh_in_background(self, key, entry, fetch):
+        with self.lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+
+        def run():
+            try:
+                self.refresh(key, fetch)
+            except Exception as e:
+                logger.warning("[TokenManager] refresh access token failed, key=%s, error=%s", key, e)
+            finally:
+                entry.refreshing = False
+
+        threading.Thread(target=run, name="token-refresh", daemon=True).start()
+
+
+class ManagedTokenClientMixin(object):
+    """
+    wechatpy客户端的access_token改由TokenManager缓存和刷新，用法：class XxxClient(ManagedTokenClientMixin, WeChatClient)
+
+    wechatpy在接口返回token失效时会调用fetch_access_token，此时强制刷新
+    """
+
+    @property
+    def access_token(self):
+        return TokenManager().get_token(self.access_token_key, self._request_access_token)
+
+    def fetch_access_token(self):
+        return TokenManager().refresh(self.access_token_key, self._request_access_token)
+
+    def _request_access_token(self):
+        result = super().fetch_access_token()
+        return result["access_token"], result.get("expires_in", 7200)
+
+
+def get_baidu_access_token(api_key, secret_key):
+    """百度智能云使用API Key和Secret Key获取access_token，有效期30天"""
+
+    def fetch():
+        url = "https://aip.baidubce.com/oauth/2.0/token"
+        params = {"grant_type": "client_credentials", "client_id": api_key, "client_secret": secret_key}
+        res = requests.post(url, params=params, timeout=(5, 10)).json()
+        if not res.get("access_token"):
+            raise Exception("get baidu access token failed: {}".format(res.get("error_description") or res))
+        return res["access_token"], res.get("expires_in", 2592000)
+
+    return TokenManager().get_token("baidu:" + str(api_key), fetch)
+
+
+def invalidate_baidu_access_token(api_key):
+    TokenManager().invalidate("baidu:" + str(api_key))
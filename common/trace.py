@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from common.metrics import get_histograms, histogram
+from config import conf
+
+STAGE_METRIC = "pipeline_stage_seconds"
+
+_recent_traces = deque(maxlen=100)  # 采样保存的最近的trace
+_recent_lock = threading.Lock()
+
+
+class Trace(object):
+    """
+    记录一条消息在处理流程中各阶段耗时的trace，挂在Context.trace上
+
+    - mark(stage): 顺序阶段，耗时为距上一个mark(或开始时间)的间隔，如compose、queue、generate、decorate、send
+    - span(stage)/record(stage, seconds): 嵌套在顺序阶段中的子步骤，如bot、asr、tts、send_attempt
+    - finish(): 各阶段耗时汇总到直方图，并按trace_sample_rate采样保存完整的trace
+    """
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.monotonic()
+        self.last = self.start
+        self.stages = []  # [(阶段名, 耗时)]
+        self.spans = []  # [(子步骤名, 耗时)]
+        self.finished = False
+
+    def mark(self, stage):
+        now = time.monotonic()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def record(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage):
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.record(stage, time.monotonic() - start)
+
+    def total(self):
+        return self.last - self.start
+
+    def finish(self):
+        """同一个trace只汇总一次"""
+        if self.finished:
+            return
+        self.finished = True
+        for stage, seconds in self.stages + self.spans:
+            histogram(STAGE_METRIC, stage=stage).observe(seconds)
+        histogram(STAGE_METRIC, stage="total").observe(self.total())
+        sample_rate = conf().get("trace_sample_rate", 0.01)
+        if sample_rate and random.random() < sample_rate:
+            with _recent_lock:
+                if _recent_traces.maxlen != conf().get("trace_buffer_size", 100):
+                    _resize_buffer(conf().get("trace_buffer_size", 100))
+                _recent_traces.append(self.to_dict())
+
+    def to_dict(self):
+        return {
+            "total": self.total(),
+            "stages": list(self.stages),
+            "spans": list(self.spans),
+        }
+
+
+def _resize_buffer(size):
+    global _recent_traces
+    _recent_traces = deque(_recent_traces, maxlen=max(1, size))
+
+
+def trace_span(context, stage):
+    """context带有trace时记录子步骤耗时，否则不做任何事"""
+    trace = getattr(context, "trace", None)
+    if trace is None:
+        return nullcontext()
+    return trace.span(stage)
+
+
+def trace_mark(context, stage):
+    trace = getattr(context, "trace", None)
+    if trace is not None:
+        trace.mark(stage)
+
+
+def get_recent_traces():
+    """最近采样的trace，最新的在最后"""
+    with _recent_lock:
+        return list(_recent_traces)
+
+
+def get_stage_stats():
+    """每个阶段的次数和耗时分位数(秒)"""
+    return {hist.labels["stage"]: hist.snapshot() for hist in get_histograms(STAGE_METRIC)}
@@ -0,0 +1,137 @@
+import functools
+import re
+import threading
+from collections import deque
+
+from config import conf
+
+
+class PrefixMatcher(object):
+    """
+    前缀匹配的字典树，与逐个startswith的结果一致：多个前缀都匹配时返回在列表中最靠前的一个
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = list(prefixes or [])
+        self.root = {}  # 字符: 子节点，子节点的None键保存以该节点结尾的前缀在列表中的最小下标
+        for index, prefix in enumerate(self.prefixes):
+            node = self.root
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            node.setdefault(None, index)
+
+    def match(self, content):
+        best = self.root.get(None)
+        node = self.root
+        for ch in content:
+            node = node.get(ch)
+            if node is None:
+                break
+            index = node.get(None)
+            if index is not None and (best is None or index < best):
+                best = index
+        return None if best is None else self.prefixes[best]
+
+
+class KeywordMatcher(object):
+    """
+    Aho-Corasick多关键词匹配，一次扫描判断内容是否包含任一关键词
+    """
+
+    def __init__(self, keywords):
+        keywords = [keyword for keyword in (keywords or []) if keyword is not None]
+        self.match_all = "" in keywords
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(False)
+                state = next_state
+            self.output[state] = True
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and ch not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(ch, 0)
+                self.output[next_state] = self.output[next_state] or self.output[self.fail[next_state]]
+        self.empty = len(self.goto) == 1 and not self.match_all
+
+    def contains(self, content):
+        if self.match_all:
+            return True
+        if self.empty:
+            return False
+        state = 0
+        for ch in content:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.output[state]:
+                return True
+        return False
+
+
+@functools.lru_cache(maxsize=1024)
+def mention_pattern(name):
+    """@某人后跟空格的正则，按名称缓存编译结果"""
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
+
+
+class TriggerIndex(object):
+    """
+    _compose_context用到的触发配置，加载配置时构建一次：名单使用集合查找，前缀和关键词使用预构建的匹配器
+    """
+
+    def __init__(self, config):
+        group_name_white_list = config.get("group_name_white_list", []) or []
+        self.all_group = "ALL_GROUP" in group_name_white_list
+        self.group_name_white_list = set(group_name_white_list)
+        self.group_name_keyword_white_list = KeywordMatcher(config.get("group_name_keyword_white_list", []))
+        group_chat_in_one_session = config.get("group_chat_in_one_session", []) or []
+        self.all_group_in_one_session = "ALL_GROUP" in group_chat_in_one_session
+        self.group_chat_in_one_session = set(group_chat_in_one_session)
+        self.nick_name_black_list = set(config.get("nick_name_black_list", []) or [])
+        self.group_chat_prefix = PrefixMatcher(config.get("group_chat_prefix"))
+        self.group_chat_keyword = KeywordMatcher(config.get("group_chat_keyword"))
+        self.single_chat_prefix = PrefixMatcher(config.get("single_chat_prefix", [""]))
+        self.image_create_prefix = PrefixMatcher(config.get("image_create_prefix", [""]))
+        self.group_at_off = config.get("group_at_off", False)
+        self.trigger_by_self = config.get("trigger_by_self", True)
+        self.always_reply_voice = config.get("always_reply_voice")
+        self.voice_reply_voice = config.get("voice_reply_voice")
+
+    def is_group_allowed(self, group_name):
+        return self.all_group or group_name in self.group_name_white_list or self.group_name_keyword_white_list.contains(group_name or "")
+
+    def is_group_in_one_session(self, group_name):
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session
+
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def get_trigger_index():
+    """返回当前配置对应的TriggerIndex，重新加载配置或修改配置项后自动重建"""
+    global _index, _index_key
+    config = conf()
+    key = (id(config), config.version)
+    if _index_key != key:
+        with _index_lock:
+            if _index_key != key:
+                _index = TriggerIndex(config)
+                _index_key = key
+    return _index
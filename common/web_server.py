@@ -0,0 +1,259 @@
+import asyncio
+import io
+import mimetypes
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import web
+
+from common.log import logger
+from config import conf
+
+FILE_CHUNK_SIZE = 64 * 1024
+# AsyncWSGIServer在environ中设置该标记，serve_file只返回X-Sendfile头，由aiohttp以sendfile发送文件
+SENDFILE_ENVIRON_KEY = "aiohttp.sendfile"
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def run_wsgi_app(wsgi_app, port, host="0.0.0.0", threads=None):
+    """
+    启动回调类渠道的http服务，阻塞直到服务停止
+
+    web_server_backend:
+    - webpy: web.py自带的cheroot线程池服务(默认)，指定threads时使用该线程数，否则与web.httpserver.runsimple相同
+    - aiohttp: 基于asyncio的服务，支持keep-alive、并发数限制和优雅退出；原有的web.py处理类不变，在线程池中执行
+    """
+    backend = conf().get("web_server_backend", "webpy")
+    if backend == "aiohttp":
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            logger.error("[web_server] aiohttp not installed, fall back to web.py server, run: pip install aiohttp")
+        else:
+            return AsyncWSGIServer(wsgi_app).run(host, port)
+    if not threads:
+        web.httpserver.runsimple(wsgi_app, (host, port))
+        return
+    # 与web.httpserver.runsimple相同，但可以设置线程数(runsimple固定为10)和更大的连接队列
+    from cheroot import wsgi
+
+    func = web.httpserver.LogMiddleware(web.httpserver.StaticMiddleware(wsgi_app))
+    server = wsgi.Server((host, port), func, numthreads=threads, request_queue_size=128, server_name="localhost")
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        server.stop()
+
+
+def parse_range(range_header, size):
+    """
+    解析单个区间的Range请求头，返回(起始位置, 结束位置)，均包含在内
+
+    没有Range头、格式无法识别或包含多个区间时返回None，按完整文件返回；区间超出文件范围时抛出ValueError
+    """
+    if not range_header:
+        return None
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-500 表示最后500字节
+        length = int(end)
+        if length == 0:
+            raise ValueError(range_header)
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(range_header)
+    return start, end
+
+
+def serve_file(path, chunk_size=FILE_CHUNK_SIZE):
+    """
+    在web.py处理函数中返回文件，用法：return serve_file(path)
+
+    - 设置Content-Type、Content-Length，支持Range请求(206/416)
+    - 按chunk_size分段读取，内存占用与文件大小无关
+    - 使用aiohttp服务时交给aiohttp以sendfile发送
+    """
+    size = os.path.getsize(path)
+    if web.ctx.env.get(SENDFILE_ENVIRON_KEY):
+        web.header("X-Sendfile", path)
+        return ""
+    web.header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+    web.header("Accept-Ranges", "bytes")
+    try:
+        byte_range = parse_range(web.ctx.env.get("HTTP_RANGE"), size)
+    except ValueError:
+        raise web.HTTPError("416 Range Not Satisfiable", {"Content-Range": f"bytes */{size}"}, "")
+    start, end = byte_range if byte_range else (0, size - 1)
+    if byte_range:
+        web.ctx.status = "206 Partial Content"
+        web.header("Content-Range", f"bytes {start}-{end}/{size}")
+    web.header("Content-Length", str(end - start + 1))
+    return _read_file(path, start, end - start + 1, chunk_size)
+
+
+def _read_file(path, offset, length, chunk_size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class AsyncWSGIServer(object):
+    """
+    用aiohttp承载WSGI应用(web.py的app.wsgifunc())
+
+    - 连接的建立、keep-alive和请求体的读取都在事件循环中完成，不占用线程
+    - 最多web_server_max_concurrency个请求同时执行处理函数，其余请求在事件循环中排队等待
+    - 响应类型为text/event-stream时逐段推送，推送期间不计入并发数；其他响应读取完整后一次性返回
+    - 退出时(app.py的信号处理函数抛出SystemExit)不再接受新连接，等待进行中的请求最多web_server_shutdown_timeout秒
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.max_concurrency = conf().get("web_server_max_concurrency", 64)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="wsgi-handler")
+        # 流式响应的每个连接在等待下一段数据时占用一个线程
+        self.stream_executor = ThreadPoolExecutor(max_workers=conf().get("web_server_threads", 200), thread_name_prefix="wsgi-stream")
+        self.semaphore = None
+
+    def make_app(self):
+        from aiohttp import web as aio_web
+
+        async def on_startup(app):
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def on_cleanup(app):
+            self.executor.shutdown(wait=False)
+            self.stream_executor.shutdown(wait=False)
+
+        app = aio_web.Application(client_max_size=conf().get("web_server_max_body_size", 20 * 1024 * 1024))
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+    def run(self, host, port):
+        from aiohttp import web as aio_web
+
+        logger.info("[web_server] aiohttp server started at http://%s:%s", host, port)
+        aio_web.run_app(
+            self.make_app(),
+            host=host,
+            port=port,
+            shutdown_timeout=conf().get("web_server_shutdown_timeout", 10),
+            keepalive_timeout=conf().get("web_server_keepalive_timeout", 75),
+            handle_signals=False,
+            access_log=None,
+            print=None,
+        )
+
+    def build_environ(self, request, body):
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(request.path, "latin-1"),
+            "QUERY_STRING": request.query_string,
+            "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+            "CONTENT_LENGTH": str(len(body)),
+            "SERVER_NAME": request.url.host or "localhost",
+            "SERVER_PORT": str(request.url.port or ""),
+            "SERVER_PROTOCOL": "HTTP/%d.%d" % request.version,
+            "REMOTE_ADDR": request.remote or "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": request.scheme,
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            SENDFILE_ENVIRON_KEY: True,
+        }
+        for name, value in request.headers.items():
+            key = "HTTP_" + name.upper().replace("-", "_")
+            if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+                continue
+            environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    def call_wsgi(self, environ):
+        """在线程池中执行WSGI应用，非流式响应读取完整的响应体；流式响应返回迭代器由调用方继续读取"""
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+            return written.append
+
+        result = self.wsgi_app(environ, start_response)
+        headers = response.get("headers", [])
+        sendfile = next((v for k, v in headers if k.lower() == "x-sendfile"), None)
+        if sendfile:
+            if hasattr(result, "close"):
+                result.close()
+            return response["status"], headers, sendfile, None
+        streaming = any(k.lower() == "content-type" and v.startswith("text/event-stream") for k, v in headers)
+        if streaming:
+            return response["status"], headers, written, result
+        try:
+            body = b"".join(written) + b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], headers, [body], None
+
+    async def handle(self, request):
+        from aiohttp import web as aio_web
+
+        body = await request.read()
+        environ = self.build_environ(request, body)
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            status, headers, chunks, stream = await loop.run_in_executor(self.executor, self.call_wsgi, environ)
+        if isinstance(chunks, str):
+            # serve_file返回的文件，由aiohttp处理Range等请求头并以sendfile发送
+            return aio_web.FileResponse(chunks, chunk_size=FILE_CHUNK_SIZE)
+        code, _, reason = status.partition(" ")
+        # 连接相关的头由aiohttp处理
+        headers = [(k, v) for k, v in headers if k.lower() not in ("connection", "content-length", "transfer-encoding")]
+        if stream is None:
+            return aio_web.Response(status=int(code), reason=reason or None, headers=headers, body=chunks[0])
+
+        response = aio_web.StreamResponse(status=int(code), reason=reason or None, headers=headers)
+        await response.prepare(request)
+        iterator = iter(stream)
+        pending = None
+        try:
+            for chunk in chunks:
+                await response.write(chunk)
+            while True:
+                pending = self.stream_executor.submit(next, iterator, None)
+                chunk = await asyncio.wrap_future(pending)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+        except ConnectionResetError:
+            logger.debug("[web_server] client disconnected: %s", request.path)
+        finally:
+            if hasattr(stream, "close"):
+                # 连接断开时迭代器可能仍在线程中阻塞，等这一次读取结束后再关闭，触发其中的清理逻辑
+                if pending is not None and not pending.done():
+                    pending.add_done_callback(lambda _: stream.close())
+                else:
+                    stream.close()
+        return response
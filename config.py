@@ -6,7 +6,7 @@ import os
 import pickle
 import copy
 
-from common.log import logger
+from common.log import logger, setup_logger
 
 # 将所有可用的配置项写在字典里, 请使用小写字母
 # 此处的配置值无实际意义，程序不会读取此处的配置，仅用于提示格式，请将配置加入到config.json中
@@ -56,18 +56,30 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "handler_pool_size": 8,  # 处理消息的线程池大小
+    "handler_pool_channel_sizes": {},  # 按通道类型单独设置线程池大小，如 {"gewechat": 16}，未设置的通道使用handler_pool_size
+    "handler_pool_max_pending": 0,  # 线程池中最多排队等待执行的消息数，0表示不限制
+    "handler_pool_overflow_policy": "block",  # 排队已满时的策略: block(等待空闲线程)/reject(拒绝并回复handler_pool_reject_reply)/drop_oldest(丢弃最早排队的消息)
+    "handler_pool_reject_reply": "当前消息较多，请稍后再试~",  # 排队已满被拒绝时回复给用户的消息
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
     "accept_friend_msg": "",  # 接受好友请求后发送的消息
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "max_sessions": 0,  # 最多保留的会话数，超出时淘汰最久未使用的会话，0表示不限制，需配置expires_in_seconds
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
     # chatgpt限流配置
     "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
+    # 对话模型按key限流，避免个别用户或群占满所有调用额度，0表示不限制
+    "rate_limit_user": 0,  # 每个用户每分钟最多提问次数
+    "rate_limit_group": 0,  # 每个群每分钟最多提问次数
+    "rate_limit_model_tpm": 0,  # 每个模型每分钟最多处理的提问字符数，按提问长度扣减
+    "rate_limit_max_keys": 10000,  # 最多保存的限流key数量，超出时淘汰最久未使用的
+    "rate_limit_reply": "提问太快啦，请休息一下再问我吧",  # 触发限流时的回复
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
     "top_p": 1,
@@ -86,6 +98,8 @@ available_setting = {
     "xunfei_api_secret": "",  # 讯飞 API secret
     "xunfei_domain": "",  # 讯飞模型对应的domain参数，Spark4.0 Ultra为 4.0Ultra，其他模型详见: https://www.xfyun.cn/doc/spark/Web.html
     "xunfei_spark_url": "",  # 讯飞模型对应的请求地址，Spark4.0 Ultra为 wss://spark-api.xf-yun.com/v4.0/chat，其他模型参考详见: https://www.xfyun.cn/doc/spark/Web.html
+    "xunfei_max_connections": 8,  # 讯飞同时打开的websocket连接数上限
+    "xunfei_timeout": 30,  # 讯飞建立连接、等待下一段回复和等待空闲连接的超时时间(秒)
     # claude 配置
     "claude_api_cookie": "",
     "claude_uuid": "",
@@ -107,12 +121,28 @@ available_setting = {
     "dify_app_type": "chatbot", # dify助手类型 chatbot(对应聊天助手或对话流)/agent(对应Agent)/workflow(对应工作流，则默认为chatbot
     "dify_conversation_max_messages": 5, # dify目前不支持设置历史消息长度，暂时使用超过最大消息数清空会话的策略，缺点是没有滑动窗口，会突然丢失历史消息，当设置的值小于等于0，则不限制历史消息长度
     "dify_error_reply": "", # dify bot错误时给用户的回复
+    "dify_pool_size": 10,  # 每组dify_api_base和dify_api_key共享的长连接池大小
+    "dify_keep_alive": True,  # 是否复用dify api的连接
+    "dify_connect_timeout": 10,  # dify api建立连接的超时时间，单位秒
+    "dify_read_timeout": 300,  # dify api读取响应的超时时间，单位秒
+    "dify_max_retries": 2,  # dify api连接失败或幂等请求返回5xx时的重试次数，重试间隔指数退避
+    "dify_stream_reply": False,  # 是否使用流式回复，开启后边生成边按句子/段落分段发送，适用于chatbot、chatflow、agent
+    "dify_stream_min_chars": 60,  # 流式回复时累积多少字后分段发送
+    "dify_stream_flush_interval": 3,  # 流式回复时距上次发送超过多少秒后分段发送
     "failover_model": "gpt-3.5-turbo", # dify bot错误时使用的备用模型
     "failover_api_key": "", # dify bot错误时使用的备用API密钥，如果为空则使用open_ai_api_key
     "failover_api_base": "", # dify bot错误时使用的备用API基础URL，如果为空则使用open_ai_api_base
     "deepsearch_model": "sonar-deep-research", # dify bot深度搜索使用的模型 
     "deepsearch_api_key": "", # 深度搜索使用的API key，如果为空则使用open_ai_api_key
     "deepsearch_api_base": "", # 深度搜索使用的API base，如果为空则使用open_ai_api_base
+    # 熔断配置，开启后dify及对话模型在错误率或p95耗时超过阈值时熔断，熔断期间直接使用failover_model回复
+    "circuit_breaker_enabled": False,
+    "circuit_breaker_window": 20,  # 统计最近多少次请求
+    "circuit_breaker_min_requests": 5,  # 窗口内请求数达到该值才判断是否熔断
+    "circuit_breaker_error_rate": 0.5,  # 错误率达到该值时熔断
+    "circuit_breaker_p95_latency": 0,  # p95耗时超过该值(秒)时熔断，0表示不按耗时熔断
+    "circuit_breaker_open_seconds": 30,  # 熔断持续时间(秒)，之后放行探测请求
+    "circuit_breaker_half_open_probes": 1,  # 熔断恢复前需要成功的探测请求数
     # coze配置
     "coze_api_base": "https://api.coze.cn",
     "coze_api_key": "xxx",
@@ -162,6 +192,7 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "media_upload_workers": 3,  # 公众号/企业微信并发上传语音分段等素材的线程数，受接口频率限制不宜过大
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
     # wechatcomapp的配置
@@ -186,6 +217,12 @@ available_setting = {
     "gewechat_token": "",
     "gewechat_app_id": "",
     "gewechat_callback_url": "", # 回调地址，示例：http://172.17.0.1:9919/v2/api/callback/collect
+    "gewechat_contact_cache_ttl": 600,  # 联系人/群成员缓存的过期时间，单位秒
+    "gewechat_contact_cache_max_size": 1000,  # 联系人/群成员缓存的最大条目数
+    "gewechat_member_miss_ttl": 60,  # 拉取群成员列表后仍找不到的成员，在该时间内不再重新拉取，单位秒
+    "gewechat_async_ingest": False,  # 是否开启异步接收，开启后回调请求只做轻量校验即返回，消息解析交给后台线程
+    "gewechat_ingest_workers": 2,  # 异步接收的后台线程数，按会话分配，同一会话的消息由同一个线程按顺序处理
+    "gewechat_ingest_queue_size": 1000,  # 异步接收队列的总长度，平分给各个后台线程，队列满时回调请求等待(背压)
     
     # chatgpt指令自定义触发词
     "clear_memory_commands": ["#清除记忆"],  # 重置会话指令，必须以#开头
@@ -193,6 +230,17 @@ available_setting = {
     "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    "log_file": "run.log",  # 日志文件路径
+    "log_async": False,  # 是否异步写日志，开启后由后台线程写文件和控制台，日志IO不阻塞消息处理线程
+    "log_rotate": "",  # 日志切分方式，size按大小切分，time按时间切分，为空不切分
+    "log_max_bytes": 10485760,  # 按大小切分时单个日志文件的最大字节数
+    "log_rotate_when": "midnight",  # 按时间切分时的切分周期，同TimedRotatingFileHandler的when参数
+    "log_backup_count": 5,  # 切分后保留的日志文件数
+    "log_json": False,  # 日志文件是否使用JSON Lines格式
+    "metrics_port": 0,  # Prometheus指标接口端口，开启后可访问http://metrics_host:metrics_port/metrics，0表示不开启
+    "metrics_host": "127.0.0.1",  # Prometheus指标接口监听地址
+    "trace_sample_rate": 0.01,  # 消息处理流程trace的采样比例，各阶段耗时始终汇总到直方图，采样的完整trace保存在内存中
+    "trace_buffer_size": 100,  # 最多保存的采样trace数量
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
@@ -214,12 +262,24 @@ available_setting = {
     "Minimax_group_id": "",
     "Minimax_base_url": "",
     "web_port": 9899,
+    "web_server_threads": 200,  # web渠道的工作线程数，每个SSE连接占用一个线程，即同时在线的浏览器数上限
+    "web_server_backend": "webpy",  # 回调类渠道(gewechat、公众号、企业微信、飞书、web)的http服务: webpy 线程池服务, aiohttp 异步服务(需安装aiohttp)
+    "web_server_max_concurrency": 64,  # aiohttp服务同时执行的请求数上限，超出的请求排队等待
+    "web_server_keepalive_timeout": 75,  # aiohttp服务keep-alive连接的空闲超时时间(秒)
+    "web_server_shutdown_timeout": 10,  # aiohttp服务退出时等待进行中请求的最长时间(秒)
+    "web_server_max_body_size": 20971520,  # aiohttp服务允许的请求体大小上限(字节)
+    "web_sse_heartbeat_interval": 15,  # web渠道SSE连接空闲时发送心跳的间隔(秒)
+    "web_sse_queue_size": 100,  # web渠道每个用户待推送消息队列的长度上限
+    "web_sse_drop_policy": "drop_oldest",  # 队列已满时的处理: drop_oldest 丢弃最早的消息, drop_newest 丢弃新消息
+    "web_sse_queue_ttl": 300,  # 用户断开后未推送的消息保留时间(秒)，超时未重连则清理其队列
 }
 
 
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        # 每次修改配置项时递增，用于判断基于配置构建的缓存是否需要重建
+        self.version = 0
         if d is None:
             d = {}
         for k, v in d.items():
@@ -235,6 +295,7 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self.version += 1
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
@@ -333,6 +394,7 @@ def load_config():
                 else:
                     config[name] = value
 
+    setup_logger(config)
     if config.get("debug", False):
         logger.setLevel(logging.DEBUG)
         logger.debug("[INIT] set log level to DEBUG")
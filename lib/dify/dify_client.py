@@ -1,10 +1,115 @@
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from common.circuit_breaker import CircuitOpenError
+
+# 记录当前线程最近一次新建连接(含TLS握手)的耗时，复用连接时为0
+_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        _timing.connect = time.monotonic() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        _timing.connect = time.monotonic() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(api_key, base_url, pool_size=10, max_retries=2, backoff_factor=0.5):
+    """
+    获取(base_url, api_key)对应的长连接会话，同一组配置在进程内共享一个连接池
+
+    只对幂等请求(GET/HEAD/OPTIONS)在5xx、429时重试；连接建立失败时请求尚未发出，任何方法都会重试
+    """
+    key = (base_url, api_key)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            retry = Retry(
+                total=max_retries,
+                connect=max_retries,
+                read=max_retries,
+                status=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+                raise_on_status=False,
+            )
+            adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
 
 
 class DifyClient:
-    def __init__(self, api_key, base_url: str = 'https://api.dify.ai/v1'):
+    def __init__(self, api_key, base_url: str = 'https://api.dify.ai/v1', connect_timeout=10, read_timeout=None,
+                 pool_size=10, max_retries=2, keep_alive=True, breaker=None):
         self.api_key = api_key
         self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        # 熔断器，需提供allow_request()和record(success, latency)，打开时请求抛出CircuitOpenError
+        self.breaker = breaker
+        self.session = get_session(api_key, base_url, pool_size=pool_size, max_retries=max_retries)
+
+    def _request(self, method, url, headers, stream=False, **kwargs):
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+        if self.breaker and not self.breaker.allow_request():
+            raise CircuitOpenError(self.breaker.name)
+        _timing.connect = 0.0
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, headers=headers, stream=stream, timeout=self.timeout, **kwargs)
+        except Exception:
+            if self.breaker:
+                self.breaker.record(False, time.monotonic() - start)
+            raise
+        # connect: 新建连接耗时, ttfb: 发出请求到收到响应头, total: 非流式请求读取完响应体的总耗时，流式请求为收到响应头的耗时
+        response.timing = {
+            "connect": _timing.connect,
+            "ttfb": response.elapsed.total_seconds(),
+            "total": time.monotonic() - start,
+        }
+        if self.breaker:
+            # 4xx是请求本身的问题，不计入后端错误
+            self.breaker.record(response.status_code < 500 and response.status_code != 429, response.timing["total"])
+        return response
 
     def _send_request(self, method, endpoint, json=None, params=None, stream=False):
         headers = {
@@ -13,7 +118,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, json=json, params=params, headers=headers, stream=stream)
+        response = self._request(method, url, headers, json=json, params=params, stream=stream)
 
         return response
 
@@ -23,7 +128,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, data=data, headers=headers, files=files)
+        response = self._request(method, url, headers, data=data, files=files)
 
         return response
 
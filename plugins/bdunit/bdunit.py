@@ -10,6 +10,7 @@ import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.token_manager import get_baidu_access_token
 from plugins import *
 
 """利用百度UNIT实现智能对话
@@ -35,7 +36,7 @@ class BDunit(Plugin):
             self.service_id = conf["service_id"]
             self.api_key = conf["api_key"]
             self.secret_key = conf["secret_key"]
-            self.access_token = self.get_token()
+            self.get_token()  # 初始化时先获取一次，校验配置是否正确
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[BDunit] inited")
         except Exception as e:
@@ -65,20 +66,13 @@ class BDunit(Plugin):
         return help_text
 
     def get_token(self):
-        """获取访问百度UUNIT 的access_token
+        """获取访问百度UUNIT 的access_token，有效期内使用缓存
         #param api_key: UNIT apk_key
         #param secret_key: UNIT secret_key
         Returns:
             string: access_token
         """
-        url = "https://aip.baidubce.com/oauth/2.0/token?client_id={}&client_secret={}&grant_type=client_credentials".format(self.api_key, self.secret_key)
-        payload = ""
-        headers = {"Content-Type": "application/json", "Accept": "application/json"}
-
-        response = requests.request("POST", url, headers=headers, data=payload)
-
-        # print(response.text)
-        return response.json()["access_token"]
+        return get_baidu_access_token(self.api_key, self.secret_key)
 
     def getUnit(self, query):
         """
@@ -87,7 +81,7 @@ class BDunit(Plugin):
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
 
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + self.access_token
+        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + self.get_token()
         request = {
             "query": query,
             "user_id": str(get_mac())[:32],
@@ -114,7 +108,7 @@ class BDunit(Plugin):
         :param query: 用户的指令字符串
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat?access_token=" + self.access_token
+        url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat?access_token=" + self.get_token()
         request = {"query": query, "user_id": str(get_mac())[:32]}
         body = {
             "log_id": str(uuid.uuid1()),
@@ -34,9 +34,9 @@ class EventAction(Enum):
 
 
 class EventContext:
-    def __init__(self, event, econtext=dict()):
+    def __init__(self, event, econtext=None):
         self.event = event
-        self.econtext = econtext
+        self.econtext = econtext if econtext is not None else {}
         self.action = EventAction.CONTINUE
 
     def __getitem__(self, key):
@@ -13,6 +13,8 @@ from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
+from common.circuit_breaker import get_all_stats
+from common.trace import get_stage_stats
 from config import conf, load_config, global_config
 from plugins import *
 
@@ -131,6 +133,18 @@ ADMIN_COMMANDS = {
         "alias": ["debug", "调试模式", "DEBUG"],
         "desc": "开启机器调试日志",
     },
+    "pstats": {
+        "alias": ["pstats", "插件统计"],
+        "desc": "查看插件的调用耗时、异常和中断统计",
+    },
+    "tstats": {
+        "alias": ["tstats", "流程耗时"],
+        "desc": "查看消息处理流程各阶段的耗时统计",
+    },
+    "cbstats": {
+        "alias": ["cbstats", "熔断状态"],
+        "desc": "查看各后端熔断器的状态和状态变化次数",
+    },
 }
 
 
@@ -362,6 +376,41 @@ class Godcmd(Plugin):
                                     result += "已启用\n"
                                 else:
                                     result += "未启用\n"
+                        elif cmd == "pstats":
+                            stats = PluginManager().get_plugin_stats()
+                            ok = True
+                            if not stats:
+                                result = "暂无插件调用统计"
+                            else:
+                                result = "插件统计(耗时单位ms)：\n"
+                                for item in stats:
+                                    result += (
+                                        f"{item['plugin']} {item['event']}: 次数{item['count']} "
+                                        f"p50={item['p50'] * 1000:.1f} p95={item['p95'] * 1000:.1f} p99={item['p99'] * 1000:.1f} "
+                                        f"异常{item['errors']} 中断{item['break_rate']:.0%}/{item['break_pass_rate']:.0%}\n"
+                                    )
+                        elif cmd == "tstats":
+                            stats = get_stage_stats()
+                            ok = True
+                            if not stats:
+                                result = "暂无消息处理流程统计"
+                            else:
+                                result = "流程耗时(单位ms)：\n"
+                                for stage, item in stats.items():
+                                    result += f"{stage}: 次数{item['count']} p50={item['p50'] * 1000:.1f} p95={item['p95'] * 1000:.1f} p99={item['p99'] * 1000:.1f}\n"
+                        elif cmd == "cbstats":
+                            stats = get_all_stats()
+                            ok = True
+                            if not stats:
+                                result = "暂无熔断器统计，请确认已开启circuit_breaker_enabled"
+                            else:
+                                result = "熔断器状态：\n"
+                                for name, item in stats.items():
+                                    transitions = ", ".join(f"{k}:{v}" for k, v in item["transitions"].items()) or "无"
+                                    result += (
+                                        f"{name}: {item['state']} 请求{item['requests']} 错误率{item['error_rate']:.0%} "
+                                        f"p95={item['p95_latency'] * 1000:.0f}ms 拒绝{item['rejected']} 状态变化[{transitions}]\n"
+                                    )
                         elif cmd == "scanp":
                             new_plugins = PluginManager().scan_plugins()
                             ok, result = True, "插件扫描完成"
@@ -5,8 +5,10 @@ import importlib.util
 import json
 import os
 import sys
+import time
 
 from common.log import logger
+from common.metrics import counter, get_counters, get_histograms, histogram
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
 from config import conf, remove_plugin_config, write_plugin_config
@@ -19,6 +21,7 @@ class PluginManager:
     def __init__(self):
         self.plugins = SortedDict(lambda k, v: v.priority, reverse=True)
         self.listening_plugins = {}
+        self.handler_chains = {}  # event: [(插件名, 处理函数, 耗时直方图)]，按优先级排列，只包含已开启的插件
         self.instances = {}
         self.pconf = {}
         self.current_plugin_path = None
@@ -128,14 +131,34 @@ class PluginManager:
             else:
                 self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
                 self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
-                self.plugins._update_heap(name)  # 更新下plugins中的顺序
+                self.plugins.update_order(name)  # 更新下plugins中的顺序
         if modified:
             self.save_config()
+        self.rebuild_handler_chains()
         return new_plugins
 
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.rebuild_handler_chains()
+
+    def rebuild_handler_chains(self):
+        """
+        按当前的优先级和开关状态生成每个事件的处理链，插件开启、关闭、重载或调整优先级后调用
+        emit_event只遍历处理链，不再逐个查找插件状态、实例和处理函数
+        """
+        handler_chains = {}
+        for event, names in self.listening_plugins.items():
+            chain = []
+            for name in names:
+                if name not in self.plugins or not self.plugins[name].enabled or name not in self.instances:
+                    continue
+                handler = self.instances[name].handlers.get(event)
+                if handler is None:
+                    continue
+                chain.append((name, handler, histogram("plugin_handler_seconds", plugin=name, event=event.name)))
+            handler_chains[event] = chain
+        self.handler_chains = handler_chains
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -158,7 +181,8 @@ class PluginManager:
                 for event in instance.handlers:
                     if event not in self.listening_plugins:
                         self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
+                    if name not in self.listening_plugins[event]:
+                        self.listening_plugins[event].append(name)
         self.refresh_order()
         return failed_plugins
 
@@ -189,17 +213,54 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        for name, handler, hist in self.handler_chains.get(e_context.event, ()):
+            if e_context.action != EventAction.CONTINUE:
+                break
+            logger.debug("Plugin %s triggered by event %s", name, e_context.event)
+            start = time.perf_counter()
+            try:
+                handler(e_context, *args, **kwargs)
+            except Exception:
+                counter("plugin_handler_errors_total", plugin=name, event=e_context.event.name).inc()
+                raise
+            finally:
+                hist.observe(time.perf_counter() - start)
+            if e_context.is_break():
+                counter("plugin_handler_breaks_total", plugin=name, event=e_context.event.name, action=e_context.action.name).inc()
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s", name, e_context.event)
         return e_context
 
+    def get_plugin_stats(self):
+        """
+        每个插件处理每种事件的调用次数、耗时分位数(秒)、异常次数和中断比例，按p95耗时从高到低排列
+        """
+        errors = {(c.labels["plugin"], c.labels["event"]): c.value for c in get_counters("plugin_handler_errors_total")}
+        breaks = {}
+        for c in get_counters("plugin_handler_breaks_total"):
+            key = (c.labels["plugin"], c.labels["event"])
+            breaks.setdefault(key, {})[c.labels["action"]] = c.value
+        stats = []
+        for hist in get_histograms("plugin_handler_seconds"):
+            key = (hist.labels["plugin"], hist.labels["event"])
+            snapshot = hist.snapshot()
+            if snapshot["count"] == 0:
+                continue
+            break_counts = breaks.get(key, {})
+            stats.append({
+                "plugin": key[0],
+                "event": key[1],
+                "count": snapshot["count"],
+                "p50": snapshot["p50"],
+                "p95": snapshot["p95"],
+                "p99": snapshot["p99"],
+                "errors": errors.get(key, 0),
+                "break_rate": break_counts.get(EventAction.BREAK.name, 0) / snapshot["count"],
+                "break_pass_rate": break_counts.get(EventAction.BREAK_PASS.name, 0) / snapshot["count"],
+            })
+        stats.sort(key=lambda item: item["p95"], reverse=True)
+        return stats
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -207,10 +268,10 @@ class PluginManager:
         if self.plugins[name].priority == priority:
             return True
         self.plugins[name].priority = priority
-        self.plugins._update_heap(name)
+        self.plugins.update_order(name)
         rawname = self.plugins[name].name
         self.pconf["plugins"][rawname]["priority"] = priority
-        self.pconf["plugins"]._update_heap(rawname)
+        self.pconf["plugins"].update_order(rawname)
         self.save_config()
         self.refresh_order()
         return True
@@ -239,6 +300,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.rebuild_handler_chains()
             return True
         return True
 
@@ -337,6 +399,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.rebuild_handler_chains()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()